@@ -0,0 +1,257 @@
+﻿"""
+History coverage audit over every candle source we have.
+
+Sources (any mix):
+  --csv DIR|FILE      exported / training CSVs (symbol, tf, time columns)
+  --parquet DIR|FILE  same columns in Parquet
+  --store DIR         local candle store (candle_store.py)
+  --live URL          Node /candles endpoint, for --symbols x --tfs
+
+Per (symbol, tf) it reports count, oldest/newest, span, duplicate bars,
+out-of-order bars, gaps (missing expected bar times, weekend-aware) and a
+readiness status against the bars the models need. Everything is numpy
+over int64 epoch arrays, so the cost is dominated by reading the source.
+
+  python candle_audit.py --store ../data/candles --out ../candle_audit.csv
+  python candle_audit.py --live http://127.0.0.1:8080/candles --require   # exit 1 if not ready
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+TF_SEC = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "4h": 14400, "1d": 86400}
+
+# bars each model reads (ict_1m: 256, ict_5m: 128, smc_*: 60)
+MIN_BARS = {"1m": 256, "5m": 128, "15m": 60, "30m": 60}
+DEFAULT_MIN_BARS = 60
+
+# 24/7 symbols; everything else follows the FX week
+CRYPTO = {"BTCUSD", "ETHUSD"}
+
+DEFAULT_SYMBOLS = ["XAUUSD", "XAGUSD", "BTCUSD", "ETHUSD", "EURUSD"]
+
+# FX/metals weekly closure, seconds since Monday 00:00 (server time)
+WEEK = 7 * 86400
+CLOSE_FROM = 4 * 86400 + 21 * 3600     # Fri 21:00
+CLOSE_TO = 6 * 86400 + 22 * 3600       # Sun 22:00
+
+def _week_pos(t: np.ndarray) -> np.ndarray:
+    # 1970-01-01 was a Thursday
+    return (t + 3 * 86400) % WEEK
+
+def _closed_before(t: np.ndarray) -> np.ndarray:
+    """Closed-market seconds in [epoch, t)."""
+    weeks = (t + 3 * 86400) // WEEK
+    return weeks * (CLOSE_TO - CLOSE_FROM) + np.clip(_week_pos(t) - CLOSE_FROM, 0, CLOSE_TO - CLOSE_FROM)
+
+def open_seconds(a: np.ndarray, b: np.ndarray, symbol: Optional[str] = None) -> np.ndarray:
+    """Trading seconds in [a, b) for `symbol`'s session."""
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    span = np.maximum(b - a, 0)
+    if symbol is not None and symbol.upper() in CRYPTO:
+        return span
+    return np.maximum(span - (_closed_before(b) - _closed_before(a)), 0)
+
+def audit_times(times: np.ndarray, tf: str, symbol: Optional[str] = None,
+                min_bars: Optional[int] = None) -> Dict[str, Any]:
+    """Audit one series of bar open times (epoch seconds, file order)."""
+    t = np.asarray(times, dtype=np.int64)
+    step = TF_SEC.get(tf.lower(), 60)
+    need = min_bars if min_bars is not None else MIN_BARS.get(tf.lower(), DEFAULT_MIN_BARS)
+    n = int(t.size)
+    rep: Dict[str, Any] = {
+        "symbol": symbol, "tf": tf, "count": n, "oldest": None, "newest": None,
+        "duplicates": 0, "out_of_order": 0, "gaps": 0, "missing": 0, "largest_gap": 0,
+        "need": need, "ready": False,
+    }
+    if n == 0:
+        return rep
+
+    d = np.diff(t)
+    rep["duplicates"] = int(np.count_nonzero(d == 0))
+    rep["out_of_order"] = int(np.count_nonzero(d < 0))
+
+    s = np.unique(t) if rep["out_of_order"] else t[np.insert(d != 0, 0, True)]
+    rep["oldest"] = int(s[0])
+    rep["newest"] = int(s[-1])
+
+    ds = np.diff(s)
+    g = np.flatnonzero(ds > step)
+    if g.size:
+        # expected slots strictly between the two bars that were open for trading
+        miss = open_seconds(s[g] + step, s[g + 1], symbol) // step
+        rep["gaps"] = int(np.count_nonzero(miss))
+        rep["missing"] = int(miss.sum())
+        rep["largest_gap"] = int(miss.max())
+
+    uniq = int(s.size)
+    rep["ready"] = uniq >= need and rep["duplicates"] == 0 and rep["out_of_order"] == 0
+    return rep
+
+def status_text(rep: Dict[str, Any]) -> str:
+    if rep["count"] == 0:
+        return "EMPTY"
+    uniq = rep["count"] - rep["duplicates"]
+    if uniq < rep["need"]:
+        return f"LOW (need {rep['need'] - uniq} more to hit {rep['need']})"
+    if rep["duplicates"] or rep["out_of_order"]:
+        return "DIRTY"
+    return "OK"
+
+# ---------------- sources ----------------
+def _iso_to_epoch(values: Iterable[Any]) -> np.ndarray:
+    import pandas as pd
+    return pd.to_datetime(pd.Series(values), utc=True, format="ISO8601").to_numpy("datetime64[s]").astype(np.int64)
+
+def _group(sym: np.ndarray, tf: np.ndarray, t: np.ndarray, out: Dict[Tuple[str, str], List[np.ndarray]]):
+    import pandas as pd
+    key = pd.MultiIndex.from_arrays([sym, tf])
+    codes, uniq = pd.factorize(key)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    for part in np.split(order, bounds):
+        s, f = uniq[codes[part[0]]]
+        out.setdefault((_clean(s), str(f).lower()), []).append(t[part])
+
+def _clean(s: str) -> str:
+    from candle_store import clean_symbol
+    return clean_symbol(s)
+
+def _files(path: str, ext: str) -> List[str]:
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, f"*{ext}")))
+    return [path]
+
+def load_csv(path: str, out: Dict[Tuple[str, str], List[np.ndarray]]):
+    import pandas as pd
+    for f in _files(path, ".csv"):
+        df = pd.read_csv(f, usecols=["symbol", "tf", "time"], dtype={"symbol": str, "tf": str, "time": str},
+                         encoding="utf-8-sig")
+        _group(df["symbol"].to_numpy(), df["tf"].to_numpy(), _iso_to_epoch(df["time"]), out)
+
+def load_parquet(path: str, out: Dict[Tuple[str, str], List[np.ndarray]]):
+    import pandas as pd
+    for f in _files(path, ".parquet"):
+        df = pd.read_parquet(f, columns=["symbol", "tf", "time"])
+        tt = df["time"]
+        if np.issubdtype(tt.dtype, np.integer):
+            t = tt.to_numpy(np.int64)
+        elif np.issubdtype(tt.dtype, np.datetime64) or str(tt.dtype).startswith("datetime64"):
+            t = pd.to_datetime(tt, utc=True).to_numpy("datetime64[s]").astype(np.int64)
+        else:
+            t = _iso_to_epoch(tt)
+        _group(df["symbol"].to_numpy(), df["tf"].to_numpy(), t, out)
+
+def load_store(path: str, out: Dict[Tuple[str, str], List[np.ndarray]]):
+    from candle_store import CandleStore, BAR_DTYPE
+    st = CandleStore(path)
+    for sym, tf in st.keys():
+        n = st.count(sym, tf)
+        if n:
+            # time column straight off the map; no record copy
+            mm = np.memmap(st.path(sym, tf), dtype=BAR_DTYPE, mode="r", shape=(n,))
+            out.setdefault((sym, tf), []).append(np.asarray(mm["time"], dtype=np.int64))
+
+def load_live(base: str, symbols: List[str], tfs: List[str], out: Dict[Tuple[str, str], List[np.ndarray]],
+              limit: int = 2000):
+    import requests
+    for sym in symbols:
+        for tf in tfs:
+            r = requests.get(base, params={"symbol": sym, "tf": tf, "limit": limit}, timeout=20)
+            r.raise_for_status()
+            j = r.json()
+            candles = j.get("candles", j if isinstance(j, list) else []) or []
+            t = _iso_to_epoch([c.get("time") for c in candles]) if candles else np.zeros(0, dtype=np.int64)
+            out.setdefault((_clean(sym), tf.lower()), []).append(t)
+
+# ---------------- report ----------------
+def _fmt_time(t: Optional[int]) -> str:
+    return "" if t is None else datetime.fromtimestamp(t, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def _fmt_span(rep: Dict[str, Any]) -> str:
+    if rep["oldest"] is None:
+        return ""
+    s = rep["newest"] - rep["oldest"]
+    return f"{s // 86400}d {s % 86400 // 3600}h {s % 3600 // 60}m"
+
+COLUMNS = ["Symbol", "TF", "Count", "Oldest", "Newest", "Span", "Status",
+           "Gaps", "MissingBars", "LargestGap", "Duplicates", "OutOfOrder"]
+
+def report_rows(reps: List[Dict[str, Any]]) -> List[List[str]]:
+    return [[r["symbol"], r["tf"], str(r["count"]), _fmt_time(r["oldest"]), _fmt_time(r["newest"]), _fmt_span(r),
+             status_text(r), str(r["gaps"]), str(r["missing"]), str(r["largest_gap"]),
+             str(r["duplicates"]), str(r["out_of_order"])] for r in reps]
+
+def audit_all(series: Dict[Tuple[str, str], List[np.ndarray]], min_bars: Optional[int] = None) -> List[Dict[str, Any]]:
+    tf_order = list(TF_SEC)
+    reps = []
+    for (sym, tf) in sorted(series, key=lambda k: (k[0], tf_order.index(k[1]) if k[1] in tf_order else 99)):
+        parts = series[(sym, tf)]
+        t = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        reps.append(audit_times(t, tf, sym, min_bars))
+    return reps
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--csv", action="append", default=[])
+    ap.add_argument("--parquet", action="append", default=[])
+    ap.add_argument("--store", action="append", default=[])
+    ap.add_argument("--live", default=None, help="Node /candles URL")
+    ap.add_argument("--symbols", default=None,
+                    help="pairs to expect; missing ones are reported EMPTY (default for --live: %s)" % ",".join(DEFAULT_SYMBOLS))
+    ap.add_argument("--tfs", default=",".join(TF_SEC), help="timeframes to expect together with --symbols")
+    ap.add_argument("--min-bars", type=int, default=None, help="override per-tf model requirement")
+    ap.add_argument("--out", default=None, help="write the report CSV here")
+    ap.add_argument("--require", action="store_true", help="exit 1 unless every audited pair is ready")
+    args = ap.parse_args()
+
+    symbols = [s.strip() for s in (args.symbols or ",".join(DEFAULT_SYMBOLS)).split(",") if s.strip()]
+    tfs = [t.strip().lower() for t in args.tfs.split(",") if t.strip()]
+
+    series: Dict[Tuple[str, str], List[np.ndarray]] = {}
+    for p in args.csv:
+        load_csv(p, series)
+    for p in args.parquet:
+        load_parquet(p, series)
+    for p in args.store:
+        load_store(p, series)
+    if args.live:
+        load_live(args.live, symbols, tfs, series)
+    if not series:
+        raise SystemExit("No sources given (use --csv/--parquet/--store/--live)")
+    if args.symbols:
+        for sym in symbols:
+            for tf in tfs:
+                series.setdefault((_clean(sym), tf), [np.zeros(0, dtype=np.int64)])
+
+    reps = audit_all(series, args.min_bars)
+    rows = report_rows(reps)
+
+    w = [max(len(c), *(len(r[i]) for r in rows)) for i, c in enumerate(COLUMNS)]
+    print("  ".join(c.ljust(w[i]) for i, c in enumerate(COLUMNS)))
+    for r in rows:
+        print("  ".join(v.ljust(w[i]) for i, v in enumerate(r)))
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8", newline="") as f:
+            wr = csv.writer(f, quoting=csv.QUOTE_ALL)
+            wr.writerow(COLUMNS)
+            wr.writerows(rows)
+        print(f"[audit] wrote {args.out}")
+
+    not_ready = [r for r in reps if not r["ready"]]
+    print(f"[audit] {len(reps) - len(not_ready)}/{len(reps)} pairs ready")
+    if args.require and not_ready:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
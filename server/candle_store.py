@@ -0,0 +1,260 @@
+﻿"""
+Append-only on-disk candle store, one fixed-record file per (symbol, tf).
+
+Layout:  <root>/<SYMBOL>/<tf>.bars
+Records: BAR_DTYPE (64 bytes, little-endian), oldest -> newest, no header.
+         count = file_size // 64, so a torn write at the tail is ignored.
+
+Writers (the bridge shard that owns the symbol, mt5_history_warmup.py)
+serialize on <tf>.bars.lock and only ever grow a file, in place: readers
+keep their memory maps, which also means no rename over a file that is
+mapped (Windows refuses that). Any number of readers, without locking;
+they memory-map the file and copy only the last N records, so a window
+read is O(N) and never touches JSON.
+"""
+from __future__ import annotations
+
+import os
+import re
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+BAR_DTYPE = np.dtype([
+    ("time", "<i8"),          # bar open, epoch seconds (MT5 server time)
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),        # tick volume
+    ("spread", "<f8"),
+    ("real_volume", "<f8"),
+])
+REC = BAR_DTYPE.itemsize
+
+# column order used for model inputs (matches predict_server feature order)
+FEATURE_COLS = ("open", "high", "low", "close", "volume", "spread", "real_volume")
+
+def clean_symbol(s: str) -> str:
+    # same rule as the bridge: strip trailing "_" / "#" suffixes
+    return re.sub(r"[^A-Za-z0-9]+$", "", str(s).strip()).upper()
+
+def parse_time(v: Any) -> int:
+    if isinstance(v, (int, np.integer)):
+        return int(v)
+    if isinstance(v, float):
+        return int(v)
+    from datetime import datetime, timezone
+    d = datetime.fromisoformat(str(v).replace("Z", "+00:00"))
+    if d.tzinfo is None:
+        d = d.replace(tzinfo=timezone.utc)
+    return int(d.timestamp())
+
+def to_bars(rows: Any) -> np.ndarray:
+    """MT5 rates array, BAR_DTYPE array, or list of candle dicts -> BAR_DTYPE array."""
+    if isinstance(rows, np.ndarray) and rows.dtype.names:
+        if rows.dtype == BAR_DTYPE:
+            return rows
+        names = rows.dtype.names
+        out = np.zeros(len(rows), dtype=BAR_DTYPE)
+        out["time"] = rows["time"]
+        for k in ("open", "high", "low", "close", "spread", "real_volume"):
+            if k in names:
+                out[k] = rows[k]
+        out["volume"] = rows["tick_volume"] if "tick_volume" in names else (rows["volume"] if "volume" in names else 0.0)
+        return out
+
+    if isinstance(rows, dict):
+        rows = [rows]
+    rows = list(rows)
+    out = np.zeros(len(rows), dtype=BAR_DTYPE)
+    for i, c in enumerate(rows):
+        out["time"][i] = parse_time(c["time"])
+        for k in ("open", "high", "low", "close", "spread", "real_volume"):
+            out[k][i] = float(c.get(k) or 0.0)
+        out["volume"][i] = float(c.get("volume", c.get("tick_volume")) or 0.0)
+    return out
+
+@contextmanager
+def _locked(p: Path):
+    """Exclusive lock on <file>.lock, held by every writer of `p` across processes."""
+    with open(p.with_name(p.name + ".lock"), "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass      # LK_LOCK gives up after ~10 s; keep waiting
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _read_file(p: Path) -> np.ndarray:
+    # plain read, no memmap: a mapping of our own would pin the file on Windows
+    try:
+        buf = np.fromfile(p, dtype=np.uint8)
+    except FileNotFoundError:
+        return np.zeros(0, dtype=BAR_DTYPE)
+    return buf[:len(buf) - len(buf) % REC].view(BAR_DTYPE)
+
+class CandleStore:
+    def __init__(self, root: str | os.PathLike):
+        self.root = Path(root)
+        self._maps: Dict[Tuple[str, str], Tuple[Tuple[int, int], np.memmap]] = {}
+
+    def path(self, symbol: str, tf: str) -> Path:
+        return self.root / clean_symbol(symbol) / f"{tf.lower().strip()}.bars"
+
+    def keys(self) -> List[Tuple[str, str]]:
+        if not self.root.exists():
+            return []
+        return sorted((p.parent.name, p.stem) for p in self.root.glob("*/*.bars"))
+
+    # ---------------- write ----------------
+    def append(self, symbol: str, tf: str, rows: Any) -> int:
+        """Append bars newer than the last stored one; a bar with the same
+        time as the last record replaces it. Older bars are ignored (use
+        merge() to backfill history in front). Returns records written."""
+        bars = _sorted_unique(to_bars(rows))
+        if len(bars) == 0:
+            return 0
+        p = self.path(symbol, tf)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        with _locked(p):
+            return self._append(p, bars)
+
+    @staticmethod
+    def _append(p: Path, bars: np.ndarray) -> int:
+        with open(p, "r+b" if p.exists() else "w+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size % REC:
+                # torn record from a crashed writer
+                size -= size % REC
+                f.truncate(size)
+            written = 0
+            if size:
+                f.seek(size - REC)
+                last_t = int(np.frombuffer(f.read(REC), dtype=BAR_DTYPE)["time"][0])
+                same = bars["time"] == last_t
+                if same.any():
+                    f.seek(size - REC)
+                    f.write(bars[same][-1:].tobytes())
+                    written += 1
+                bars = bars[bars["time"] > last_t]
+            if len(bars):
+                f.seek(size)
+                f.write(bars.tobytes())
+                written += len(bars)
+        return written
+
+    def merge(self, symbol: str, tf: str, rows: Any) -> int:
+        """Union of stored and given bars (given wins on equal time). For history
+        backfills that may reach behind the first record. Returns new records."""
+        bars = _sorted_unique(to_bars(rows))
+        if len(bars) == 0:
+            return 0
+        p = self.path(symbol, tf)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        with _locked(p):
+            old = _read_file(p)
+            if len(old) == 0 or bars["time"][0] > old["time"][-1]:
+                return self._append(p, bars)
+
+            i = np.searchsorted(old["time"], bars["time"])
+            known = (i < len(old)) & (old["time"][np.minimum(i, len(old) - 1)] == bars["time"])
+            newer = bars["time"] > old["time"][-1]
+            if np.all(known | newer):
+                # the common case (warm store): nothing lands in front of or between
+                # stored bars, so overwrite changed records and append the rest in place
+                with open(p, "r+b") as f:
+                    for j in np.flatnonzero(known & (old[np.minimum(i, len(old) - 1)] != bars)):
+                        f.seek(int(i[j]) * REC)
+                        f.write(bars[j:j + 1].tobytes())
+                return self._append(p, bars[newer]) if newer.any() else 0
+
+            both = np.concatenate([bars, old])
+            # stable sort keeps `bars` ahead of `old` for equal times
+            both = both[np.argsort(both["time"], kind="stable")]
+            both = both[np.insert(np.diff(both["time"]) != 0, 0, True)]
+            # a superset of `old`, so the file only grows: rewritten in place (no rename)
+            # and readers at worst see one torn window, which the ready gate refuses
+            with open(p, "r+b") as f:
+                f.write(both.tobytes())
+            return len(both) - len(old)
+
+    # ---------------- read ----------------
+    def _map(self, symbol: str, tf: str) -> Optional[np.memmap]:
+        p = self.path(symbol, tf)
+        try:
+            st = os.stat(p)
+        except FileNotFoundError:
+            return None
+        n = st.st_size // REC
+        if n == 0:
+            return None
+        k = (clean_symbol(symbol), tf.lower().strip())
+        sig = (st.st_ino, n)
+        hit = self._maps.get(k)
+        if hit is not None and hit[0] == sig:
+            return hit[1]
+        mm = np.memmap(p, dtype=BAR_DTYPE, mode="r", shape=(n,))
+        self._maps[k] = (sig, mm)
+        return mm
+
+    def count(self, symbol: str, tf: str) -> int:
+        try:
+            return os.stat(self.path(symbol, tf)).st_size // REC
+        except FileNotFoundError:
+            return 0
+
+    def tail(self, symbol: str, tf: str, n: int) -> np.ndarray:
+        """Last n bars (oldest first) as a private BAR_DTYPE copy."""
+        mm = self._map(symbol, tf)
+        if mm is None or n <= 0:
+            return np.zeros(0, dtype=BAR_DTYPE)
+        return np.array(mm[-int(n):])
+
+    def read(self, symbol: str, tf: str) -> np.ndarray:
+        mm = self._map(symbol, tf)
+        return np.zeros(0, dtype=BAR_DTYPE) if mm is None else np.array(mm)
+
+    def last_time(self, symbol: str, tf: str) -> Optional[int]:
+        t = self.tail(symbol, tf, 1)
+        return int(t["time"][0]) if len(t) else None
+
+    def window(self, symbol: str, tf: str, n: int, cols: Iterable[str] = FEATURE_COLS) -> np.ndarray:
+        """Last n bars as a float32 (rows, len(cols)) matrix for model input."""
+        t = self.tail(symbol, tf, n)
+        cols = list(cols)
+        out = np.empty((len(t), len(cols)), dtype=np.float32)
+        for j, c in enumerate(cols):
+            out[:, j] = t[c]
+        return out
+
+def _sorted_unique(bars: np.ndarray) -> np.ndarray:
+    # by time; the last of equal times wins
+    if len(bars) > 1 and np.any(np.diff(bars["time"]) <= 0):
+        bars = bars[np.argsort(bars["time"], kind="stable")]
+        bars = bars[np.append(np.diff(bars["time"]) != 0, True)]
+    return bars
+
+def store_from_base(base: str) -> Optional[CandleStore]:
+    """CANDLES_BASE may be an http URL (Node) or file:///path / a directory."""
+    if base.startswith("file://"):
+        return CandleStore(base[len("file://"):])
+    if "://" not in base and Path(base).is_dir():
+        return CandleStore(base)
+    return None
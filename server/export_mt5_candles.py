@@ -1,5 +1,6 @@
-﻿import argparse, os
+﻿import argparse, os, glob, re, time
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timezone
 import MetaTrader5 as mt5
 
@@ -13,79 +14,213 @@ TF_MAP = {
   "1d": mt5.TIMEFRAME_D1,
 }
 
+TF_SEC = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "4h": 14400, "1d": 86400}
+
+CSV_COLS = ["symbol","tf","time","open","high","low","close","volume"]
+
 def die(msg):
   raise SystemExit(msg)
 
+def split_list(v):
+  return [x.strip() for x in v.split(",") if x.strip()]
+
+def to_frame(rates, symbol, tf):
+  # vectorized epoch -> ISO (same text as datetime.isoformat() on UTC)
+  t = pd.to_datetime(rates["time"], unit="s", utc=True).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+  return pd.DataFrame({
+    "symbol": symbol,
+    "tf": tf,
+    "time": t,
+    "open": rates["open"],
+    "high": rates["high"],
+    "low": rates["low"],
+    "close": rates["close"],
+    "volume": rates["tick_volume"],
+  }, columns=CSV_COLS)
+
+def last_csv_time(path):
+  """Epoch of the last complete row; drops a torn last line first."""
+  with open(path, "rb+") as f:
+    size = f.seek(0, os.SEEK_END)
+    if size == 0:
+      return None
+    back = min(size, 1 << 16)
+    f.seek(size - back)
+    tail = f.read(back)
+    if not tail.endswith(b"\n"):
+      cut = tail.rfind(b"\n")
+      f.truncate(size - back + cut + 1 if cut >= 0 else 0)
+      tail = tail[:cut + 1] if cut >= 0 else b""
+  lines = [ln for ln in tail.decode("utf-8", "ignore").splitlines() if ln.strip()]
+  if not lines or lines[-1].startswith("symbol,"):
+    return None
+  iso = lines[-1].split(",")[2]
+  return int(datetime.fromisoformat(iso).timestamp())
+
+def count_rows(path):
+  n = 0
+  with open(path, "rb") as f:
+    while True:
+      b = f.read(1 << 20)
+      if not b:
+        break
+      n += b.count(b"\n")
+  return max(n - 1, 0)   # header
+
+def existing_export(out_dir, symbol, tf):
+  """Latest finished export for (symbol, tf) and its row count (from the name)."""
+  best = None
+  for p in glob.glob(os.path.join(out_dir, f"{symbol}_{tf}_mt5_*.csv")):
+    m = re.search(r"_mt5_(\d+)\.csv$", p)
+    if m and (best is None or int(m.group(1)) > best[1]):
+      best = (p, int(m.group(1)))
+  return best
+
+def oldest_pos_time(symbol, tf_mt5, count):
+  """Open time of the bar `count-1` positions back, or of the oldest bar
+  the terminal has if history is shorter (binary search on position)."""
+  def at(pos):
+    r = mt5.copy_rates_from_pos(symbol, tf_mt5, pos, 1)
+    return None if r is None or len(r) == 0 else int(r["time"][0])
+
+  t = at(count - 1)
+  if t is not None:
+    return t
+  lo, hi = 0, count - 1          # at(lo) valid, at(hi) invalid
+  t = at(0)
+  if t is None:
+    return None
+  while hi - lo > 1:
+    mid = (lo + hi) // 2
+    tm = at(mid)
+    if tm is None:
+      hi = mid
+    else:
+      lo, t = mid, tm
+  return t
+
+def export_pair(symbol, tf, out_dir, count=None, chunk=5000, since=False):
+  """Stream one (symbol, tf) to CSV, oldest -> newest, chunk by chunk.
+
+  fresh:   writes <out>/<sym>_<tf>_mt5.part.csv, renamed to ..._mt5_<n>.csv
+           when done; an existing .part is resumed from its last bar.
+  since:   appends only bars newer than the latest finished export.
+  """
+  t0 = time.time()
+  tf_mt5 = TF_MAP[tf]
+  if not mt5.symbol_select(symbol, True):
+    return {"symbol": symbol, "tf": tf, "ok": False, "error": f"symbol_select failed: {mt5.last_error()}"}
+
+  os.makedirs(out_dir, exist_ok=True)
+  prev = existing_export(out_dir, symbol, tf) if since else None
+  part = os.path.join(out_dir, f"{symbol}_{tf}_mt5.part.csv")
+
+  if prev is not None:
+    os.replace(prev[0], part)
+    have = prev[1]
+    start = (last_csv_time(part) or 0) + 1
+  elif os.path.exists(part):
+    have = count_rows(part)
+    last = last_csv_time(part)
+    start = last + 1 if last is not None else None
+  else:
+    have = 0
+    start = None
+
+  if start is None:
+    if not count:
+      return {"symbol": symbol, "tf": tf, "ok": False, "error": "--count required for a fresh export"}
+    # +1: position 0 is the forming bar, which is not exported
+    start = oldest_pos_time(symbol, tf_mt5, count + 1)
+    if start is None:
+      return {"symbol": symbol, "tf": tf, "ok": False, "error":
+              f"No rates returned for {symbol} {tf}. In MT5 -> Tools->Options->Charts raise 'Max bars in history', "
+              f"then open the {tf} chart and press Home to load more history."}
+
+  # pos 0 is the still-forming bar: export closed bars only so --since never freezes a partial bar
+  cur = mt5.copy_rates_from_pos(symbol, tf_mt5, 0, 1)
+  end = int(cur["time"][0]) - 1 if cur is not None and len(cur) else int(time.time())
+
+  span = max(100, chunk) * TF_SEC[tf]
+  added = 0
+  last = start - 1
+  with open(part, "a", encoding="utf-8", newline="") as f:
+    if f.tell() == 0:
+      f.write(",".join(CSV_COLS) + "\n")
+    t = start
+    while t <= end:
+      t2 = min(t + span - 1, end)
+      rates = mt5.copy_rates_range(symbol, tf_mt5,
+                                   datetime.fromtimestamp(t, tz=timezone.utc),
+                                   datetime.fromtimestamp(t2, tz=timezone.utc))
+      if rates is not None and len(rates):
+        rates = rates[(rates["time"] > last) & (rates["time"] <= end)]
+        if len(rates):
+          to_frame(rates, symbol, tf).to_csv(f, header=False, index=False)
+          f.flush()
+          added += len(rates)
+          last = int(rates["time"][-1])
+      t = t2 + 1
+
+  total = have + added
+  final = os.path.join(out_dir, f"{symbol}_{tf}_mt5_{total}.csv")
+  os.replace(part, final)
+  return {"symbol": symbol, "tf": tf, "ok": True, "added": added, "total": total,
+          "file": final, "sec": time.time() - t0}
+
+def _init_worker():
+  if not mt5.initialize():
+    raise RuntimeError(f"MT5 initialize() failed: {mt5.last_error()}")
+
+def _report(r):
+  if r["ok"]:
+    print(f"OK {r['symbol']} {r['tf']}: +{r['added']} bars (total {r['total']}) in {r['sec']:.1f}s -> {r['file']}")
+  else:
+    print(f"FAIL {r['symbol']} {r['tf']}: {r['error']}")
+
 def main():
   ap = argparse.ArgumentParser()
-  ap.add_argument("--symbol", required=True)
-  ap.add_argument("--tf", required=True)
-  ap.add_argument("--count", type=int, required=True)
+  ap.add_argument("--symbol", "--symbols", dest="symbols", required=True, help="one symbol or a comma list")
+  ap.add_argument("--tf", "--tfs", dest="tfs", required=True, help="one tf or a comma list")
+  ap.add_argument("--count", type=int, default=None, help="bars per pair for a fresh export")
   ap.add_argument("--out", required=True)
-  ap.add_argument("--chunk", type=int, default=5000)
+  ap.add_argument("--chunk", type=int, default=5000, help="bars per request / write")
+  ap.add_argument("--workers", type=int, default=1, help="pairs exported in parallel (one MT5 connection each)")
+  ap.add_argument("--since", action="store_true", help="append only bars newer than the existing export")
   args = ap.parse_args()
 
-  tf = args.tf.lower()
-  if tf not in TF_MAP:
-    die(f"Unsupported tf={args.tf}. Allowed: {list(TF_MAP.keys())}")
-
-  if not mt5.initialize():
-    die(f"MT5 initialize() failed: {mt5.last_error()}\n"
-        f"Open MetaTrader 5 terminal, login to broker, then run again.")
-
-  symbol = args.symbol.upper()
-  if not mt5.symbol_select(symbol, True):
-    die(f"symbol_select failed for {symbol}: {mt5.last_error()}")
-
-  total = args.count
-  chunk = max(100, args.chunk)
-  offset = 0
-  rows = []
-
-  while len(rows) < total:
-    need = min(chunk, total - len(rows))
-    rates = mt5.copy_rates_from_pos(symbol, TF_MAP[tf], offset, need)
-
-    # if history not loaded enough, you get None/empty
-    if rates is None or len(rates) == 0:
-      break
-
-    rows.append(rates)
-    offset += len(rates)
-
-    # safety stop if MT5 stops giving older data
-    if len(rates) < need:
-      break
-
-  mt5.shutdown()
-
-  if not rows:
-    die(
-      f"No rates returned for {symbol} {tf}.\n"
-      f"Fix: In MT5 -> Tools->Options->Charts set 'Max bars in history' and 'Max bars in chart' to a big number,\n"
-      f"then open {symbol} chart on {tf} and press Home to load more history."
-    )
-
-  import numpy as np
-  arr = np.concatenate(rows, axis=0)
-
-  df = pd.DataFrame(arr)
-  # df columns: time, open, high, low, close, tick_volume, spread, real_volume
-  df["time"] = df["time"].apply(lambda s: datetime.fromtimestamp(int(s), tz=timezone.utc).isoformat())
-  df.rename(columns={"tick_volume":"volume"}, inplace=True)
-
-  df.insert(0, "tf", tf)
-  df.insert(0, "symbol", symbol)
-
-  df = df[["symbol","tf","time","open","high","low","close","volume"]]
-
-  # MT5 returns from newest->older with offset paging; reverse to chronological
-  df = df.iloc[::-1].reset_index(drop=True)
-
-  os.makedirs(args.out, exist_ok=True)
-  out_file = os.path.join(args.out, f"{symbol}_{tf}_mt5_{len(df)}.csv")
-  df.to_csv(out_file, index=False, encoding="utf-8")
-  print(f"OK {symbol} {tf}: saved {len(df)} -> {out_file}")
+  symbols = [s.upper() for s in split_list(args.symbols)]
+  tfs = [t.lower() for t in split_list(args.tfs)]
+  bad = [t for t in tfs if t not in TF_MAP]
+  if bad:
+    die(f"Unsupported tf={bad}. Allowed: {list(TF_MAP.keys())}")
+  if not args.since and not args.count:
+    die("--count is required unless --since")
+
+  pairs = [(s, t) for s in symbols for t in tfs]
+  kw = dict(out_dir=args.out, count=args.count, chunk=args.chunk, since=args.since)
+
+  results = []
+  if args.workers <= 1 or len(pairs) == 1:
+    if not mt5.initialize():
+      die(f"MT5 initialize() failed: {mt5.last_error()}\n"
+          f"Open MetaTrader 5 terminal, login to broker, then run again.")
+    for s, t in pairs:
+      r = export_pair(s, t, **kw)
+      _report(r)
+      results.append(r)
+    mt5.shutdown()
+  else:
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as ex:
+      futs = [ex.submit(export_pair, s, t, **kw) for s, t in pairs]
+      for fu in as_completed(futs):
+        r = fu.result()
+        _report(r)
+        results.append(r)
+
+  failed = [r for r in results if not r["ok"]]
+  if failed:
+    die(f"{len(failed)}/{len(results)} exports failed")
 
 if __name__ == "__main__":
   main()
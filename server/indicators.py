@@ -0,0 +1,256 @@
+﻿"""
+Incremental versions of the training features, O(1) state update per bar.
+
+  RollingATR      train_smc.compute_atr: mean true range over `period`
+                  bars, first bar's previous close is its own close
+  RollingMeanVar  sliding-window Welford mean / population variance
+  FeatureWindow   ring buffer of the last T raw OHLCV bars; features()
+                  equals train_smc.build_feature_window(raw())
+  LiveFeatures    FeatureWindow + RollingATR for one (symbol, tf)
+
+Running sums are rebuilt from the ring every RESYNC updates so rounding
+error cannot accumulate over long sessions.
+
+  python indicators.py --check [--data-dir ../training/data]
+
+replays synthetic and CSV series bar by bar and compares every step with
+the batch functions in training/train_smc.py (exit code 1 on mismatch).
+"""
+from __future__ import annotations
+
+import math
+from typing import Any, Optional
+
+import numpy as np
+
+RESYNC = 4096
+
+class RollingATR:
+    def __init__(self, period: int = 14):
+        self.period = int(period)
+        self.tr = np.zeros(self.period)
+        self.n = 0
+        self.sum = 0.0
+        self.prev_close: Optional[float] = None
+
+    def update(self, high: float, low: float, close: float) -> float:
+        pc = close if self.prev_close is None else self.prev_close
+        tr = max(high - low, abs(high - pc), abs(low - pc))
+        self.prev_close = close
+
+        i = self.n % self.period
+        self.sum += tr - self.tr[i]
+        self.tr[i] = tr
+        self.n += 1
+        if self.n % RESYNC == 0:
+            self.sum = float(self.tr.sum())
+        return self.value
+
+    @property
+    def value(self) -> float:
+        return self.sum / self.period if self.n >= self.period else math.nan
+
+class RollingMeanVar:
+    """Mean and population variance of the last `size` values (Welford add/remove).
+
+    A NaN/inf in the window makes mean and var NaN, like the batch z-score; the
+    sums are rebuilt from the ring as soon as the last one has left."""
+    def __init__(self, size: int):
+        self.size = int(size)
+        self.buf = np.zeros(self.size)
+        self.n = 0          # values seen
+        self.bad = 0        # non-finite values in the window
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, x: float) -> None:
+        k = min(self.n, self.size)            # values currently in the window
+        i = self.n % self.size
+        old = float(self.buf[i]) if k == self.size else 0.0
+        self.bad += (not math.isfinite(x)) - (not math.isfinite(old))
+        # no Welford step through a NaN/inf: it would poison the sums until the next RESYNC
+        clean = not self.bad and math.isfinite(old)
+        if clean and k == self.size:
+            # replace `old` by `x` in a full window
+            mean = self.mean + (x - old) / k
+            self.m2 += (x - old) * (x - mean + old - self.mean)
+            self.mean = mean
+        elif clean:
+            k += 1
+            d = x - self.mean
+            self.mean += d / k
+            self.m2 += d * (x - self.mean)
+        self.buf[i] = x
+        self.n += 1
+        if self.bad:
+            self.mean = self.m2 = math.nan
+            return
+        if self.m2 < 0.0:
+            self.m2 = 0.0
+        if self.n % RESYNC == 0 or not clean:
+            w = self.buf[: min(self.n, self.size)]
+            self.mean = float(w.mean())
+            self.m2 = float(((w - self.mean) ** 2).sum())
+
+    @property
+    def count(self) -> int:
+        return min(self.n, self.size)
+
+    @property
+    def var(self) -> float:
+        k = self.count
+        return self.m2 / k if k else math.nan
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.var)
+
+class FeatureWindow:
+    """Last T bars of [open, high, low, close, volume].
+
+    Rows are written twice into a 2T buffer, so the window is always the
+    contiguous slice buf[pos:pos+T] and raw() needs no roll or copy."""
+    def __init__(self, T: int = 60):
+        self.T = int(T)
+        self.buf = np.zeros((2 * self.T, 5))
+        self.n = 0
+        self.vol = RollingMeanVar(self.T)
+
+    def push(self, o: float, h: float, l: float, c: float, v: float) -> None:
+        i = self.n % self.T
+        row = (o, h, l, c, v)
+        self.buf[i] = row
+        self.buf[i + self.T] = row
+        self.n += 1
+        self.vol.update(math.log1p(max(v, 0.0)))
+
+    @property
+    def ready(self) -> bool:
+        return self.n >= self.T
+
+    def raw(self) -> np.ndarray:
+        """(T, 5) float64 view, oldest first (what the *_raw ONNX models take)."""
+        pos = self.n % self.T
+        return self.buf[pos:pos + self.T]
+
+    def features(self) -> np.ndarray:
+        """build_feature_window(raw()) from the running volume stats."""
+        w = self.raw()
+        ref = w[-1, 3]
+        if ref == 0 or not np.isfinite(ref):
+            ref = np.nanmean(w[:, 3])
+            if not np.isfinite(ref) or ref == 0:
+                ref = 1.0
+        out = np.empty((self.T, 5), dtype=np.float64)
+        out[:, 0:4] = w[:, 0:4] / ref - 1.0
+        v = np.log1p(np.maximum(w[:, 4], 0.0))
+        out[:, 4] = (v - self.vol.mean) / (self.vol.std + 1e-6)
+        return out.astype(np.float32)
+
+class LiveFeatures:
+    """Per (symbol, tf) state fed one closed bar at a time."""
+    def __init__(self, T: int = 60, atr_period: int = 14):
+        self.window = FeatureWindow(T)
+        self.atr = RollingATR(atr_period)
+        self.last_time: Optional[int] = None
+
+    def update(self, bar: Any) -> None:
+        """bar: dict / MT5 rates record / candle_store.BAR_DTYPE record."""
+        o, h, l, c = (float(bar[k]) for k in ("open", "high", "low", "close"))
+        names = getattr(getattr(bar, "dtype", None), "names", None) or bar
+        v = float(bar["tick_volume"] if "tick_volume" in names else bar["volume"])
+        self.window.push(o, h, l, c, v)
+        self.atr.update(h, l, c)
+        if "time" in names:
+            self.last_time = int(bar["time"])
+
+    @classmethod
+    def from_bars(cls, bars: np.ndarray, T: int = 60, atr_period: int = 14) -> "LiveFeatures":
+        lf = cls(T, atr_period)
+        for b in bars:
+            lf.update(b)
+        return lf
+
+    @property
+    def ready(self) -> bool:
+        return self.window.ready and self.atr.n >= self.atr.period
+
+# ---------------- parity check ----------------
+def _series(n, seed=0):
+    rng = np.random.default_rng(seed)
+    c = 100.0 * np.exp(np.cumsum(rng.normal(0, 1e-3, n)))
+    o = np.concatenate([[c[0]], c[:-1]])
+    h = np.maximum(o, c) * (1 + np.abs(rng.normal(0, 5e-4, n)))
+    l = np.minimum(o, c) * (1 - np.abs(rng.normal(0, 5e-4, n)))
+    v = rng.integers(0, 5000, n).astype(np.float64)
+    v[rng.random(n) < 0.01] = 0.0
+    return o, h, l, c, v
+
+def check(series, T=60, atr_period=14, every=1):
+    """Replay bar by bar; max abs differences vs the batch functions."""
+    from train_smc import compute_atr, build_feature_window
+    o, h, l, c, v = series
+    ref_atr = compute_atr(h, l, c, period=atr_period)
+    lf = LiveFeatures(T, atr_period)
+    d_atr = d_feat = 0.0
+    for i in range(len(c)):
+        lf.update({"open": o[i], "high": h[i], "low": l[i], "close": c[i], "volume": v[i]})
+        a = lf.atr.value
+        if np.isfinite(ref_atr[i]) != np.isfinite(a):
+            d_atr = math.inf
+        elif np.isfinite(a):
+            d_atr = max(d_atr, abs(a - ref_atr[i]) / max(abs(ref_atr[i]), 1e-12))
+        if lf.window.ready and i % every == 0:
+            win = np.stack([o, h, l, c, v], axis=1)[i + 1 - T:i + 1]
+            f, ref = lf.window.features(), build_feature_window(win)
+            d = np.abs(f - ref)
+            d[np.isnan(f) & np.isnan(ref)] = 0.0    # both NaN while a bad bar is in the window
+            d_feat = max(d_feat, float(np.nan_to_num(d, nan=math.inf).max()))
+    return d_atr, d_feat
+
+def main():
+    import os, sys, glob, time, argparse
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--check", action="store_true", help="compare with training/train_smc.py bar by bar")
+    ap.add_argument("--data-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "training", "data"))
+    ap.add_argument("--bars", type=int, default=20000, help="synthetic bars (long enough to cross several resyncs)")
+    ap.add_argument("--atr-tol", type=float, default=1e-9, help="relative")
+    ap.add_argument("--feat-tol", type=float, default=1e-5, help="absolute, float32 features")
+    args = ap.parse_args()
+    if not args.check:
+        ap.print_help()
+        return
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "training"))
+    runs = [("synthetic", _series(args.bars))]
+    import pandas as pd
+    for f in sorted(glob.glob(os.path.join(args.data_dir, "*.csv"))):
+        d = pd.read_csv(f).sort_values("time")
+        runs.append((os.path.basename(f), tuple(d[k].to_numpy(np.float64) for k in ("open", "high", "low", "close", "volume"))))
+
+    bad = 0
+    for name, s in runs:
+        t0 = time.perf_counter()
+        d_atr, d_feat = check(s)
+        ok = d_atr <= args.atr_tol and d_feat <= args.feat_tol
+        bad += not ok
+        print(f"{'OK ' if ok else 'BAD'} {name}: {len(s[0])} bars | atr rel {d_atr:.1e} | features abs {d_feat:.1e} | {time.perf_counter() - t0:.1f}s")
+
+    # update cost vs recomputing from scratch for one new bar
+    o, h, l, c, v = _series(5000, seed=1)
+    lf = LiveFeatures()
+    t0 = time.perf_counter()
+    for i in range(len(c)):
+        lf.update({"open": o[i], "high": h[i], "low": l[i], "close": c[i], "volume": v[i]})
+    inc = (time.perf_counter() - t0) / len(c) * 1e6
+    from train_smc import compute_atr, build_feature_window
+    t0 = time.perf_counter()
+    for i in range(200):
+        compute_atr(h[:800], l[:800], c[:800])
+        build_feature_window(np.stack([o, h, l, c, v], axis=1)[740:800])
+    batch = (time.perf_counter() - t0) / 200 * 1e6
+    print(f"per bar: incremental update {inc:.1f} us vs batch recompute over 800 bars {batch:.1f} us")
+    sys.exit(1 if bad else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,584 @@
+﻿"""
+Load generator for predict_server: dashboard-like traffic, measured.
+
+Pieces (all started and stopped by this script):
+  stub candle server   GET /candles like Node, seeded from training/data CSVs
+                       (restamped to end now; symbols/tfs without a CSV reuse
+                       one, rescaled); also takes the bridge's POST /candle(s)
+                       and /tick, and records bar closes under GET /closes
+  predict_server       uvicorn (--server plain) or serve_shared.py (--server
+                       shared) with CANDLES_BASE pointing at the stub
+  bridge (--bridge)    tawaqu3tickbridge.py on the fake MetaTrader5 module
+                       (mt5stub/), posting live bars into the stub
+
+Payloads (--mix): "symbol" (server fetches the window), "flat" (JSON
+features list, test_model_from_node.build_features_7 columns) and
+"binary" (octet-stream + X-Shape, as test_model_from_node.py sends).
+
+Modes:
+  sweep   closed loop: N clients back-to-back for --duration per level of
+          --concurrency; throughput, p50/p95/p99 and the knee (the level
+          with the most throughput per unit of p95 latency)
+  burst   --clients dashboards each watching --pairs (symbol, tf) pairs all
+          request at once when a bar closes: simulated every --bar-sec
+          (1m closes, 5m every 5th, ...) or, with --bridge, when the bridge
+          posts a new bar. Reports per-burst makespan and latency.
+  replay  open loop from a JSONL recording (--record writes one from any
+          mode: {"t": sec, "symbol", "tf", "kind"} per request)
+
+  python loadgen.py --mode sweep --concurrency 1,2,4,8,16 --duration 10
+  python loadgen.py --mode burst --clients 40 --closes 15 --bar-sec 2 --record burst.jsonl
+  python loadgen.py --mode replay --replay burst.jsonl --speed 2
+  python loadgen.py --mode burst --bridge --closes 3
+  python loadgen.py --mode candles --candles-port 8080          # stub candle server only
+"""
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import zlib
+import random
+import signal
+import argparse
+import threading
+import subprocess
+import multiprocessing as mp
+from bisect import bisect_left
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from candle_audit import TF_SEC
+from test_model_from_node import build_features_7
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(HERE, "..", "training", "data")
+
+# (T, F) the served models take per tf
+SHAPES = {"1m": (256, 7), "5m": (128, 7), "15m": (60, 5), "30m": (60, 5)}
+DEFAULT_SYMBOLS = "XAUUSD,XAGUSD,EURUSD,BTCUSD,ETHUSD"
+DEFAULT_MIX = "symbol:0.5,flat:0.25,binary:0.25"
+KINDS = ("symbol", "flat", "binary")
+
+# rescale reused CSVs to roughly the symbol's own price level
+PRICE = {"XAUUSD": 4300.0, "XAGUSD": 52.0, "EURUSD": 1.08, "BTCUSD": 95000.0, "ETHUSD": 3400.0}
+STUB_BARS = 2000
+# the bridge posts closed bars; one that ended at most this long ago is a live bar close
+LIVE_CLOSE_SEC = 10
+
+# ---------------- candle data ----------------
+def _iso(t):
+    return datetime.fromtimestamp(int(t), tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _read_csvs(data_dir):
+    import pandas as pd
+    out = {}
+    for f in sorted(glob.glob(os.path.join(data_dir, "*.csv"))):
+        d = pd.read_csv(f)
+        for (sym, tf), g in d.groupby(["symbol", "tf"]):
+            out[(str(sym).upper(), str(tf).lower())] = g.sort_values("time")[["open", "high", "low", "close", "volume"]].to_numpy(np.float64)
+    if not out:
+        raise RuntimeError(f"No CSV found in {data_dir}")
+    return out
+
+def build_series(data_dir, symbols, tfs, now, bars=STUB_BARS):
+    """{(symbol, tf): [candle dict, ...]} ending at the last closed bar before `now`."""
+    src = _read_csvs(data_dir)
+    keys = sorted(src)
+    out = {}
+    for sym in symbols:
+        for tf in tfs:
+            if (sym, tf) in src:
+                a = src[(sym, tf)]
+            else:
+                same_tf = [k for k in keys if k[1] == tf] or keys
+                a = src[same_tf[zlib.crc32(sym.encode()) % len(same_tf)]]
+                if sym in PRICE:
+                    a = a.copy()
+                    a[:, :4] *= PRICE[sym] / a[-1, 3]
+            a = a[-bars:]
+            step = TF_SEC[tf]
+            last = now - now % step - step
+            times = last - step * np.arange(len(a) - 1, -1, -1, dtype=np.int64)
+            out[(sym, tf)] = [{"time": _iso(t), "open": r[0], "high": r[1], "low": r[2], "close": r[3], "volume": r[4]}
+                              for t, r in zip(times.tolist(), a.tolist())]
+    return out
+
+# ---------------- stub candle server ----------------
+class CandleBook:
+    """Bars per (symbol, tf) kept sorted by time; upserts from the bridge."""
+    def __init__(self, series, keep=STUB_BARS):
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.times = {k: [int(datetime.fromisoformat(c["time"].replace("Z", "+00:00")).timestamp()) for c in v]
+                      for k, v in series.items()}
+        self.bars = {k: list(v) for k, v in series.items()}
+        self.cache = {}
+        self.closes = []            # (seq, symbol, tf, closed bar time)
+        self.last_close = {}
+        self.ticks = 0
+
+    def get(self, sym, tf, limit):
+        key = (sym, tf, limit)
+        with self.lock:
+            body = self.cache.get(key)
+            if body is None:
+                bars = self.bars.get((sym, tf), [])
+                body = json.dumps({"ok": True, "symbol": sym, "tf": tf, "candles": bars[-limit:]}).encode()
+                self.cache[key] = body
+        return body
+
+    def upsert(self, c):
+        sym = "".join(ch for ch in str(c.get("symbol", "")).upper() if ch.isalnum())
+        tf = str(c.get("tf", "")).lower()
+        if not sym or tf not in TF_SEC or c.get("time") is None:
+            return False
+        t = int(datetime.fromisoformat(str(c["time"]).replace("Z", "+00:00")).timestamp())
+        bar = {"time": _iso(t), **{k: float(c.get(k, 0.0)) for k in ("open", "high", "low", "close", "volume")}}
+        with self.lock:
+            times = self.times.setdefault((sym, tf), [])
+            bars = self.bars.setdefault((sym, tf), [])
+            i = bisect_left(times, t)
+            if 0 <= time.time() - (t + TF_SEC[tf]) <= LIVE_CLOSE_SEC and self.last_close.get((sym, tf), -1) < t:
+                # backfill's forming bar has not ended yet, and its closed bars are old
+                self.last_close[(sym, tf)] = t
+                self.closes.append((len(self.closes) + 1, sym, tf, t))
+            if i < len(times) and times[i] == t:
+                bars[i] = bar
+            else:
+                times.insert(i, t)
+                bars.insert(i, bar)
+                if len(times) > self.keep:
+                    del times[0], bars[0]
+            self.cache = {k: v for k, v in self.cache.items() if k[:2] != (sym, tf)}
+        return True
+
+class _Handler(BaseHTTPRequestHandler):
+    book = None
+    protocol_version = "HTTP/1.1"
+    # headers and body go out as separate writes; with Nagle on, every response on a kept-alive
+    # connection (the bridge's requests.Session) waits ~40 ms for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, body):
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        u = urlparse(self.path)
+        q = {k: v[-1] for k, v in parse_qs(u.query).items()}
+        if u.path == "/candles":
+            sym = "".join(ch for ch in q.get("symbol", "").upper() if ch.isalnum())
+            limit = max(1, min(2000, int(q.get("limit", "300"))))
+            return self._send(200, self.book.get(sym, q.get("tf", "").lower(), limit))
+        if u.path == "/closes":
+            since = int(q.get("since", "0"))
+            with self.book.lock:
+                ev = [{"seq": s, "symbol": sym, "tf": tf, "time": t} for s, sym, tf, t in self.book.closes[since:]]
+            return self._send(200, json.dumps({"ok": True, "closes": ev, "ticks": self.book.ticks}).encode())
+        if u.path == "/health":
+            return self._send(200, b'{"ok": true}')
+        self._send(404, b'{"ok": false, "error": "Not found"}')
+
+    def do_POST(self):
+        n = int(self.headers.get("Content-Length", "0") or 0)
+        path = urlparse(self.path).path
+        ok = True
+        try:
+            msg = json.loads(self.rfile.read(n) or b"{}")
+            if path == "/candle":
+                ok = self.book.upsert(msg)
+            elif path == "/candles":
+                for c in msg.get("candles", []):
+                    ok = self.book.upsert(dict(c, symbol=msg.get("symbol"), tf=msg.get("tf"))) and ok
+        except (ValueError, TypeError, AttributeError):
+            return self._send(400, b'{"ok": false}')
+        if path in ("/candle", "/candles"):
+            pass
+        elif path == "/tick":
+            self.book.ticks += 1
+        elif path != "/signal":
+            return self._send(404, b'{"ok": false, "error": "Not found"}')
+        self._send(200 if ok else 400, json.dumps({"ok": ok}).encode())
+
+def serve_candles(port, data_dir, symbols, tfs, now):
+    signal.signal(signal.SIGTERM, lambda *a: sys.exit(0))
+    _Handler.book = CandleBook(build_series(data_dir, symbols, tfs, now))
+    srv = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    srv.daemon_threads = True
+    srv.serve_forever()
+
+# ---------------- processes ----------------
+def wait_http(url, proc=None, timeout=120):
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"{url}: process exited with {proc.returncode}")
+        try:
+            if requests.get(url, timeout=1).status_code < 500:
+                return time.time() - t0
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+def start_predict_server(args, candles_port):
+    env = dict(os.environ, CANDLES_BASE=f"http://127.0.0.1:{candles_port}/candles", PYTHONUNBUFFERED="1")
+    if args.server == "shared":
+        cmd = [sys.executable, os.path.join(HERE, "serve_shared.py"), "--host", "127.0.0.1",
+               "--port", str(args.port), "--workers", str(args.workers)]
+    else:
+        env["PRELOAD"] = "1"
+        cmd = [sys.executable, "-m", "uvicorn", "predict_server:app", "--host", "127.0.0.1",
+               "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    up = wait_http(f"http://127.0.0.1:{args.port}/stream/stats", proc)
+    print(f"[loadgen] predict_server ({args.server}, {args.workers} worker(s)) up in {up:.1f}s", flush=True)
+    return proc
+
+def start_bridge(args, candles_port):
+    env = dict(os.environ, BRIDGE_SERVER_HTTP=f"http://127.0.0.1:{candles_port}", PYTHONUNBUFFERED="1",
+               PYTHONPATH=os.pathsep.join([os.path.join(HERE, "mt5stub"), os.environ.get("PYTHONPATH", "")]),
+               BRIDGE_BACKFILL_LIMIT=str(max(SHAPES["1m"][0] + 44, 300)), BRIDGE_BACKFILL_SLEEP="0")
+    cmd = [sys.executable, os.path.join(HERE, "tawaqu3tickbridge.py"), "--symbols", ",".join(args.symbols),
+           "--candles-from", args.bridge_candles]
+    proc = subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    print(f"[loadgen] bridge on the stub MT5 feed pid={proc.pid} ({args.bridge_candles})", flush=True)
+    return proc
+
+def stop(proc):
+    if proc is None:
+        return
+    if isinstance(proc, mp.Process):
+        proc.terminate()
+        proc.join(10)
+        return
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(timeout=20)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+# ---------------- requests ----------------
+class Payloads:
+    """Pre-encoded request bodies per (symbol, tf, kind), so the client spends
+    its CPU on sending, not on json.dumps of 1792 floats."""
+    def __init__(self, series, url):
+        self.url = url
+        self.body = {}
+        for (sym, tf), bars in series.items():
+            if tf not in SHAPES:
+                continue
+            T, F = SHAPES[tf]
+            X = build_features_7(bars[-T:])[:, :F]
+            self.body[(sym, tf, "symbol")] = (
+                {"tf": tf}, json.dumps({"tf": tf, "symbol": sym}).encode(), {"Content-Type": "application/json"})
+            self.body[(sym, tf, "flat")] = (
+                {"tf": tf}, json.dumps({"tf": tf, "symbol": sym, "features": X.reshape(-1).tolist()}).encode(),
+                {"Content-Type": "application/json"})
+            self.body[(sym, tf, "binary")] = (
+                {"tf": tf, "symbol": sym}, X.astype("<f4").tobytes(),
+                {"Content-Type": "application/octet-stream", "X-Shape": f"1,{T},{F}"})
+
+    def send(self, session, sym, tf, kind):
+        params, body, headers = self.body[(sym, tf, kind)]
+        t0 = time.perf_counter()
+        try:
+            code = session.post(self.url, params=params, data=body, headers=headers, timeout=60).status_code
+        except requests.RequestException:
+            code = 0
+        return code, (time.perf_counter() - t0) * 1000.0
+
+class Recorder:
+    def __init__(self, path):
+        self.f = open(path, "w") if path else None
+        self.t0 = None              # first request = t 0
+        self.lock = threading.Lock()
+
+    def add(self, sym, tf, kind):
+        if self.f is not None:
+            if self.t0 is None:
+                self.t0 = time.time()
+            line = json.dumps({"t": round(time.time() - self.t0, 4), "symbol": sym, "tf": tf, "kind": kind})
+            with self.lock:
+                self.f.write(line + "\n")
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+_local = threading.local()
+
+def _session():
+    s = getattr(_local, "session", None)
+    if s is None:
+        s = _local.session = requests.Session()
+    return s
+
+def summarize(rows, seconds):
+    """rows: (kind, tf, code, ms)."""
+    ms = np.array([r[3] for r in rows if r[2] == 200], dtype=np.float64)
+    out = {"requests": len(rows), "errors": sum(r[2] != 200 for r in rows),
+           "rps": round(len(ms) / seconds, 1) if seconds > 0 else 0.0}
+    for p in (50, 95, 99):
+        out[f"p{p}_ms"] = round(float(np.percentile(ms, p)), 2) if ms.size else float("nan")
+    return out
+
+def print_table(rows, cols):
+    print("  " + " ".join(f"{c:>10}" for c in cols))
+    for r in rows:
+        print("  " + " ".join(f"{r.get(c, ''):>10}" for c in cols))
+
+def by_kind(rows, seconds):
+    print("\n  per payload / tf (all levels):")
+    groups = sorted({(r[0], r[1]) for r in rows})
+    for kind, tf in groups:
+        s = summarize([r for r in rows if r[0] == kind and r[1] == tf], seconds)
+        print(f"  {kind:<7} {tf:<4} n={s['requests']:<6} err={s['errors']:<4} p50 {s['p50_ms']:>8} ms  p99 {s['p99_ms']:>8} ms")
+
+# ---------------- modes ----------------
+def pick(rng, pairs, mix):
+    sym, tf = pairs[rng.randrange(len(pairs))]
+    kind = rng.choices(KINDS, weights=[mix.get(k, 0.0) for k in KINDS])[0]
+    return sym, tf, kind
+
+def knee(levels):
+    """Level with the highest throughput per unit of p95 latency (Kleinrock's power)."""
+    ok = [l for l in levels if l["rps"] > 0 and np.isfinite(l["p95_ms"])]
+    return max(ok, key=lambda l: l["rps"] / l["p95_ms"]) if ok else None
+
+def run_sweep(args, payloads, pairs, rec):
+    levels, all_rows = [], []
+    for n in args.concurrency:
+        stop_at = [0.0]
+        rows = []
+        lock = threading.Lock()
+
+        def client(i):
+            rng = random.Random(args.seed * 1000 + i)
+            s = _session()
+            mine = []
+            while time.time() < stop_at[0]:
+                sym, tf, kind = pick(rng, pairs, args.mix)
+                rec.add(sym, tf, kind)
+                code, ms = payloads.send(s, sym, tf, kind)
+                mine.append((kind, tf, code, ms))
+            with lock:
+                rows.extend(mine)
+
+        # warm-up at this level, then measure
+        for phase, secs in (("warm", args.warmup), ("run", args.duration)):
+            rows.clear()
+            stop_at[0] = time.time() + secs
+            t0 = time.time()
+            with ThreadPoolExecutor(n) as ex:
+                list(ex.map(client, range(n)))
+            elapsed = time.time() - t0
+        s = dict(summarize(rows, elapsed), concurrency=n)
+        levels.append(s)
+        all_rows.extend(rows)
+        print(f"[loadgen] c={n:<4} {s['rps']:>8} req/s  p50 {s['p50_ms']} ms  p95 {s['p95_ms']} ms  p99 {s['p99_ms']} ms"
+              f"  errors {s['errors']}", flush=True)
+
+    k = knee(levels)
+    for l in levels:
+        l["knee"] = "<-" if l is k else ""
+    print()
+    print_table(levels, ["concurrency", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "knee"])
+    if k is not None:
+        best = max(levels, key=lambda l: l["rps"])
+        print(f"\n  knee at concurrency {k['concurrency']}: {k['rps']} req/s, p95 {k['p95_ms']} ms "
+              f"(max {best['rps']} req/s at {best['concurrency']}, p95 {best['p95_ms']} ms)")
+    by_kind(all_rows, sum(args.duration for _ in levels))
+    return levels
+
+def _fire(payloads, reqs, max_inflight, rec):
+    t0 = time.perf_counter()
+
+    def one(r):
+        rec.add(*r)
+        code, ms = payloads.send(_session(), *r)
+        return (r[2], r[1], code, ms)
+
+    with ThreadPoolExecutor(min(max_inflight, max(1, len(reqs)))) as ex:
+        rows = list(ex.map(one, reqs))
+    return rows, (time.perf_counter() - t0) * 1000.0
+
+def closes_sim(args):
+    """Simulated bar closes: k-th 1m close also closes every tf whose length divides k."""
+    for k in range(1, args.closes + 1):
+        time.sleep(args.bar_sec)
+        yield [tf for tf in args.tfs if k % (TF_SEC[tf] // 60) == 0]
+
+def closes_bridge(args, candles_port, timeout=900):
+    url = f"http://127.0.0.1:{candles_port}/closes"
+    seen = len(requests.get(url, timeout=5).json()["closes"])
+    got, t0 = 0, time.time()
+    while got < args.closes and time.time() - t0 < timeout:
+        time.sleep(0.2)
+        ev = requests.get(url, params={"since": seen}, timeout=5).json()["closes"]
+        if not ev:
+            continue
+        seen += len(ev)
+        got += 1
+        # the bridge posts every symbol's bars within one pass: group them into one burst
+        time.sleep(0.5)
+        ev += requests.get(url, params={"since": seen}, timeout=5).json()["closes"]
+        seen = max(e["seq"] for e in ev)
+        yield sorted({e["tf"] for e in ev if e["tf"] in args.tfs}), {(e["symbol"], e["tf"]) for e in ev}
+
+def run_burst(args, payloads, pairs, rec, candles_port):
+    rng = random.Random(args.seed)
+    clients = [[pairs[i] for i in rng.sample(range(len(pairs)), min(args.pairs, len(pairs)))] for _ in range(args.clients)]
+    bursts, all_rows = [], []
+    src = closes_bridge(args, candles_port) if args.bridge else ((tfs, None) for tfs in closes_sim(args))
+    for i, (tfs, which) in enumerate(src, 1):
+        reqs = [(sym, tf, pick(rng, [(sym, tf)], args.mix)[2]) for c in clients for sym, tf in c
+                if tf in tfs and (which is None or (sym, tf) in which)]
+        if not reqs:
+            continue
+        rows, span = _fire(payloads, reqs, args.max_inflight, rec)
+        all_rows.extend(rows)
+        s = dict(summarize(rows, span / 1000.0), burst=i, tfs="+".join(tfs), makespan_ms=round(span, 1))
+        bursts.append(s)
+        print(f"[loadgen] burst {i} ({s['tfs']}): {s['requests']} requests in {span:.0f} ms  p50 {s['p50_ms']} ms"
+              f"  p99 {s['p99_ms']} ms  errors {s['errors']}", flush=True)
+    print()
+    print_table(bursts, ["burst", "tfs", "requests", "errors", "makespan_ms", "p50_ms", "p95_ms", "p99_ms"])
+    if bursts:
+        print(f"\n  worst burst makespan {max(b['makespan_ms'] for b in bursts):.0f} ms over {len(bursts)} bursts "
+              f"({args.clients} clients x {args.pairs} pairs)")
+    by_kind(all_rows, sum(b["makespan_ms"] for b in bursts) / 1000.0)
+    return bursts
+
+def run_replay(args, payloads, rec):
+    with open(args.replay) as f:
+        events = [json.loads(l) for l in f if l.strip()]
+    events = [e for e in events if (e["symbol"], e["tf"], e.get("kind", "symbol")) in payloads.body]
+    if not events:
+        raise SystemExit(f"nothing to replay from {args.replay} for these symbols/tfs")
+    rows, lock = [], threading.Lock()
+
+    def one(e):
+        rec.add(e["symbol"], e["tf"], e.get("kind", "symbol"))
+        code, ms = payloads.send(_session(), e["symbol"], e["tf"], e.get("kind", "symbol"))
+        with lock:
+            rows.append((e.get("kind", "symbol"), e["tf"], code, ms))
+
+    late = 0
+    t0 = time.time()
+    with ThreadPoolExecutor(args.max_inflight) as ex:
+        for e in events:
+            due = t0 + e["t"] / args.speed
+            wait = due - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            elif wait < -0.05:
+                late += 1
+            ex.submit(one, e)
+    elapsed = time.time() - t0
+    s = summarize(rows, elapsed)
+    print()
+    print_table([dict(s, speed=args.speed, late=late)], ["requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "speed", "late"])
+    if late:
+        print(f"\n  {late} requests left >50 ms behind schedule: raise --max-inflight or the recording outran the client")
+    by_kind(rows, elapsed)
+    return [s]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=["sweep", "burst", "replay", "candles"], default="sweep")
+    ap.add_argument("--data-dir", default=DATA_DIR)
+    ap.add_argument("--symbols", default=DEFAULT_SYMBOLS)
+    ap.add_argument("--tfs", default="1m,5m,15m,30m")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="payload weights, kind:weight,...")
+    ap.add_argument("--seed", type=int, default=7)
+    # servers
+    ap.add_argument("--url", default=None, help="use a running predict_server (.../predict) instead of starting one")
+    ap.add_argument("--server", choices=["plain", "shared"], default="plain")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--port", type=int, default=8791)
+    ap.add_argument("--candles-port", type=int, default=8792)
+    ap.add_argument("--bridge", action="store_true", help="also run the bridge on the stub MT5 feed into the stub candles")
+    ap.add_argument("--bridge-candles", choices=["rates", "ticks"], default="ticks")
+    # sweep
+    ap.add_argument("--concurrency", default="1,2,4,8,16,32")
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds measured per level")
+    ap.add_argument("--warmup", type=float, default=2.0, help="seconds run (not measured) before each level")
+    # burst
+    ap.add_argument("--clients", type=int, default=40)
+    ap.add_argument("--pairs", type=int, default=4, help="(symbol, tf) pairs per client")
+    ap.add_argument("--closes", type=int, default=15)
+    ap.add_argument("--bar-sec", type=float, default=2.0, help="seconds between simulated 1m closes")
+    ap.add_argument("--max-inflight", type=int, default=64)
+    # replay / record
+    ap.add_argument("--replay", default=None)
+    ap.add_argument("--speed", type=float, default=1.0)
+    ap.add_argument("--record", default=None, help="write every request as JSONL (replayable)")
+    ap.add_argument("--out", default=None, help="CSV of the result table")
+    args = ap.parse_args()
+
+    args.symbols = [s.strip().upper() for s in args.symbols.split(",") if s.strip()]
+    args.tfs = [t.strip().lower() for t in args.tfs.split(",") if t.strip()]
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    args.mix = {k.strip(): float(w) for k, _, w in (p.partition(":") for p in args.mix.split(",") if p.strip())}
+    if args.mode == "replay" and not args.replay:
+        ap.error("--mode replay needs --replay FILE")
+
+    now = int(time.time())
+    if args.mode == "candles":
+        print(f"[loadgen] stub candles on :{args.candles_port}", flush=True)
+        return serve_candles(args.candles_port, args.data_dir, args.symbols, args.tfs, now)
+
+    candles = mp.Process(target=serve_candles, daemon=True,
+                         args=(args.candles_port, args.data_dir, args.symbols, args.tfs, now))
+    candles.start()
+    server = bridge = None
+    rec = Recorder(args.record)
+    try:
+        wait_http(f"http://127.0.0.1:{args.candles_port}/health")
+        if args.bridge:
+            bridge = start_bridge(args, args.candles_port)
+        if args.url is None:
+            server = start_predict_server(args, args.candles_port)
+        url = args.url or f"http://127.0.0.1:{args.port}/predict"
+
+        payloads = Payloads(build_series(args.data_dir, args.symbols, [t for t in args.tfs if t in SHAPES], now), url)
+        pairs = [(s, t) for s in args.symbols for t in args.tfs if t in SHAPES]
+        print(f"[loadgen] {len(pairs)} (symbol, tf) pairs | mix {args.mix} | -> {url}", flush=True)
+
+        if args.mode == "sweep":
+            table = run_sweep(args, payloads, pairs, rec)
+        elif args.mode == "burst":
+            table = run_burst(args, payloads, pairs, rec, args.candles_port)
+        else:
+            table = run_replay(args, payloads, rec)
+
+        if args.out and table:
+            with open(args.out, "w", newline="") as f:
+                w = csv.DictWriter(f, fieldnames=list(table[0].keys()))
+                w.writeheader()
+                w.writerows(table)
+            print(f"\n✅ Saved {args.out}")
+        if args.record:
+            print(f"✅ Recorded traffic: {args.record}")
+    finally:
+        rec.close()
+        stop(server)
+        stop(bridge)
+        stop(candles)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+﻿"""
+Per-worker memory of predict_server under N workers, three ways:
+
+  plain    PRELOAD=1 uvicorn predict_server:app --workers N   (every worker loads its own copy)
+  shared   serve_shared.py --workers N --mode fork            (load once, fork; Linux / WSL)
+  mmap     serve_shared.py --workers N --mode mmap            (spawned workers map one weights file)
+
+Each server gets the same /predict traffic on every model first, then every
+process in its tree is sampled with psutil:
+  rss  resident pages (Windows: working set), shared ones counted in full for every process
+  pss  shared pages split between the processes mapping them (sums to the real total);
+       Linux only, from /proc/<pid>/smaps_rollup, blank elsewhere
+  uss  pages only this process holds (Windows: private working set), i.e.
+       what one more worker costs
+
+  python measure_workers.py --workers 4
+
+The default modes are the ones this OS can run (no `shared` without fork).
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import psutil
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MB = 1024 * 1024
+
+# (tf, T, F) as the served models expect them
+MODELS = [("1m", 256, 7), ("5m", 128, 7), ("15m", 60, 5), ("30m", 60, 5)]
+
+def start(mode, workers, port):
+    env = dict(os.environ, ORT_INTRA_THREADS="1", PYTHONUNBUFFERED="1")
+    if mode == "plain":
+        env["PRELOAD"] = "1"
+        cmd = [sys.executable, "-m", "uvicorn", "predict_server:app", "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, os.path.join(HERE, "serve_shared.py"), "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--mode", "fork" if mode == "shared" else "mmap"]
+    return subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+def wait_ready(proc, port, workers, timeout=120):
+    url = f"http://127.0.0.1:{port}/stream/stats"
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited: {proc.stderr.read().decode(errors='ignore')[-2000:]}")
+        kids = psutil.Process(proc.pid).children(recursive=True)
+        try:
+            if len(kids) >= workers and requests.get(url, timeout=1).ok:
+                return time.time() - t0
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError("server did not come up")
+
+def drive(port, n_requests, concurrency=8):
+    url = f"http://127.0.0.1:{port}/predict"
+    rng = np.random.default_rng(0)
+    bodies = []
+    for tf, T, F in MODELS:
+        x = rng.random((T, F), dtype=np.float32) + 1.0
+        bodies.append((tf, x.astype("<f4").tobytes(), f"1,{T},{F}"))
+
+    def one(i):
+        tf, body, shape = bodies[i % len(bodies)]
+        r = requests.post(url, params={"tf": tf}, data=body,
+                          headers={"Content-Type": "application/octet-stream", "X-Shape": shape}, timeout=30)
+        r.raise_for_status()
+
+    with ThreadPoolExecutor(concurrency) as ex:
+        list(ex.map(one, range(n_requests)))
+
+def sample(pid):
+    root = psutil.Process(pid)
+    rows = []
+    for p in [root] + root.children(recursive=True):
+        try:
+            m = p.memory_full_info()
+        except psutil.Error:
+            continue
+        if p.pid == pid:
+            role = "parent"
+        elif "resource_tracker" in " ".join(p.cmdline()):
+            role = "helper"          # multiprocessing's tracker under spawned workers
+        else:
+            role = "worker"
+        rows.append({"pid": p.pid, "role": role,
+                     "rss": m.rss / MB, "pss": getattr(m, "pss", float("nan")) / MB, "uss": m.uss / MB})
+    return rows
+
+def stop(proc):
+    # collected first: on Windows terminate() kills only the parent and orphans the workers
+    kids = psutil.Process(proc.pid).children(recursive=True)
+    proc.terminate()
+    try:
+        proc.wait(timeout=20)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    for p in kids:
+        try:
+            p.wait(timeout=5)
+        except psutil.TimeoutExpired:
+            p.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+def _mb(v):
+    return f"{v:.1f}" if np.isfinite(v) else "-"
+
+def measure(mode, workers, port, n_requests):
+    proc = start(mode, workers, port)
+    try:
+        up = wait_ready(proc, port, workers)
+        drive(port, n_requests)
+        time.sleep(0.5)
+        rows = sample(proc.pid)
+    finally:
+        stop(proc)
+    return up, rows
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--modes", default="plain,shared,mmap" if hasattr(os, "fork") else "plain,mmap")
+    ap.add_argument("--port", type=int, default=8790)
+    ap.add_argument("--requests", type=int, default=200, help="/predict calls spread over all models before sampling")
+    args = ap.parse_args()
+    modes = [m.strip() for m in args.modes.split(",")]
+    if "shared" in modes and not hasattr(os, "fork"):
+        print(f"[measure] mode 'shared' needs os.fork, not available on {sys.platform}", file=sys.stderr)
+        return 2
+    uss_name = "uss MB" if sys.platform != "win32" else "pws MB"    # private working set
+
+    summary = []
+    for k, mode in enumerate(modes):
+        up, rows = measure(mode, args.workers, args.port + k, args.requests)
+        print(f"\n[{mode}] {args.workers} workers, up in {up:.1f}s")
+        print(f"  {'role':<7} {'pid':>7} {'rss MB':>9} {'pss MB':>9} {uss_name:>9}")
+        for r in rows:
+            print(f"  {r['role']:<7} {r['pid']:>7} {r['rss']:>9.1f} {_mb(r['pss']):>9} {r['uss']:>9.1f}")
+        w = [r for r in rows if r["role"] == "worker"]
+        summary.append((mode, sum(r["rss"] for r in rows), sum(r["pss"] for r in rows),
+                        sum(r["uss"] for r in rows), float(np.mean([r["uss"] for r in w])) if w else float("nan")))
+
+    u = uss_name.split()[0]
+    print(f"\n  {'mode':<7} {'sum rss MB':>11} {'total pss MB':>13} {'sum ' + u + ' MB':>12} {u + '/worker MB':>14}")
+    for mode, rss, pss, uss_sum, uss in summary:
+        print(f"  {mode:<7} {rss:>11.1f} {_mb(pss):>13} {uss_sum:>12.1f} {uss:>14.1f}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,14 @@
-﻿from datetime import datetime, timezone, timedelta
+﻿import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import numpy as np
 import MetaTrader5 as mt5
 
+from candle_store import CandleStore, clean_symbol
+
 SYMBOLS = ["EURUSD_","XAUUSD_","BTCUSD","ETHUSD", "XAGUSD_"]
 
 TF_MAP = {
@@ -13,6 +21,9 @@ TF_MAP = {
   "1d":  mt5.TIMEFRAME_D1,
 }
 
+TF_SEC = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "4h": 14400, "1d": 86400}
+
+# how far back we are willing to go per tf
 RANGE_DAYS = {
   "1m": 7,
   "5m": 60,
@@ -24,34 +35,122 @@ RANGE_DAYS = {
 
 }
 
-def main():
-    if not mt5.initialize():
-        raise RuntimeError(f"MT5 init failed: {mt5.last_error()}")
+TARGET_BARS = 800      # what the bridge backfills
+# warmed bars are kept next to the server unless --no-store is given
+DEFAULT_STORE = os.getenv("CANDLE_STORE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "candles")
+FIRST_CHUNK = 500      # bars in the first request; doubles every step
+MAX_EMPTY = 3          # consecutive empty chunks => history exhausted
+
+def _utc(t):
+    return datetime.fromtimestamp(int(t), tz=timezone.utc)
 
-    print("[warmup] MT5 connected.")
+def warm_pair(sym, tf_name, target=TARGET_BARS, store_root=None):
+    """Walk back from now in doubling chunks until `target` bars are loaded
+    (or RANGE_DAYS is exhausted), instead of one huge range request.
 
-    for s in SYMBOLS:
-        mt5.symbol_select(s, True)
+    When the store already holds `target` bars only the bars after its last
+    one are fetched, and appended in place (safe next to a live bridge and
+    predict_server: writers share the store's lock, readers keep their maps)."""
+    t0 = time.time()
+    tf = TF_MAP[tf_name]
+    step = TF_SEC[tf_name]
+    mt5.symbol_select(sym, True)
+    store = CandleStore(store_root) if store_root else None
+    cached = store.count(clean_symbol(sym), tf_name) if store else 0
+    last = store.last_time(clean_symbol(sym), tf_name) if cached >= target else None
 
-    now = datetime.now(timezone.utc)
+    cur = mt5.copy_rates_from_pos(sym, tf, 0, 1)
+    if cur is not None and len(cur):
+        forming = int(cur["time"][0])
+    else:
+        now = int(datetime.now(timezone.utc).timestamp())
+        forming = now - now % step
+    end = forming + step
+    floor_t = end - RANGE_DAYS[tf_name] * 86400
+    if last is not None:
+        floor_t = max(floor_t, last + 1)
 
-    for sym in SYMBOLS:
-        for tf_name, tf in TF_MAP.items():
-            days = RANGE_DAYS[tf_name]
-            d1 = now - timedelta(days=days)
+    chunks = []
+    got = 0
+    span = FIRST_CHUNK
+    calls = 0
+    empty = 0
+    while got < target and end > floor_t:
+        start = max(end - span * step, floor_t)
+        rates = mt5.copy_rates_range(sym, tf, _utc(start), _utc(end - 1))
+        calls += 1
+        if rates is not None and len(rates):
+            chunks.append(rates)
+            got += len(rates)
+            empty = 0
+        else:
+            empty += 1
+            if empty >= MAX_EMPTY:
+                break
+        end = start
+        # grow, but don't ask for far more than is still missing
+        span = min(span * 2, max(2 * (target - got), FIRST_CHUNK))
 
-            # Ask for a date range (this often forces MT5 to download history)
-            rates = mt5.copy_rates_range(sym, tf, d1, now)
+    written = 0
+    if chunks:
+        arr = np.concatenate(chunks[::-1])
+        arr = arr[arr["time"] < forming]      # closed bars only
+        if store and len(arr):
+            write = store.append if last is not None else store.merge
+            written = write(clean_symbol(sym), tf_name, arr)
+
+    return {"symbol": sym, "tf": tf_name, "bars": got, "calls": calls, "written": written,
+            "cached": cached if last is not None else 0, "sec": time.time() - t0}
+
+def _line(r):
+    have = f" (+{r['cached']} in store)" if r["cached"] else ""
+    return f"[warmup] {r['symbol']} {r['tf']} -> {r['bars']} bars{have}, {r['calls']} calls, {r['sec']:.2f}s"
+
+def _init_worker():
+    if not mt5.initialize():
+        raise RuntimeError(f"MT5 init failed: {mt5.last_error()}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--jobs", type=int, default=4, help="pairs warmed concurrently (one MT5 connection each)")
+    ap.add_argument("--target", type=int, default=TARGET_BARS, help="bars wanted per (symbol, tf)")
+    ap.add_argument("--store", default=DEFAULT_STORE, help="candle store directory to keep what was fetched (default: CANDLE_STORE or server/candles)")
+    ap.add_argument("--no-store", action="store_true", help="only warm the terminal cache, do not keep the bars")
+    ap.add_argument("--symbols", default=None, help="comma list overriding SYMBOLS")
+    ap.add_argument("--tfs", default=None, help="comma list overriding TF_MAP keys")
+    args = ap.parse_args()
+    if args.no_store:
+        args.store = None
 
-            n = 0 if rates is None else len(rates)
-            print(f"[warmup] {sym} {tf_name} range({days}d) -> {n}")
+    symbols = [s.strip() for s in args.symbols.split(",")] if args.symbols else SYMBOLS
+    tfs = [t.strip() for t in args.tfs.split(",")] if args.tfs else list(TF_MAP)
+    pairs = [(s, t) for s in symbols for t in tfs]
 
-            # Then check how many bars we can fetch from_pos (what your bridge uses)
-            rates2 = mt5.copy_rates_from_pos(sym, tf, 0, 800)
-            n2 = 0 if rates2 is None else len(rates2)
-            print(f"[warmup] {sym} {tf_name} from_pos(800) -> {n2}")
+    t0 = time.time()
+    results = []
+    if args.jobs <= 1:
+        _init_worker()
+        print("[warmup] MT5 connected.")
+        for s, t in pairs:
+            r = warm_pair(s, t, args.target, args.store)
+            print(_line(r))
+            results.append(r)
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_worker) as ex:
+            futs = [ex.submit(warm_pair, s, t, args.target, args.store) for s, t in pairs]
+            for fu in as_completed(futs):
+                r = fu.result()
+                print(_line(r))
+                results.append(r)
 
-    print("[warmup] done.")
+    wall = time.time() - t0
+    busy = sum(r["sec"] for r in results)
+    short = [f"{r['symbol']} {r['tf']}" for r in results if r["bars"] + r["cached"] < args.target]
+    print(f"[warmup] done: {len(results)} pairs in {wall:.1f}s wall ({busy:.1f}s summed per-pair)")
+    if args.store:
+        print(f"[warmup] stored {sum(r['written'] for r in results)} new bars in {args.store}")
+    if short:
+        print(f"[warmup] below target ({args.target}): {', '.join(short)}")
 
 if __name__ == "__main__":
     main()
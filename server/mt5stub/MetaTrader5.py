@@ -0,0 +1,320 @@
+﻿"""
+Stub MetaTrader5 module for running the bridge/tools without a terminal.
+
+Usage (from server/):
+  PYTHONPATH=mt5stub python tawaqu3tickbridge.py --shards 2
+
+Prices are a deterministic function of (symbol, time), so every process
+sees the same history. FX/metal symbols are closed over the weekend
+(Fri 21:00 -> Sun 22:00 UTC); crypto trades 24/7.
+
+Env knobs:
+  MT5STUB_LATENCY_MS   sleep per API call (simulate terminal IPC cost)
+  MT5STUB_FAIL_INIT=1  make initialize() fail
+"""
+import os
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+
+TIMEFRAME_M1 = 1
+TIMEFRAME_M5 = 5
+TIMEFRAME_M15 = 15
+TIMEFRAME_M30 = 30
+TIMEFRAME_H1 = 16385
+TIMEFRAME_H4 = 16388
+TIMEFRAME_D1 = 16408
+
+COPY_TICKS_ALL = -1
+COPY_TICKS_INFO = 1
+COPY_TICKS_TRADE = 2
+
+_TF_SEC = {
+  TIMEFRAME_M1: 60,
+  TIMEFRAME_M5: 300,
+  TIMEFRAME_M15: 900,
+  TIMEFRAME_M30: 1800,
+  TIMEFRAME_H1: 3600,
+  TIMEFRAME_H4: 14400,
+  TIMEFRAME_D1: 86400,
+}
+
+RATES_DTYPE = np.dtype([
+  ("time", "<i8"),
+  ("open", "<f8"),
+  ("high", "<f8"),
+  ("low", "<f8"),
+  ("close", "<f8"),
+  ("tick_volume", "<u8"),
+  ("spread", "<i4"),
+  ("real_volume", "<u8"),
+])
+
+TICKS_DTYPE = np.dtype([
+  ("time", "<i8"),
+  ("bid", "<f8"),
+  ("ask", "<f8"),
+  ("last", "<f8"),
+  ("volume", "<u8"),
+  ("time_msc", "<i8"),
+  ("flags", "<u4"),
+  ("volume_real", "<f8"),
+])
+TICK_EVERY_MS = 500
+
+Tick = namedtuple("Tick", "time bid ask last volume time_msc flags volume_real")
+SymbolInfo = namedtuple("SymbolInfo", "name digits point trade_tick_size trade_tick_value trade_contract_size spread")
+
+_BASE = {
+  "XAUUSD": (4300.0, 2),
+  "XAGUSD": (52.0, 3),
+  "EURUSD": (1.08, 5),
+  "BTCUSD": (95000.0, 2),
+  "ETHUSD": (3400.0, 2),
+}
+_CRYPTO = {"BTCUSD", "ETHUSD"}
+
+# weekly closure for non-crypto, seconds since Monday 00:00 UTC
+_WEEK = 7 * 86400
+_CLOSE_FROM = 4 * 86400 + 21 * 3600
+_CLOSE_TO = 6 * 86400 + 22 * 3600
+
+_state = {"init": False, "selected": set(), "error": (1, "Success")}
+
+def _latency():
+  ms = float(os.getenv("MT5STUB_LATENCY_MS", "0") or 0)
+  if ms > 0:
+    time.sleep(ms / 1000.0)
+
+def _clean(symbol):
+  return "".join(ch for ch in str(symbol).upper() if ch.isalnum())
+
+def _base(symbol):
+  s = _clean(symbol)
+  if s in _BASE:
+    return _BASE[s]
+  h = zlib.crc32(s.encode()) % 1000
+  return (10.0 + h, 3)
+
+def _is_open(symbol, t):
+  t = np.asarray(t, dtype=np.int64)
+  if _clean(symbol) in _CRYPTO:
+    return np.ones(t.shape, dtype=bool)
+  w = (t + 3 * 86400) % _WEEK
+  return (w < _CLOSE_FROM) | (w >= _CLOSE_TO)
+
+def _noise(seed, k):
+  # splitmix64 -> uniform [-1, 1)
+  with np.errstate(over="ignore"):
+    z = (np.asarray(k, dtype=np.uint64) + np.uint64(seed)) * np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+  return (z >> np.uint64(11)).astype(np.float64) / float(1 << 52) - 1.0
+
+def _price(symbol, t):
+  """Mid price at epoch seconds t (vectorized)."""
+  base, _ = _base(symbol)
+  seed = zlib.crc32(_clean(symbol).encode())
+  t = np.asarray(t, dtype=np.float64)
+  m = t / 60.0
+  drift = 0.004 * np.sin(m / 977.0) + 0.002 * np.sin(m / 97.0) + 0.0008 * np.sin(m / 13.7)
+  jitter = 0.0003 * _noise(seed, np.floor(t / 15.0).astype(np.int64))
+  return base * (1.0 + drift + jitter)
+
+def _bar_times_back(symbol, step, last_start, count):
+  """`count` open bar start times ending at last_start (inclusive), oldest first."""
+  out = []
+  have = 0
+  cur = int(last_start)
+  while have < count:
+    n = max(64, int((count - have) * 1.5))
+    cand = cur - step * np.arange(n, dtype=np.int64)
+    cand = cand[_is_open(symbol, cand)]
+    take = cand[: count - have]
+    out.append(take)
+    have += len(take)
+    cur = int(cur - step * n)
+    if cur < 0:
+      break
+  if not out:
+    return np.zeros(0, dtype=np.int64)
+  return np.concatenate(out)[::-1].copy()
+
+def _bars(symbol, step, starts, now):
+  _, digits = _base(symbol)
+  k = 8
+  frac = np.linspace(0.0, 1.0, k + 1)
+  ends = np.minimum(starts + step, now)
+  pts = starts[:, None] + (ends - starts)[:, None] * frac[None, :]
+  path = _price(symbol, pts)
+  seed = zlib.crc32(_clean(symbol).encode()) ^ 0x5A5A
+  r = np.empty(len(starts), dtype=RATES_DTYPE)
+  r["time"] = starts
+  r["open"] = np.round(path[:, 0], digits)
+  r["close"] = np.round(path[:, -1], digits)
+  wick = 1.0 + 0.0002 * np.abs(_noise(seed, starts))
+  r["high"] = np.round(path.max(axis=1) * wick, digits)
+  r["low"] = np.round(path.min(axis=1) / wick, digits)
+  vol = (step / 60.0) * (40.0 + 30.0 * np.abs(_noise(seed + 1, starts)))
+  r["tick_volume"] = np.maximum(1, np.round(vol * (ends - starts) / step)).astype(np.uint64)
+  r["spread"] = 10
+  r["real_volume"] = 0
+  return r
+
+def _now():
+  return int(time.time())
+
+def _to_epoch(d):
+  if isinstance(d, datetime):
+    if d.tzinfo is None:
+      d = d.replace(tzinfo=timezone.utc)
+    return int(d.timestamp())
+  return int(d)
+
+def _ok():
+  _state["error"] = (1, "Success")
+
+def _fail(code, msg):
+  _state["error"] = (code, msg)
+  return None
+
+# ---------------- public API (subset of MetaTrader5) ----------------
+def initialize(path=None, **kwargs):
+  _latency()
+  if os.getenv("MT5STUB_FAIL_INIT", "0") == "1":
+    _state["error"] = (-10005, "IPC timeout")
+    return False
+  _state["init"] = True
+  _ok()
+  return True
+
+def shutdown():
+  _state["init"] = False
+  return True
+
+def last_error():
+  return _state["error"]
+
+def symbol_select(symbol, enable=True):
+  _latency()
+  if not _state["init"]:
+    _fail(-10004, "No IPC connection")
+    return False
+  if enable:
+    _state["selected"].add(symbol)
+  else:
+    _state["selected"].discard(symbol)
+  _ok()
+  return True
+
+def symbol_info(symbol):
+  _latency()
+  if not _state["init"]:
+    return _fail(-10004, "No IPC connection")
+  _, digits = _base(symbol)
+  point = 10.0 ** -digits
+  return SymbolInfo(symbol, digits, point, point, 1.0, 100.0, 10)
+
+def symbol_info_tick(symbol):
+  _latency()
+  if not _state["init"]:
+    return _fail(-10004, "No IPC connection")
+  now = time.time()
+  t = int(now)
+  if not bool(_is_open(symbol, t)):
+    w = (t + 3 * 86400) % _WEEK
+    t = t - (w - _CLOSE_FROM) - 1
+    now = float(t)
+  _, digits = _base(symbol)
+  mid = float(_price(symbol, now))
+  half = 5 * 10.0 ** -digits
+  _ok()
+  return Tick(t, round(mid - half, digits), round(mid + half, digits), 0.0, 0, int(now * 1000), 6, 0.0)
+
+def _ticks(symbol, msc):
+  msc = msc[_is_open(symbol, msc // 1000)]
+  _, digits = _base(symbol)
+  mid = _price(symbol, msc / 1000.0)
+  half = 5 * 10.0 ** -digits
+  out = np.zeros(len(msc), dtype=TICKS_DTYPE)
+  out["time"] = msc // 1000
+  out["bid"] = np.round(mid - half, digits)
+  out["ask"] = np.round(mid + half, digits)
+  out["time_msc"] = msc
+  out["flags"] = 6
+  return out
+
+def copy_ticks_from(symbol, date_from, count, flags):
+  """Ticks every TICK_EVERY_MS from date_from (seconds), at most `count`, up to now."""
+  _latency()
+  if not _state["init"]:
+    return _fail(-10004, "No IPC connection")
+  a = _to_epoch(date_from) * 1000
+  a += (-a) % TICK_EVERY_MS
+  b = int(time.time() * 1000)
+  if b < a:
+    _ok()
+    return np.zeros(0, dtype=TICKS_DTYPE)
+  msc = np.arange(a, min(b, a + int(count) * TICK_EVERY_MS - 1) + 1, TICK_EVERY_MS, dtype=np.int64)
+  _ok()
+  return _ticks(symbol, msc)[: int(count)]
+
+def copy_ticks_range(symbol, date_from, date_to, flags):
+  _latency()
+  if not _state["init"]:
+    return _fail(-10004, "No IPC connection")
+  a = _to_epoch(date_from) * 1000
+  a += (-a) % TICK_EVERY_MS
+  b = min(_to_epoch(date_to) * 1000, int(time.time() * 1000))
+  msc = np.arange(a, b + 1, TICK_EVERY_MS, dtype=np.int64) if b >= a else np.zeros(0, dtype=np.int64)
+  _ok()
+  return _ticks(symbol, msc)
+
+def copy_rates_from_pos(symbol, timeframe, start_pos, count):
+  _latency()
+  if not _state["init"]:
+    return _fail(-10004, "No IPC connection")
+  step = _TF_SEC.get(timeframe)
+  if step is None or count <= 0:
+    return _fail(-2, "Invalid params")
+  now = _now()
+  times = _bar_times_back(symbol, step, now - now % step, int(start_pos) + int(count))
+  times = times[: len(times) - int(start_pos)] if start_pos else times
+  _ok()
+  return _bars(symbol, step, times, now)
+
+def copy_rates_from(symbol, timeframe, date_from, count):
+  _latency()
+  if not _state["init"]:
+    return _fail(-10004, "No IPC connection")
+  step = _TF_SEC.get(timeframe)
+  if step is None or count <= 0:
+    return _fail(-2, "Invalid params")
+  now = _now()
+  t = min(_to_epoch(date_from), now)
+  times = _bar_times_back(symbol, step, t - t % step, int(count))
+  _ok()
+  return _bars(symbol, step, times, now)
+
+def copy_rates_range(symbol, timeframe, date_from, date_to):
+  _latency()
+  if not _state["init"]:
+    return _fail(-10004, "No IPC connection")
+  step = _TF_SEC.get(timeframe)
+  if step is None:
+    return _fail(-2, "Invalid params")
+  now = _now()
+  a = _to_epoch(date_from)
+  b = min(_to_epoch(date_to), now)
+  first = a + (-a) % step
+  if b < first:
+    _ok()
+    return np.zeros(0, dtype=RATES_DTYPE)
+  times = np.arange(first, b + 1, step, dtype=np.int64)
+  times = times[_is_open(symbol, times)]
+  _ok()
+  return _bars(symbol, step, times, now)
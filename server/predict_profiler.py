@@ -0,0 +1,308 @@
+﻿"""
+Opt-in request profiling for predict_server.
+
+Two kinds of capture, written to one directory that keeps the newest
+`keep` files of each kind:
+
+  *.ort.json   ORT per-node profile. enable_profiling slows every run of a
+               session, so served sessions never have it; instead the
+               request's input is replayed on a background thread through a
+               fresh profiling session of the same model file (profiling
+               stops for good at end_profiling). Taken for a `sample`
+               fraction of requests and for every request over `slow_ms`.
+  *.pstats     cProfile of a request. Runs for a `py_sample` fraction of
+               requests, and for the next `arm` requests of a model after
+               one of its requests was slow; saved only when the profiled
+               request is itself over `slow_ms`. One request at a time is
+               profiled (others run unprofiled): on Python 3.12+ cProfile
+               is built on sys.monitoring, allows one active profiler per
+               interpreter and records every thread, so a capture there
+               also contains whatever the other requests ran meanwhile.
+
+File names are <stamp>-<pid>-<model>-<reason>-<ms>ms.<kind>, so forked
+workers can share the directory. summary() folds the files back into the
+hottest ORT operators / nodes and Python frames per model.
+"""
+from __future__ import annotations
+
+import cProfile
+import glob
+import json
+import os
+import pstats
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import onnxruntime as ort
+
+ORT_SUFFIX = ".ort.json"
+PY_SUFFIX = ".pstats"
+
+# replays queued at once; further triggers are counted as skipped
+MAX_PENDING_REPLAYS = 2
+
+RunFn = Callable[[ort.InferenceSession, np.ndarray], Any]
+
+def _parse_name(path: str) -> Optional[Dict[str, Any]]:
+    base = os.path.basename(path)
+    for suffix in (ORT_SUFFIX, PY_SUFFIX):
+        if base.endswith(suffix):
+            parts = base[: -len(suffix)].split("-")
+            if len(parts) == 5 and parts[4].endswith("ms"):
+                return {"file": base, "stamp": parts[0], "pid": int(parts[1]), "model": parts[2],
+                        "reason": parts[3], "ms": float(parts[4][:-2])}
+    return None
+
+def ort_ops(path: str) -> Dict[str, Any]:
+    """Node times of the last model_run in an ORT profile (earlier runs are warm-up)."""
+    with open(path) as f:
+        events = json.load(f)
+    runs = [e for e in events if e.get("cat") == "Session" and e.get("name") == "model_run"]
+    last = runs[-1] if runs else None
+    ops: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0])
+    nodes: Dict[str, float] = defaultdict(float)
+    for e in events:
+        if e.get("cat") != "Node" or not e.get("name", "").endswith("_kernel_time"):
+            continue
+        if last is not None and not (last["ts"] <= e["ts"] <= last["ts"] + last["dur"]):
+            continue
+        op = e.get("args", {}).get("op_name", "?")
+        ops[op][0] += e["dur"]
+        ops[op][1] += 1
+        nodes[f"{e['name'][:-len('_kernel_time')]} ({op})"] += e["dur"]
+    return {"run_us": float(last["dur"]) if last else float("nan"),
+            "ops": {k: (v[0], v[1]) for k, v in ops.items()}, "nodes": dict(nodes)}
+
+class RequestProfiler:
+    def __init__(self, out_dir: str, sample: float = 0.0, slow_ms: float = 0.0, py_sample: float = 0.0,
+                 arm: int = 5, keep: int = 200, intra_threads: int = 0):
+        self.out_dir = out_dir
+        self.sample = float(sample)
+        self.slow_ms = float(slow_ms)
+        self.py_sample = float(py_sample)
+        self.arm = int(arm)
+        self.keep = int(keep)
+        self.intra_threads = int(intra_threads)
+        self.enabled = self.sample > 0 or self.slow_ms > 0 or self.py_sample > 0
+
+        self._lock = threading.Lock()
+        self._py_lock = threading.Lock()       # held while a cProfile is running
+        self._armed: Dict[str, int] = defaultdict(int)
+        self._pending = 0
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._ort_cache: Dict[str, Dict[str, Any]] = {}
+        self.stats = {"requests": 0, "slow": 0, "ort_replays": 0, "py_profiles": 0, "py_saved": 0,
+                      "py_busy": 0, "skipped": 0, "errors": 0}
+
+    # ---------------- per request ----------------
+    def begin(self, model: str) -> Optional[cProfile.Profile]:
+        """Called on the request thread before the work; returns a running
+        cProfile when this request should be profiled in Python."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self.stats["requests"] += 1
+            on = self._armed[model] > 0
+            if on:
+                self._armed[model] -= 1
+        if not on and not (self.py_sample > 0 and random.random() < self.py_sample):
+            return None
+        if not self._py_lock.acquire(blocking=False):
+            self.stats["py_busy"] += 1
+            return None
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # another profiler (debugger, coverage, ...) owns the hook on 3.12+
+            self._py_lock.release()
+            self.stats["py_busy"] += 1
+            return None
+        return prof
+
+    def abort(self, prof: Optional[cProfile.Profile]) -> None:
+        """Stop a profile from begin() without recording it (request failed)."""
+        if prof is not None:
+            prof.disable()
+            self._py_lock.release()
+
+    def end(self, model: str, model_path: str, X: Optional[np.ndarray], ms: float,
+            prof: Optional[cProfile.Profile], run: RunFn) -> None:
+        """Called on the request thread after the work (ms = request latency)."""
+        if prof is not None:
+            prof.disable()
+            self._py_lock.release()
+        if not self.enabled:
+            return
+        slow = self.slow_ms > 0 and ms >= self.slow_ms
+        if slow:
+            with self._lock:
+                self.stats["slow"] += 1
+                self._armed[model] = max(self._armed[model], self.arm)
+        if prof is not None:
+            self.stats["py_profiles"] += 1
+            if slow:
+                self._save_pstats(prof, model, ms)
+        if X is None:
+            return
+        reason = "slow" if slow else ("sample" if self.sample > 0 and random.random() < self.sample else None)
+        if reason is not None:
+            self._submit_replay(model, model_path, X, ms, reason, run)
+
+    # ---------------- captures ----------------
+    def _name(self, model: str, reason: str, ms: float, suffix: str) -> str:
+        t = time.time()
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(t)) + f"{int(t * 1000) % 1000:03d}"
+        return os.path.join(self.out_dir, f"{stamp}-{os.getpid()}-{model}-{reason}-{ms:.0f}ms{suffix}")
+
+    def _save_pstats(self, prof: cProfile.Profile, model: str, ms: float) -> None:
+        os.makedirs(self.out_dir, exist_ok=True)
+        prof.dump_stats(self._name(model, "slow", ms, PY_SUFFIX))
+        self.stats["py_saved"] += 1
+        self._rotate(PY_SUFFIX)
+
+    def _submit_replay(self, model, model_path, X, ms, reason, run) -> None:
+        with self._lock:
+            if self._pending >= MAX_PENDING_REPLAYS:
+                self.stats["skipped"] += 1
+                return
+            self._pending += 1
+            if self._pool is None:
+                # created lazily: serve_shared.py forks after import, threads must start in the worker
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile")
+        self._pool.submit(self._replay, model, model_path, X, ms, reason, run)
+
+    def _replay(self, model, model_path, X, ms, reason, run) -> None:
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            so = ort.SessionOptions()
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.intra_threads > 0:
+                so.intra_op_num_threads = self.intra_threads
+            so.enable_profiling = True
+            so.profile_file_prefix = os.path.join(self.out_dir, f".tmp-{os.getpid()}-{model}")
+            sess = ort.InferenceSession(model_path, sess_options=so, providers=["CPUExecutionProvider"])
+            run(sess, X)        # warm-up: arena growth, first-run allocations
+            run(sess, X)
+            tmp = sess.end_profiling()
+            os.replace(tmp, self._name(model, reason, ms, ORT_SUFFIX))
+            self.stats["ort_replays"] += 1
+            self._rotate(ORT_SUFFIX)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[profile] replay of {model} failed: {e}", flush=True)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _rotate(self, suffix: str) -> None:
+        files = sorted(glob.glob(os.path.join(self.out_dir, f"*{suffix}")), key=os.path.basename)
+        for p in files[: max(0, len(files) - self.keep)]:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+            self._ort_cache.pop(p, None)
+
+    # ---------------- summary ----------------
+    def captures(self) -> List[Dict[str, Any]]:
+        out = []
+        for p in glob.glob(os.path.join(self.out_dir, "*")):
+            meta = _parse_name(p)
+            if meta is not None:
+                meta["kind"] = "ort" if p.endswith(ORT_SUFFIX) else "python"
+                out.append(meta)
+        return sorted(out, key=lambda m: m["file"])
+
+    def _ort(self, path: str) -> Dict[str, Any]:
+        if path not in self._ort_cache:
+            self._ort_cache[path] = ort_ops(path)
+        return self._ort_cache[path]
+
+    def summary(self, model: Optional[str] = None, top: int = 10) -> Dict[str, Any]:
+        by_model: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for c in self.captures():
+            if model is None or c["model"] == model:
+                by_model[c["model"]].append(c)
+
+        models = {}
+        for m, caps in sorted(by_model.items()):
+            ort_caps = [c for c in caps if c["kind"] == "ort"]
+            py_caps = [c for c in caps if c["kind"] == "python"]
+            models[m] = {
+                "captures": {"ort": len(ort_caps), "python": len(py_caps)},
+                # latency of the captured requests (a slow request can have both kinds of file)
+                "request_ms": _ms_summary([c["ms"] for c in (ort_caps or py_caps)]),
+                "ort": self._ort_summary(ort_caps, top),
+                "python": _py_summary([os.path.join(self.out_dir, c["file"]) for c in py_caps], top),
+                "recent": [c["file"] for c in caps[-5:]],
+            }
+        return {
+            "enabled": self.enabled,
+            "dir": self.out_dir,
+            "config": {"sample": self.sample, "slow_ms": self.slow_ms, "py_sample": self.py_sample,
+                       "arm": self.arm, "keep": self.keep},
+            "stats": dict(self.stats),
+            "models": models,
+        }
+
+    def _ort_summary(self, caps: List[Dict[str, Any]], top: int) -> Dict[str, Any]:
+        if not caps:
+            return {}
+        ops: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0])
+        nodes: Dict[str, float] = defaultdict(float)
+        run_us = []
+        for c in caps:
+            try:
+                r = self._ort(os.path.join(self.out_dir, c["file"]))
+            except (OSError, ValueError):
+                continue
+            run_us.append(r["run_us"])
+            for k, (us, n) in r["ops"].items():
+                ops[k][0] += us
+                ops[k][1] += n
+            for k, us in r["nodes"].items():
+                nodes[k] += us
+        total = sum(v[0] for v in ops.values()) or 1.0
+        n = max(len(run_us), 1)
+        return {
+            "replays": len(run_us),
+            "replay_run_ms": _ms_summary([u / 1000.0 for u in run_us]),
+            "ops": [{"op": k, "pct": round(100.0 * us / total, 1), "us_per_run": round(us / n, 1), "nodes_per_run": round(cnt / n, 1)}
+                    for k, (us, cnt) in sorted(ops.items(), key=lambda kv: -kv[1][0])[:top]],
+            "nodes": [{"node": k, "pct": round(100.0 * us / total, 1), "us_per_run": round(us / n, 1)}
+                      for k, us in sorted(nodes.items(), key=lambda kv: -kv[1])[:top]],
+        }
+
+def _ms_summary(ms: List[float]) -> Dict[str, float]:
+    if not ms:
+        return {}
+    a = np.asarray(ms, dtype=np.float64)
+    return {"n": int(a.size), "p50": round(float(np.percentile(a, 50)), 3),
+            "max": round(float(a.max()), 3)}
+
+def _py_summary(paths: List[str], top: int) -> List[Dict[str, Any]]:
+    """Frames with the most own time across the captured requests."""
+    st: Optional[pstats.Stats] = None
+    for p in paths:
+        try:
+            if st is None:
+                st = pstats.Stats(p)
+            else:
+                st.add(p)
+        except (OSError, TypeError, EOFError, ValueError):
+            continue
+    if st is None:
+        return []
+    rows = []
+    n = max(len(paths), 1)
+    for (file, line, func), (cc, nc, tt, ct, _callers) in st.stats.items():
+        rows.append({"frame": f"{os.path.basename(file)}:{line}({func})", "calls_per_req": round(nc / n, 1),
+                     "self_ms_per_req": round(1000.0 * tt / n, 3), "cum_ms_per_req": round(1000.0 * ct / n, 3)})
+    rows.sort(key=lambda r: -r["self_ms_per_req"])
+    return rows[:top]
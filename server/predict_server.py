@@ -1,16 +1,31 @@
 ﻿from __future__ import annotations
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
 from typing import Optional, List, Dict, Any, Tuple
 from pathlib import Path
+from datetime import datetime, timezone
 import os
+import io
+import json
+import asyncio
 import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import base64
 import numpy as np
 import requests
 import onnxruntime as ort
 
+from candle_store import FEATURE_COLS, store_from_base, parse_time, clean_symbol
+from candle_audit import audit_times
+from predict_profiler import RequestProfiler
+import shared_weights
+
 app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
@@ -26,6 +41,15 @@ ICT_DIR = (PROJ / "assets" / "models" / "ict").resolve()
 SMC_DIR = (PROJ / "assets" / "models" / "smc").resolve()
 
 CANDLES_BASE = os.getenv("CANDLES_BASE", "http://127.0.0.1:8080/candles")
+# file:///path (or a plain directory) => read the bridge's local candle store
+_STORE = store_from_base(CANDLES_BASE)
+
+# refuse candle windows that would need padding or hold duplicate/out-of-order bars
+READY_GATE = os.getenv("READY_GATE", "1") == "1"
+# also refuse windows with more than this many missing in-session bars (-1 = ignore gaps)
+MAX_WINDOW_MISSING = int(os.getenv("MAX_WINDOW_MISSING", "-1"))
+# stamped on Node candles that carry no time; such windows cannot be audited
+NO_TIME = -1
 
 def _softmax(x: np.ndarray) -> np.ndarray:
     x = x.astype(np.float64)
@@ -35,34 +59,86 @@ def _softmax(x: np.ndarray) -> np.ndarray:
     return (e / s) if s != 0 else np.array([0.5, 0.5], dtype=np.float64)
 
 def _sigmoid(x: float) -> float:
-    return 1.0 / (1.0 + math.exp(-x))
+    # no OverflowError for large |x|
+    if x >= 0:
+        return 1.0 / (1.0 + math.exp(-x))
+    e = math.exp(x)
+    return e / (1.0 + e)
+
+# ORT intra-op threads per session (0 = ORT default). serve_shared.py sets 1:
+# ORT's thread pool does not survive fork, and each forked worker owns a core anyway.
+ORT_INTRA_THREADS = int(os.getenv("ORT_INTRA_THREADS", "0"))
+# SHARED_WEIGHTS=1: large initializers are memory-mapped from WEIGHTS_DIR (see shared_weights.py),
+# so workers share one copy without fork, e.g. `uvicorn --workers N` on Windows
+SHARED_WEIGHTS = os.getenv("SHARED_WEIGHTS", "0") == "1"
+WEIGHTS_DIR = Path(os.getenv("WEIGHTS_DIR", str(PROJ / "data" / "weights")))
 
 def _load_session(path: Path) -> ort.InferenceSession:
     if not path.exists():
         raise FileNotFoundError(str(path))
     so = ort.SessionOptions()
     so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if ORT_INTRA_THREADS > 0:
+        so.intra_op_num_threads = ORT_INTRA_THREADS
+    if SHARED_WEIGHTS:
+        return shared_weights.session(path, so, WEIGHTS_DIR)
     return ort.InferenceSession(str(path), sess_options=so, providers=["CPUExecutionProvider"])
 
-_SESS: Dict[str, ort.InferenceSession] = {}
-
-def _get_sess(model_key: str) -> ort.InferenceSession:
-    if model_key in _SESS:
-        return _SESS[model_key]
-
+_SESS: Dict[Tuple[str, bool], ort.InferenceSession] = {}
+_SESS_BY_PATH: Dict[str, ort.InferenceSession] = {}
+
+# what client payloads (features / features_b64 / binary bodies) hold when the request does not
+# say (input_format): 0 => windows already normalized by build_feature_window, 1 => raw OHLCV.
+# Windows the server fetches itself are raw and always go to the *_raw graph when one exists.
+RAW_MODELS = os.getenv("RAW_MODELS", "0") == "1"
+INPUT_FORMATS = ("features", "raw_ohlcv")
+
+def _model_file(d: Path, key: str, raw: bool = False) -> Path:
+    # offline-optimized graphs written by training/export_onnx.py first
+    names = [f"{key}.opt.onnx", f"{key}.onnx"]
+    if raw:
+        # graphs with build_feature_window folded in; models without one (ICT) take the window as-is
+        names = [f"{key}_raw.opt.onnx", f"{key}_raw.onnx"] + names
+    for n in names:
+        if (d / n).exists():
+            return d / n
+    return d / f"{key}.onnx"
+
+# graphs without an input_format tag: ICT has always been fed raw OHLCV windows (the server's
+# own candles and the clients' alike); plain SMC graphs take build_feature_window output
+_UNTAGGED_FORMAT = {"ict_1m": "raw_ohlcv", "ict_5m": "raw_ohlcv"}
+
+def _input_format(sess: ort.InferenceSession, model_key: str) -> str:
+    # "raw_ohlcv" when the graph takes plain bars (normalization inside or none needed), else "features"
+    return sess.get_modelmeta().custom_metadata_map.get("input_format", _UNTAGGED_FORMAT.get(model_key, "features"))
+
+_SESS_LOCK = threading.Lock()
+
+def _get_sess(model_key: str, raw: bool = False) -> ort.InferenceSession:
+    k = (model_key, raw)
+    if k in _SESS:
+        return _SESS[k]
+    with _SESS_LOCK:
+        if k not in _SESS:
+            # raw and normalized lookups share a session when they resolve to the same file
+            p = _session_path(model_key, raw)
+            if str(p) not in _SESS_BY_PATH:
+                _SESS_BY_PATH[str(p)] = _load_session(p)
+            _SESS[k] = _SESS_BY_PATH[str(p)]
+    return _SESS[k]
+
+def _session_path(model_key: str, raw: bool = False) -> Path:
     if model_key == "ict_1m":
-        p = ICT_DIR / "ict_1m.onnx"
+        p = _model_file(ICT_DIR, "ict_1m", raw)
     elif model_key == "ict_5m":
-        p = ICT_DIR / "ict_5m.onnx"
+        p = _model_file(ICT_DIR, "ict_5m", raw)
     elif model_key == "smc_15m":
-        p = SMC_DIR / "smc_15m.onnx"
+        p = _model_file(SMC_DIR, "smc_15m", raw)
     elif model_key == "smc_30m":
-        p = SMC_DIR / "smc_30m.onnx"
+        p = _model_file(SMC_DIR, "smc_30m", raw)
     else:
         raise KeyError(model_key)
-
-    _SESS[model_key] = _load_session(p)
-    return _SESS[model_key]
+    return p
 
 def _pick_model(tf: str) -> Tuple[str, str]:
     t = tf.lower().strip()
@@ -89,6 +165,14 @@ def _infer_expected_shape(sess: ort.InferenceSession, fallback_T: int, fallback_
             F = shape[2]
     return T, F
 
+def _model_shape(tf: str, raw: bool = False) -> Tuple[str, str, ort.InferenceSession, int, int]:
+    school, model_key = _pick_model(tf)
+    sess = _get_sess(model_key, raw)
+    fallback_T = 60 if school == "ICT" else 256
+    fallback_F = 5  if school == "ICT" else 7
+    T, F = _infer_expected_shape(sess, fallback_T=fallback_T, fallback_F=fallback_F)
+    return school, model_key, sess, T, F
+
 def _normalize_candle_row(c: Dict[str, Any]) -> Dict[str, float]:
     def g(*keys, default=0.0):
         for k in keys:
@@ -119,24 +203,58 @@ def _fetch_candles(symbol: str, tf: str, limit: int) -> List[Dict[str, Any]]:
         candles = []
     return candles
 
-def _build_X_from_candles(candles: List[Dict[str, Any]], T: int, F: int) -> np.ndarray:
+def _rows_from_candles(candles: List[Dict[str, Any]]) -> np.ndarray:
+    # (n, 7): open, high, low, close, volume, spread, real_volume
     rows = []
     for c in candles:
         row = _normalize_candle_row(c)
+        rows.append([row["open"], row["high"], row["low"], row["close"], row["volume"], row["spread"], row["real_volume"]])
+    if not rows:
+        return np.zeros((0, 7), dtype=np.float32)
+    return np.array(rows, dtype=np.float32)
+
+def _fetch_window(symbol: str, tf: str, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Last `limit` bars as (times int64 (n,), rows float32 (n, 7)), from the local store or Node."""
+    if _STORE is not None:
+        bars = _STORE.tail(symbol, tf, limit)
+        rows = np.empty((len(bars), 7), dtype=np.float32)
+        for j, k in enumerate(FEATURE_COLS):
+            rows[:, j] = bars[k]
+        return bars["time"], rows
+    candles = _fetch_candles(symbol, tf, limit=limit)
+    times = np.array([parse_time(c["time"]) if c.get("time") is not None else NO_TIME for c in candles], dtype=np.int64)
+    return times, _rows_from_candles(candles)
+
+def _check_ready(symbol: str, tf: str, times: np.ndarray, T: int) -> None:
+    w = times[-T:]
+    no_time = int(np.count_nonzero(w == NO_TIME))
+    if no_time:
+        # duplicates/order/gaps are unknowable without times; only the bar count can be checked
+        if w.size >= T:
+            return
+        raise HTTPException(status_code=503, detail={
+            "error": "history not ready",
+            "symbol": symbol, "tf": tf, "need": T, "have": int(w.size), "no_time": no_time,
+        })
+    rep = audit_times(w, tf, symbol=symbol.upper(), min_bars=T)
+    if rep["ready"] and (MAX_WINDOW_MISSING < 0 or rep["missing"] <= MAX_WINDOW_MISSING):
+        return
+    raise HTTPException(status_code=503, detail={
+        "error": "history not ready",
+        "symbol": symbol, "tf": tf, "need": T, "have": rep["count"],
+        "duplicates": rep["duplicates"], "out_of_order": rep["out_of_order"], "missing": rep["missing"],
+    })
 
-        # ICT expects 5 features; SMC expects 7
-        base = [row["open"], row["high"], row["low"], row["close"], row["volume"]]
-        if F >= 7:
-            base += [row["spread"], row["real_volume"]]
-        # pad/truncate to F
-        if len(base) < F:
-            base += [0.0] * (F - len(base))
-        base = base[:F]
-        rows.append(base)
+def _build_X_from_candles(candles: List[Dict[str, Any]], T: int, F: int) -> np.ndarray:
+    return _build_X_from_rows(_rows_from_candles(candles), T=T, F=F)
 
-    arr = np.array(rows, dtype=np.float32)
-    if arr.size == 0:
-        arr = np.zeros((0, F), dtype=np.float32)
+def _build_X_from_rows(rows: np.ndarray, T: int, F: int) -> np.ndarray:
+    # ICT expects 5 features; SMC expects 7
+    arr = rows[:, :7] if F >= 7 else rows[:, :5]
+    # pad/truncate to F
+    if arr.shape[1] < F:
+        arr = np.hstack([arr, np.zeros((arr.shape[0], F - arr.shape[1]), dtype=np.float32)])
+    arr = arr[:, :F].astype(np.float32, copy=False)
 
     # pad/trim time dimension
     if arr.shape[0] < T:
@@ -150,8 +268,8 @@ def _build_X_from_candles(candles: List[Dict[str, Any]], T: int, F: int) -> np.n
 
     return arr.reshape(1, T, F).astype(np.float32)
 
-def _build_X_from_flat_features(features: List[float], T: int, F: int) -> np.ndarray:
-    a = np.array(features, dtype=np.float32).reshape(-1)
+def _build_X_from_flat_features(features: Any, T: int, F: int) -> np.ndarray:
+    a = np.asarray(features, dtype=np.float32).reshape(-1)
     # try to reshape smartly
     if a.size == T * F:
         arr = a.reshape(T, F)
@@ -179,11 +297,93 @@ def _build_X_from_flat_features(features: List[float], T: int, F: int) -> np.nda
 
     return arr.reshape(1, T, F).astype(np.float32)
 
-def _run(sess: ort.InferenceSession, X: np.ndarray) -> np.ndarray:
-    inp_name = sess.get_inputs()[0].name
-    outs = sess.run(None, {inp_name: X})
-    y = np.array(outs[0])
-    return y.reshape(-1).astype(np.float64)
+def _run_batch(sess: ort.InferenceSession, X: np.ndarray) -> np.ndarray:
+    """[B, T, F] -> [B, K]; models with a fixed batch dim are fed in slices of that size."""
+    inp = sess.get_inputs()[0]
+    b = inp.shape[0] if inp.shape else None
+    if not isinstance(b, int) or b == X.shape[0]:
+        y = np.asarray(sess.run(None, {inp.name: X})[0])
+        return y.reshape(X.shape[0], -1)
+    outs = []
+    for i in range(0, X.shape[0], b):
+        part = X[i:i + b]
+        n = part.shape[0]
+        if n < b:
+            part = np.concatenate([part, np.repeat(part[-1:], b - n, axis=0)])
+        y = np.asarray(sess.run(None, {inp.name: part})[0])
+        outs.append(y.reshape(b, -1)[:n])
+    return np.concatenate(outs)
+
+# ---------------- binary tensor payloads ----------------
+# raw:  Content-Type application/octet-stream, X-Shape: 77,256,7, X-Dtype: float32 (little-endian)
+# npy:  Content-Type application/x-npy (np.save output)
+# json: {"features_b64": "...", "shape": [...], "dtype": "float32"}
+_RAW_TYPES = {"application/octet-stream"}
+_NPY_TYPES = {"application/x-npy", "application/npy"}
+_DTYPES = {"float32": "<f4", "f4": "<f4", "float64": "<f8", "f8": "<f8", "float16": "<f2", "f2": "<f2"}
+
+def _parse_shape(v: Any) -> Optional[List[int]]:
+    if v is None or v == "":
+        return None
+    if isinstance(v, str):
+        v = [p for p in v.replace("x", ",").split(",") if p.strip()]
+    try:
+        shape = [int(p) for p in v]
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail=f"bad shape {v!r}, expected comma-separated integers")
+    if any(d < 0 for d in shape):
+        raise HTTPException(status_code=422, detail=f"bad shape {shape}: negative dimension")
+    return shape
+
+def _decode_raw(buf: bytes, shape: Optional[List[int]], dtype: Optional[str]) -> np.ndarray:
+    name = (dtype or "float32").lower()
+    if name not in _DTYPES:
+        raise HTTPException(status_code=422, detail=f"unsupported dtype '{dtype}', use one of {', '.join(_DTYPES)}")
+    dt = np.dtype(_DTYPES[name])
+    if len(buf) % dt.itemsize:
+        raise HTTPException(status_code=422, detail=f"body length {len(buf)} is not a multiple of {dt.itemsize}")
+    a = np.frombuffer(buf, dtype=dt)      # zero-copy view of the request body
+    if shape:
+        if int(np.prod(shape)) != a.size:
+            raise HTTPException(status_code=422, detail=f"shape {shape} does not match {a.size} values")
+        a = a.reshape(shape)
+    return a if dt == np.float32 else a.astype(np.float32)
+
+def _decode_npy(buf: bytes) -> np.ndarray:
+    bio = io.BytesIO(buf)
+    try:
+        version = np.lib.format.read_magic(bio)
+        if version == (1, 0):
+            shape, fortran, dt = np.lib.format.read_array_header_1_0(bio)
+        else:
+            shape, fortran, dt = np.lib.format.read_array_header_2_0(bio)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"bad .npy body: {e}")
+    if dt.hasobject:
+        raise HTTPException(status_code=422, detail="object arrays are not accepted")
+    n = int(np.prod(shape))
+    try:
+        a = np.frombuffer(buf, dtype=dt, count=n, offset=bio.tell()).reshape(shape, order="F" if fortran else "C")
+    except ValueError as e:
+        # truncated body: fewer bytes than the header promises
+        raise HTTPException(status_code=422, detail=f"bad .npy body: {e}")
+    return a if dt == np.float32 else a.astype(np.float32)
+
+def _X_from_tensor(a: np.ndarray, T: int, F: int) -> np.ndarray:
+    # already [B, T, F]: feed as-is (no copy); anything else goes through the flat-features rules
+    if a.ndim == 3 and a.shape[1] == T and a.shape[2] == F:
+        return np.ascontiguousarray(a)
+    return _build_X_from_flat_features(a, T=T, F=F)
+
+def _encode_out(y: np.ndarray, accept: str) -> Optional[Tuple[bytes, str]]:
+    accept = accept.lower()
+    if "application/x-npy" in accept:
+        bio = io.BytesIO()
+        np.save(bio, y.astype("<f4"), allow_pickle=False)
+        return bio.getvalue(), "application/x-npy"
+    if "application/octet-stream" in accept:
+        return y.astype("<f4").tobytes(), "application/octet-stream"
+    return None
 
 def _to_side_conf(out: np.ndarray) -> Dict[str, Any]:
     # common cases:
@@ -206,28 +406,115 @@ class PredictReq(BaseModel):
     symbol: Optional[str] = None
     lookback: Optional[int] = 60
     features: Optional[List[float]] = None
+    # compact alternative to `features`: base64 of raw little-endian values
+    features_b64: Optional[str] = None
+    shape: Optional[List[int]] = None
+    dtype: Optional[str] = "float32"
+    # what features / features_b64 / binary bodies hold: "features" (normalized) or "raw_ohlcv";
+    # unset => RAW_MODELS decides
+    input_format: Optional[str] = None
+    # JSON responses: return outputs as base64 float32 (`out_b64`) instead of a list
+    return_b64: Optional[bool] = False
 
 @app.post("/predict")
-def predict(req: PredictReq):
-    school, model_key = _pick_model(req.tf)
-    sess = _get_sess(model_key)
-
+async def predict(request: Request):
+    ctype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    body = await request.body()
+    tensor = None
+
+    if ctype in _RAW_TYPES or ctype in _NPY_TYPES:
+        q = request.query_params
+        tf = q.get("tf") or request.headers.get("x-tf")
+        if not tf:
+            raise HTTPException(status_code=422, detail="tf query parameter (or X-TF header) is required for binary bodies")
+        req = PredictReq(tf=tf, symbol=q.get("symbol") or request.headers.get("x-symbol"),
+                         input_format=q.get("input_format") or request.headers.get("x-input-format"))
+        if ctype in _NPY_TYPES:
+            tensor = _decode_npy(body)
+        else:
+            tensor = _decode_raw(body, _parse_shape(q.get("shape") or request.headers.get("x-shape")),
+                                 q.get("dtype") or request.headers.get("x-dtype"))
+    else:
+        try:
+            obj = json.loads(body or b"{}")
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"invalid JSON body: {e}")
+        if not isinstance(obj, dict):
+            raise HTTPException(status_code=422, detail=f"JSON body must be an object, got {type(obj).__name__}")
+        try:
+            req = PredictReq(**obj)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=json.loads(e.json()))
+        if req.features_b64:
+            try:
+                buf = base64.b64decode(req.features_b64, validate=True)
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=f"features_b64 is not valid base64: {e}")
+            tensor = _decode_raw(buf, req.shape, req.dtype)
+
+    if _PROFILER.enabled:
+        res, y = await run_in_threadpool(_profiled_predict, req, tensor)
+    else:
+        res, y = await run_in_threadpool(_predict, req, tensor)
+
+    enc = _encode_out(y, request.headers.get("accept", ""))
+    if enc is not None:
+        content, media = enc
+        return Response(content=content, media_type=media, headers={
+            "X-Shape": ",".join(str(d) for d in y.shape),
+            "X-Dtype": "float32",
+            "X-Model": res["model"],
+            "X-Side": res["side"],
+            "X-Confidence": str(res["confidence"]),
+        })
+
+    if req.return_b64:
+        res["out_b64"] = base64.b64encode(y.astype("<f4").tobytes()).decode("ascii")
+    else:
+        res["out"] = y.reshape(-1).astype(np.float64).tolist()
+    return res
+
+def _client_format(req: PredictReq) -> str:
+    fmt = (req.input_format or ("raw_ohlcv" if RAW_MODELS else "features")).strip().lower()
+    if fmt not in INPUT_FORMATS:
+        raise HTTPException(status_code=422, detail=f"input_format must be one of {', '.join(INPUT_FORMATS)}")
+    return fmt
+
+def _predict(req: PredictReq, tensor: Optional[np.ndarray] = None,
+             trace: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], np.ndarray]:
+    # client windows go to the model that takes their format; fetched candles are always raw
+    client = tensor is not None or bool(req.features)
+    fmt = _client_format(req) if client else "raw_ohlcv"
+    raw = fmt == "raw_ohlcv"
     # expected shape from model
-    fallback_T = 60 if school == "ICT" else 256
-    fallback_F = 5  if school == "ICT" else 7
-    T, F = _infer_expected_shape(sess, fallback_T=fallback_T, fallback_F=fallback_F)
-
-    if req.features is not None and len(req.features) > 0:
+    school, model_key, sess, T, F = _model_shape(req.tf, raw)
+    # a declared format must be honoured; undeclared windows for a model with a single graph
+    # (ICT) go to that graph, as they always did
+    taken = _input_format(sess, model_key)
+    if client and req.input_format and taken != fmt:
+        raise HTTPException(status_code=422, detail=(
+            f"no {fmt} model for tf '{req.tf}': {_session_path(model_key, raw).name} takes {taken}"))
+
+    if tensor is not None:
+        X = _X_from_tensor(tensor, T=T, F=F)
+    elif req.features is not None and len(req.features) > 0:
         X = _build_X_from_flat_features(req.features, T=T, F=F)
     else:
         if not req.symbol:
             raise HTTPException(status_code=422, detail="symbol is required when features are not provided")
-        limit = req.lookback or T
-        candles = _fetch_candles(req.symbol, req.tf, limit=limit)
-        X = _build_X_from_candles(candles, T=T, F=F)
-
-    out = _run(sess, X)
-    meta = _to_side_conf(out)
+        # the window is always T bars; lookback can only ask for more context
+        limit = max(req.lookback or 0, T)
+        times, rows = _fetch_window(req.symbol, req.tf, limit=limit)
+        if READY_GATE:
+            _check_ready(req.symbol, req.tf, times, T)
+        X = _build_X_from_rows(rows, T=T, F=F)
+
+    if trace is not None:
+        # what the profiler needs to replay this request's inference
+        trace["model"], trace["X"], trace["path"] = model_key, X, str(_session_path(model_key, raw))
+    y = _run_batch(sess, X)
+    # side/confidence describe the first sample, as before
+    meta = _to_side_conf(y[0].astype(np.float64))
 
     return {
         "school": school,
@@ -240,5 +527,323 @@ def predict(req: PredictReq):
         "confidence": round(meta["confidence"], 2),
         "buy_prob": round(meta["buy_prob"], 6),
         "sell_prob": round(meta["sell_prob"], 6),
-        "out": out.tolist(),
+        "out_shape": list(y.shape),
+        "input_format": taken,
+    }, y
+
+# ---------------- profiling (opt-in) ----------------
+# PROFILE_SAMPLE=0.01     replay 1% of /predict inputs through an ORT profiling session
+# PROFILE_SLOW_MS=50      replay every request slower than this, save its cProfile when
+#                         one was running, and cProfile the next PROFILE_ARM requests of that model
+# PROFILE_PY_SAMPLE=0.05  cProfile 5% of requests (kept only when slow)
+# Files go to PROFILE_DIR (newest PROFILE_KEEP of each kind); GET /admin/profile summarizes them.
+PROFILE_DIR = os.getenv("PROFILE_DIR", str(PROJ / "data" / "profiles"))
+_PROFILER = RequestProfiler(
+    PROFILE_DIR,
+    sample=float(os.getenv("PROFILE_SAMPLE", "0")),
+    slow_ms=float(os.getenv("PROFILE_SLOW_MS", "0")),
+    py_sample=float(os.getenv("PROFILE_PY_SAMPLE", "0")),
+    arm=int(os.getenv("PROFILE_ARM", "5")),
+    keep=int(os.getenv("PROFILE_KEEP", "200")),
+    intra_threads=ORT_INTRA_THREADS,
+)
+
+def _profiled_predict(req: PredictReq, tensor: Optional[np.ndarray] = None) -> Tuple[Dict[str, Any], np.ndarray]:
+    _, model_key = _pick_model(req.tf)
+    trace: Dict[str, Any] = {}
+    prof = _PROFILER.begin(model_key)
+    t0 = time.perf_counter()
+    try:
+        res, y = _predict(req, tensor, trace)
+    except BaseException:
+        _PROFILER.abort(prof)
+        raise
+    _PROFILER.end(model_key, trace.get("path"), trace.get("X"),
+                  (time.perf_counter() - t0) * 1000.0, prof, _run_batch)
+    return res, y
+
+@app.get("/admin/profile")
+def admin_profile(model: Optional[str] = None, top: int = 10):
+    return _PROFILER.summary(model=model, top=max(1, min(top, 100)))
+
+# ---------------- push streaming (SSE) ----------------
+# GET /stream?pairs=EURUSD:15m,XAUUSD:1m  ->  text/event-stream
+#   event: subscribed   once, with the accepted pairs
+#   event: prediction   when a new closed bar arrives for a pair (the last one is replayed on subscribe)
+#   event: not_ready    when the new bar's window fails the readiness gate
+# One poller for all clients: each new bar is inferred once, batched per model,
+# and fanned out to every subscriber of that pair.
+STREAM_POLL_SEC = float(os.getenv("STREAM_POLL_SEC", "1.0"))
+STREAM_PING_SEC = float(os.getenv("STREAM_PING_SEC", "15"))
+STREAM_QUEUE = int(os.getenv("STREAM_QUEUE", "64"))       # per client; oldest dropped when full
+
+_STREAM_SUBS: Dict[Tuple[str, str], set] = {}     # (SYMBOL, tf) -> client queues
+_STREAM_SEEN: Dict[Tuple[str, str], int] = {}     # last bar time inferred
+_STREAM_WAITING: Dict[Tuple[str, str], int] = {}  # bar held back by the ready gate, retried every poll
+_STREAM_LAST: Dict[Tuple[str, str], str] = {}     # last prediction event, replayed to new clients
+_STREAM_STATS = {"polls": 0, "bars": 0, "batches": 0, "events": 0, "dropped": 0}
+_STREAM_TASK: Optional[asyncio.Task] = None
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+def _parse_pairs(pairs: str) -> List[Tuple[str, str]]:
+    keys = []
+    for p in pairs.split(","):
+        if not p.strip():
+            continue
+        sym, _, tf = p.strip().partition(":")
+        if not sym or not tf:
+            raise HTTPException(status_code=422, detail=f"bad pair '{p}', expected SYMBOL:tf")
+        tf = tf.lower().strip()
+        _pick_model(tf)
+        key = (clean_symbol(sym), tf)
+        if key not in keys:
+            keys.append(key)
+    if not keys:
+        raise HTTPException(status_code=422, detail="pairs is empty")
+    return keys
+
+def _last_bar_time(symbol: str, tf: str) -> Optional[int]:
+    if _STORE is not None:
+        return _STORE.last_time(symbol, tf)
+    c = _fetch_candles(symbol, tf, limit=1)
+    return parse_time(c[-1]["time"]) if c and c[-1].get("time") is not None else None
+
+def _stream_poll(keys: List[Tuple[str, str]]) -> List[Tuple[Tuple[str, str], str, Dict[str, Any]]]:
+    """Pairs among `keys` with a new closed bar -> events, one inference per model."""
+    _STREAM_STATS["polls"] += 1
+    pending: Dict[str, List[Tuple[Tuple[str, str], int, np.ndarray]]] = {}
+    events = []
+    for key in keys:
+        sym, tf = key
+        try:
+            last = _last_bar_time(sym, tf)
+            if last is None or last <= _STREAM_SEEN.get(key, -1):
+                continue
+            school, model_key, sess, T, F = _model_shape(tf, raw=True)
+            times, rows = _fetch_window(sym, tf, limit=T)
+        except Exception as e:
+            print(f"[stream] {sym} {tf}: {e}")
+            continue
+        if _STREAM_WAITING.get(key) != last:
+            _STREAM_STATS["bars"] += 1
+        if READY_GATE:
+            try:
+                _check_ready(sym, tf, times, T)
+            except HTTPException as e:
+                # _STREAM_SEEN stays put so the bar is retried once the history fills in;
+                # subscribers hear about it once per bar, not once per poll
+                if _STREAM_WAITING.get(key) != last:
+                    events.append((key, "not_ready", e.detail))
+                _STREAM_WAITING[key] = last
+                continue
+        pending.setdefault(model_key, []).append((key, last, _build_X_from_rows(rows, T=T, F=F)))
+
+    for model_key, items in pending.items():
+        school, _, sess, T, F = _model_shape(items[0][0][1], raw=True)
+        y = _run_batch(sess, np.concatenate([x for _, _, x in items]))
+        _STREAM_STATS["batches"] += 1
+        for (key, last, _), out in zip(items, y):
+            _STREAM_SEEN[key] = last
+            _STREAM_WAITING.pop(key, None)
+            meta = _to_side_conf(out.astype(np.float64))
+            events.append((key, "prediction", {
+                "school": school,
+                "model": model_key,
+                "symbol": key[0],
+                "tf": key[1],
+                "bar_time": datetime.fromtimestamp(last, tz=timezone.utc).isoformat(),
+                "side": meta["side"],
+                "confidence": round(meta["confidence"], 2),
+                "buy_prob": round(meta["buy_prob"], 6),
+                "sell_prob": round(meta["sell_prob"], 6),
+                "out": out.astype(np.float64).tolist(),
+                "batch": len(items),
+            }))
+    return events
+
+def _offer(q: asyncio.Queue, msg: str) -> None:
+    if q.full():
+        q.get_nowait()
+        _STREAM_STATS["dropped"] += 1
+    q.put_nowait(msg)
+
+async def _stream_loop() -> None:
+    global _STREAM_TASK
+    try:
+        while _STREAM_SUBS:
+            events = await run_in_threadpool(_stream_poll, list(_STREAM_SUBS))
+            for key, event, data in events:
+                msg = _sse(event, data)
+                if event == "prediction":
+                    _STREAM_LAST[key] = msg
+                for q in list(_STREAM_SUBS.get(key, ())):
+                    _offer(q, msg)
+                    _STREAM_STATS["events"] += 1
+            await asyncio.sleep(STREAM_POLL_SEC)
+    finally:
+        _STREAM_TASK = None
+
+@app.get("/stream")
+async def stream(pairs: str):
+    keys = _parse_pairs(pairs)
+
+    async def gen():
+        global _STREAM_TASK
+        q: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE)
+        for k in keys:
+            _STREAM_SUBS.setdefault(k, set()).add(q)
+            if k in _STREAM_LAST:
+                _offer(q, _STREAM_LAST[k])
+        if _STREAM_TASK is None:
+            _STREAM_TASK = asyncio.create_task(_stream_loop())
+        try:
+            yield _sse("subscribed", {"pairs": [f"{s}:{t}" for s, t in keys]})
+            while True:
+                try:
+                    yield await asyncio.wait_for(q.get(), STREAM_PING_SEC)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+        finally:
+            for k in keys:
+                subs = _STREAM_SUBS.get(k)
+                if subs is not None:
+                    subs.discard(q)
+                    if not subs:
+                        del _STREAM_SUBS[k]
+
+    return StreamingResponse(gen(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/stream/stats")
+def stream_stats():
+    return {
+        "pairs": {f"{s}:{t}": len(q) for (s, t), q in _STREAM_SUBS.items()},
+        "clients": len({id(q) for qs in _STREAM_SUBS.values() for q in qs}),
+        **_STREAM_STATS,
     }
+
+# ---------------- multi-model consensus ----------------
+# GET /consensus?symbol=XAUUSD[&tfs=1m,5m,15m,30m][&weights=15m:2,30m:2]
+# Each tf fetches its own window and runs its own session on _CONSENSUS_POOL;
+# ORT releases the GIL, so the wall time is about the slowest tf, not the sum.
+CONSENSUS_TFS = ["1m", "5m", "15m", "30m"]
+_CONSENSUS_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("CONSENSUS_WORKERS", "4")),
+                                     thread_name_prefix="consensus")
+
+def _parse_weights(weights: Optional[str]) -> Dict[str, float]:
+    out = {}
+    for p in (weights or "").split(","):
+        if p.strip():
+            tf, _, w = p.partition(":")
+            try:
+                out[tf.strip().lower()] = float(w)
+            except ValueError:
+                raise HTTPException(status_code=422, detail=f"bad weight '{p}', expected tf:number")
+    return out
+
+def _consensus_one(symbol: str, tf: str) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    try:
+        school, model_key, sess, T, F = _model_shape(tf, raw=True)
+        times, rows = _fetch_window(symbol, tf, limit=T)
+        if READY_GATE:
+            _check_ready(symbol, tf, times, T)
+        X = _build_X_from_rows(rows, T=T, F=F)
+        t1 = time.perf_counter()
+        y = _run_batch(sess, X)
+        t2 = time.perf_counter()
+    except HTTPException as e:
+        return {"tf": tf, "ok": False, "error": e.detail, "ms": round((time.perf_counter() - t0) * 1000.0, 3)}
+    except Exception as e:
+        return {"tf": tf, "ok": False, "error": str(e), "ms": round((time.perf_counter() - t0) * 1000.0, 3)}
+
+    meta = _to_side_conf(y[0].astype(np.float64))
+    return {
+        "tf": tf,
+        "ok": True,
+        "school": school,
+        "model": model_key,
+        "side": meta["side"],
+        "confidence": round(meta["confidence"], 2),
+        "buy_prob": round(meta["buy_prob"], 6),
+        "sell_prob": round(meta["sell_prob"], 6),
+        "out": y[0].astype(np.float64).tolist(),
+        "fetch_ms": round((t1 - t0) * 1000.0, 3),
+        "infer_ms": round((t2 - t1) * 1000.0, 3),
+        "ms": round((t2 - t0) * 1000.0, 3),
+    }
+
+def _aggregate(results: List[Dict[str, Any]], weights: Dict[str, float]) -> Dict[str, Any]:
+    ok = [r for r in results if r["ok"] and weights.get(r["tf"], 1.0) > 0]
+    if not ok:
+        return {"side": None, "confidence": 0.0, "buy_prob": None, "sell_prob": None, "votes": {}, "used": []}
+    w = np.array([weights.get(r["tf"], 1.0) for r in ok], dtype=np.float64)
+    buy_p = float(np.dot(w, [r["buy_prob"] for r in ok]) / w.sum())
+    side = "BUY" if buy_p >= 0.5 else "SELL"
+    votes = {"BUY": sum(r["side"] == "BUY" for r in ok), "SELL": sum(r["side"] == "SELL" for r in ok)}
+    return {
+        "side": side,
+        "confidence": round(max(buy_p, 1.0 - buy_p) * 100.0, 2),
+        "buy_prob": round(buy_p, 6),
+        "sell_prob": round(1.0 - buy_p, 6),
+        "votes": votes,
+        "agree": votes[side] == len(ok),
+        "used": [r["tf"] for r in ok],
+    }
+
+@app.get("/consensus")
+async def consensus(symbol: str, tfs: Optional[str] = None, weights: Optional[str] = None):
+    tf_list = [t.strip().lower() for t in tfs.split(",") if t.strip()] if tfs else CONSENSUS_TFS
+    for tf in tf_list:
+        _pick_model(tf)
+    w = _parse_weights(weights)
+
+    t0 = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(loop.run_in_executor(_CONSENSUS_POOL, _consensus_one, symbol, tf)
+                                     for tf in tf_list))
+    total = (time.perf_counter() - t0) * 1000.0
+
+    if not any(r["ok"] for r in results):
+        raise HTTPException(status_code=503, detail={"error": "no model produced a signal", "models": results})
+    return {
+        "symbol": symbol,
+        "consensus": _aggregate(results, w),
+        "models": results,
+        "timing": {
+            "total_ms": round(total, 3),
+            "slowest_ms": max(r["ms"] for r in results),
+            "sum_ms": round(sum(r["ms"] for r in results), 3),
+        },
+    }
+
+# ---------------- preload ----------------
+def preload() -> Dict[str, str]:
+    """Load every session and run one dummy window through it, so weights,
+    prepacked buffers and arenas exist before serve_shared.py forks."""
+    loaded = {}
+    for tf in CONSENSUS_TFS:
+        for raw in (True, False):
+            school, model_key, sess, T, F = _model_shape(tf, raw)
+            p = _session_path(model_key, raw)
+            if str(p) not in loaded:
+                _run_batch(sess, np.zeros((1, T, F), dtype=np.float32))
+                loaded[str(p)] = p.name
+    return loaded
+
+def split_weights() -> Dict[str, str]:
+    """Write the SHARED_WEIGHTS layout of every served model into WEIGHTS_DIR, without
+    creating sessions (serve_shared.py --mode mmap runs this before spawning workers)."""
+    out = {}
+    for tf in CONSENSUS_TFS:
+        _, model_key = _pick_model(tf)
+        for raw in (True, False):
+            p = _session_path(model_key, raw)
+            out[str(p)] = shared_weights.split(p, WEIGHTS_DIR).name
+    return out
+
+# PRELOAD=1: load at import (plain `uvicorn --workers N`, one copy per worker)
+if os.getenv("PRELOAD", "0") == "1":
+    preload()
@@ -0,0 +1,162 @@
+﻿"""
+Multi-worker predict_server that keeps one copy of the model weights.
+
+--mode fork (default where os.fork exists: Linux / WSL)
+  The parent imports predict_server, loads all ONNX sessions once, binds the
+  listening socket and forks N workers that serve it with uvicorn.
+  Interpreter, libraries, sessions and weights stay in pages shared
+  copy-on-write with the parent, so each extra worker costs only what it
+  writes after the fork (request buffers, ORT activations).
+
+--mode mmap (default on Windows, works everywhere)
+  Sessions run with SHARED_WEIGHTS=1: the parent splits every model once
+  into WEIGHTS_DIR (shared_weights.py) and uvicorn's supervisor spawns N
+  workers that memory-map those weight files, so the weights are shared
+  through the OS page cache. The interpreter and libraries are still loaded
+  per worker.
+
+  python serve_shared.py --workers 4 --port 8000 [--mode mmap]
+
+Compare with `PRELOAD=1 uvicorn predict_server:app --workers 4`, where every
+worker imports and loads everything again (see measure_workers.py).
+"""
+import os
+import sys
+import gc
+import time
+import signal
+import socket
+import argparse
+
+# must be set before predict_server reads it: ORT's intra-op pool threads are
+# not carried across fork, so each worker runs sessions on its own thread
+os.environ.setdefault("ORT_INTRA_THREADS", "1")
+
+RESTART_BACKOFF_SEC = 1
+
+def bind(host, port, backlog=2048):
+    # explicit IPPROTO_TCP: asyncio only sets TCP_NODELAY on accepted connections
+    # whose proto says TCP; with proto 0 every response waits on delayed ACK (~40 ms)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(app, sock, log_level):
+    import uvicorn
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=log_level, access_log=False, lifespan="off")
+    uvicorn.Server(config).run(sockets=[sock])
+
+def split_weights():
+    import predict_server
+    return predict_server.split_weights()
+
+def serve_mapped(args):
+    # before predict_server is imported anywhere: it reads SHARED_WEIGHTS at import
+    os.environ["SHARED_WEIGHTS"] = "1"
+    t0 = time.time()
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    import uvicorn
+    from uvicorn.supervisors import Multiprocess
+    # split every model into WEIGHTS_DIR before any worker starts, so workers only map finished
+    # files; in a throwaway process so the supervisor itself never holds predict_server
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as ex:
+        split = ex.submit(split_weights).result()
+    print(f"[serve] split {', '.join(sorted(set(split.values())))} in {time.time() - t0:.2f}s", flush=True)
+
+    # spawned workers load their sessions on import, from the files split above
+    os.environ["PRELOAD"] = "1"
+    config = uvicorn.Config("predict_server:app", workers=args.workers, log_level=args.log_level,
+                            access_log=False, lifespan="off")
+    # our socket, not uvicorn's: its bind_socket() leaves proto 0 and hits the same delayed-ACK stall
+    sock = bind(args.host, args.port)
+    print(f"[serve] listening on {args.host}:{args.port} with {args.workers} workers (mmap)", flush=True)
+    try:
+        if args.workers > 1:
+            Multiprocess(config, sockets=[sock]).run()
+        else:
+            uvicorn.Server(config).run(sockets=[sock])
+    finally:
+        sock.close()
+    print("[serve] stopped", flush=True)
+    return 0
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--log-level", default="warning")
+    ap.add_argument("--mode", choices=("fork", "mmap"), default="fork" if hasattr(os, "fork") else "mmap",
+                    help="fork: copy-on-write workers (Linux/WSL); mmap: spawned workers sharing mapped weights")
+    args = ap.parse_args()
+
+    # checked before loading anything: Windows has no fork
+    if args.mode == "fork" and not hasattr(os, "fork"):
+        print("[serve] os.fork is not available on this platform; use --mode mmap", file=sys.stderr)
+        return 2
+    if args.mode == "mmap":
+        return serve_mapped(args)
+
+    t0 = time.time()
+    import predict_server
+    loaded = predict_server.preload()
+    # keep the collector from touching (and un-sharing) everything allocated so far
+    gc.collect()
+    gc.freeze()
+    print(f"[serve] preloaded {', '.join(loaded.values())} in {time.time() - t0:.2f}s", flush=True)
+
+    sock = bind(args.host, args.port)
+    children = {}
+    stopping = False
+
+    def spawn(i):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(predict_server.app, sock, args.log_level)
+            finally:
+                os._exit(0)
+        children[pid] = i
+        print(f"[serve] worker {i} pid={pid}", flush=True)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for i in range(args.workers):
+        spawn(i)
+    print(f"[serve] listening on {args.host}:{args.port} with {args.workers} workers", flush=True)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        i = children.pop(pid, None)
+        if i is None or stopping:
+            continue
+        print(f"[serve] worker {i} pid={pid} exited ({status}), restarting", flush=True)
+        time.sleep(RESTART_BACKOFF_SEC)
+        spawn(i)
+
+    sock.close()
+    print("[serve] stopped", flush=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+﻿"""
+Memory-mapped ONNX weights, shared by every worker process on any OS.
+
+split() rewrites a model once into WEIGHTS_DIR:
+  <stem>.<sig>.onnx      the graph; large initializers are external data in ...
+  <stem>.<sig>.weights   ... this file, each tensor aligned to ALIGN bytes
+  <stem>.<sig>.json      name -> (offset, dtype, shape), so loading needs no onnx package
+<sig> changes with the source model (and its external data), so a file another
+worker has mapped is never rewritten in place (Windows refuses that).
+
+session() maps the .weights file with np.memmap and hands every tensor to ORT
+through SessionOptions.add_initializer. The pages belong to the OS page cache,
+so N workers hold one copy whether they were forked (serve_shared.py) or
+spawned (`uvicorn --workers N`, the only option on Windows). Prepacking is
+off for these sessions: it copies MatMul/Conv/Gemm weights into private
+per-process buffers, i.e. un-shares exactly this memory.
+
+  python shared_weights.py ../assets/models/smc/*.onnx --out ../data/weights
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import onnxruntime as ort
+
+ALIGN = 65536        # Windows allocation granularity; a page multiple everywhere else
+MIN_BYTES = 1024     # smaller initializers stay inline in the graph
+
+def signature(src: Path) -> str:
+    """Changes whenever the model file or a sibling named after it (<name>.data) changes."""
+    h = hashlib.sha1()
+    for p in sorted(src.parent.glob(src.name + "*")):
+        st = p.stat()
+        h.update(f"{p.name}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()[:12]
+
+def _paths(src: Path, out_dir: Path) -> Tuple[Path, Path, Path]:
+    base = f"{src.stem}.{signature(src)}"
+    return out_dir / f"{base}.onnx", out_dir / f"{base}.weights", out_dir / f"{base}.json"
+
+def _publish(tmp: Path, dst: Path) -> None:
+    try:
+        os.replace(tmp, dst)
+    except PermissionError:
+        # another worker split the same source first and has it mapped; contents are identical
+        tmp.unlink()
+        if not dst.exists():
+            raise
+
+def split(src: Path, out_dir: Path, min_bytes: int = MIN_BYTES) -> Path:
+    """Write the mapped layout of `src` into `out_dir` (no-op when current); returns the index path."""
+    src, out_dir = Path(src), Path(out_dir)
+    model_p, weights_p, index_p = _paths(src, out_dir)
+    if index_p.exists():
+        return index_p
+
+    import onnx
+    out_dir.mkdir(parents=True, exist_ok=True)
+    m = onnx.load(str(src))      # pulls in external data as well
+    tensors: Dict[str, List[Any]] = {}
+    tmp = f".{os.getpid()}.tmp"
+    off = 0
+    with open(str(weights_p) + tmp, "wb") as f:
+        for t in m.graph.initializer:
+            a = onnx.numpy_helper.to_array(t)
+            if a.nbytes < min_bytes:
+                continue
+            pad = -off % ALIGN
+            f.write(b"\0" * pad)
+            off += pad
+            f.write(np.ascontiguousarray(a).tobytes())
+            tensors[t.name] = [off, a.dtype.str, list(a.shape)]
+            ext = onnx.TensorProto(name=t.name, data_type=t.data_type, dims=t.dims,
+                                   data_location=onnx.TensorProto.EXTERNAL)
+            for k, v in (("location", weights_p.name), ("offset", str(off)), ("length", str(a.nbytes))):
+                e = ext.external_data.add()
+                e.key, e.value = k, v
+            t.CopyFrom(ext)
+            off += a.nbytes
+    onnx.save(m, str(model_p) + tmp)
+    Path(str(index_p) + tmp).write_text(json.dumps({
+        "source": src.name, "model": model_p.name, "weights": weights_p.name, "tensors": tensors}))
+
+    # index last: it is what marks the split as complete
+    for p in (weights_p, model_p, index_p):
+        _publish(Path(str(p) + tmp), p)
+    return index_p
+
+def session(src: Path, so: ort.SessionOptions, out_dir: Path) -> ort.InferenceSession:
+    """InferenceSession for `src` whose large initializers are read from the shared mapping."""
+    index_p = split(src, out_dir)
+    idx = json.loads(index_p.read_text())
+    mm = np.memmap(index_p.parent / idx["weights"], dtype=np.uint8, mode="r") if idx["tensors"] else None
+    values = []
+    for name, (off, dtype, shape) in idx["tensors"].items():
+        v = ort.OrtValue.ortvalue_from_numpy(np.ndarray(shape, dtype=np.dtype(dtype), buffer=mm, offset=off))
+        so.add_initializer(name, v)
+        values.append(v)
+    so.add_session_config_entry("session.disable_prepacking", "1")
+    sess = ort.InferenceSession(str(index_p.parent / idx["model"]), sess_options=so,
+                                providers=["CPUExecutionProvider"])
+    # ORT reads these buffers in place for as long as the session lives
+    sess._shared_weights = (mm, values)
+    return sess
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="split ONNX models into the shared, memory-mapped layout")
+    ap.add_argument("models", nargs="+")
+    ap.add_argument("--out", required=True, help="WEIGHTS_DIR predict_server reads with SHARED_WEIGHTS=1")
+    ap.add_argument("--min-bytes", type=int, default=MIN_BYTES)
+    args = ap.parse_args()
+    for p in args.models:
+        idx = json.loads(split(Path(p), Path(args.out), args.min_bytes).read_text())
+        size = sum(int(np.prod(s)) * np.dtype(d).itemsize for _, d, s in idx["tensors"].values())
+        print(f"[weights] {p} -> {idx['weights']}: {len(idx['tensors'])} tensors, {size / 1024:.0f} KB")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
-﻿import time
+﻿import os
+import time
 import re
+import argparse
+import queue
+import multiprocessing as mp
 import requests
 from datetime import datetime, timezone
 
 import MetaTrader5 as mt5
 
-SERVER_HTTP = "http://127.0.0.1:8080"
+from candle_store import CandleStore
+from tick_aggregator import TickAggregator
+
+SERVER_HTTP = os.getenv("BRIDGE_SERVER_HTTP", "http://127.0.0.1:8080")
 POST_TICK   = f"{SERVER_HTTP}/tick"
 POST_OHLC   = f"{SERVER_HTTP}/candle"
 
@@ -28,11 +35,34 @@ TF_MAP = {
   "1d":  mt5.TIMEFRAME_D1,
 }
 
-BACKFILL_LIMIT = 800          # <-- initial history count per tf per symbol
-BACKFILL_SLEEP = 0.01         # small delay so we don't overload Node
+BACKFILL_LIMIT = int(os.getenv("BRIDGE_BACKFILL_LIMIT", "800"))      # <-- initial history count per tf per symbol
+BACKFILL_SLEEP = float(os.getenv("BRIDGE_BACKFILL_SLEEP", "0.01"))   # small delay so we don't overload Node
+# with a store, backfill only what closed after its last bar; 1 => post all BACKFILL_LIMIT bars
+# (e.g. Node was restarted with an empty memory). --full-backfill sets it.
+FULL_BACKFILL = os.getenv("BRIDGE_FULL_BACKFILL", "0") == "1"
 TICK_SLEEP_SEC = 0.25
 CANDLE_PUSH_EVERY_SEC = 2.0
 
+# --candles-from ticks: bars are built from copy_ticks_from, copy_rates is only
+# used to seed the forming bars and to reconcile bars after they close
+TICKS_MAX = 10000             # ticks per copy_ticks_from call
+RECONCILE_EVERY_SEC = 5.0
+
+# supervisor mode (--shards N)
+HEALTH_EVERY_SEC = 1.0        # worker -> supervisor heartbeat/stats
+HEALTH_TIMEOUT_SEC = 60.0     # no heartbeat for this long => worker is restarted
+BACKFILL_BEAT_EVERY = 50      # backfill posts between heartbeats (a slow Node must not look like a hang)
+REPORT_EVERY_SEC = 10.0       # per-shard throughput/lag summary
+RESTART_BACKOFF_SEC = 2.0
+
+# local candle store (closed bars only); set via --store or CANDLE_STORE
+STORE = None
+
+def open_store(root):
+  global STORE
+  STORE = CandleStore(root) if root else None
+  return STORE
+
 def iso_from_epoch_sec(t:int) -> str:
   return datetime.fromtimestamp(int(t), tz=timezone.utc).isoformat()
 
@@ -40,9 +70,9 @@ def clean_symbol(s: str) -> str:
   # remove trailing non-alphanumeric like "_" or "#"
   return re.sub(r"[^A-Za-z0-9]+$", "", s)
 
-def post_json(url, payload):
+def post_json(url, payload, session=None):
   try:
-    r = requests.post(url, json=payload, timeout=3)
+    r = (session or requests).post(url, json=payload, timeout=3)
     return r.status_code, r.text
   except Exception as e:
     return 0, str(e)
@@ -67,77 +97,362 @@ def copy_rates(symbol, tf_mt5, limit):
     return []
   return rates
 
-def backfill_symbol_tf(symbol, tf_name, tf_mt5, limit):
+def candle_payload(sym_clean, tf_name, r):
+  return {
+    "symbol": sym_clean,
+    "tf": tf_name,
+    "time": iso_from_epoch_sec(r["time"]),
+    "open": float(r["open"]),
+    "high": float(r["high"]),
+    "low": float(r["low"]),
+    "close": float(r["close"]),
+    "volume": float(r["tick_volume"]),
+  }
+
+def backfill_symbol_tf(symbol, tf_name, tf_mt5, limit, session=None, on_progress=None):
+  """Store + post the last `limit` bars; on_progress(done, total) every BACKFILL_BEAT_EVERY posts."""
   rates = copy_rates(symbol, tf_mt5, limit)
   if rates is None or len(rates)==0:
     print(f"[backfill] no rates: {symbol} {tf_name}")
-    return
+    return 0
 
   sym_clean = clean_symbol(symbol)
+  last = STORE.last_time(sym_clean, tf_name) if STORE is not None and not FULL_BACKFILL else None
+  if last is not None:
+    # warm store: only the bars after its last one (at least the forming bar)
+    rates = rates[rates["time"] > last]
+  if STORE is not None:
+    # last row is the still-forming bar
+    STORE.append(sym_clean, tf_name, rates[:-1])
+
   # post oldest -> newest
-  for r in rates:
-    post_json(POST_OHLC, {
-      "symbol": sym_clean,
-      "tf": tf_name,
-      "time": iso_from_epoch_sec(r["time"]),
-      "open": float(r["open"]),
-      "high": float(r["high"]),
-      "low": float(r["low"]),
-      "close": float(r["close"]),
-      "volume": float(r["tick_volume"]),
-    })
+  for i, r in enumerate(rates, 1):
+    post_json(POST_OHLC, candle_payload(sym_clean, tf_name, r), session=session)
     time.sleep(BACKFILL_SLEEP)
+    if on_progress and i % BACKFILL_BEAT_EVERY == 0:
+      on_progress(i, len(rates))
 
-  print(f"[backfill] done {sym_clean} {tf_name}: {len(rates)} bars")
+  print(f"[backfill] done {sym_clean} {tf_name}: {len(rates)} bars" + (" (after store)" if last is not None else ""))
+  return len(rates)
 
-def main():
-  if not mt5.initialize():
+def init_mt5(terminal=None):
+  ok = mt5.initialize(path=terminal) if terminal else mt5.initialize()
+  if not ok:
     raise RuntimeError(f"MT5 init failed: {mt5.last_error()}")
 
-  print("[bridge] MT5 connected.")
-  ok_symbols = ensure_symbols(SYMBOLS)
-  if not ok_symbols:
-    raise RuntimeError("No valid symbols. Fix SYMBOLS to match Market Watch.")
+def new_stats():
+  return {"ticks": 0, "candles": 0, "errors": 0, "loops": 0, "rate_calls": 0,
+          "loop_ms_sum": 0.0, "loop_ms_max": 0.0, "cycle_ms_sum": 0.0}
 
-  print("[bridge] symbols:", [clean_symbol(s) for s in ok_symbols])
-  print("[bridge] timeframes:", list(TF_MAP.keys()))
+def push_candle(sym_clean, tf_name, rates, session=None, stats=None):
+  """Store + post closed bar(s) (MT5 rates records)."""
+  if STORE is not None:
+    STORE.append(sym_clean, tf_name, rates)
+  for r in rates:
+    code, _ = post_json(POST_OHLC, candle_payload(sym_clean, tf_name, r), session=session)
+    if stats is not None:
+      stats["candles"] += 1
+      if code != 200: stats["errors"] += 1
 
-  # one-time backfill
-  for sym in ok_symbols:
-    for tf_name, tf_mt5 in TF_MAP.items():
-      backfill_symbol_tf(sym, tf_name, tf_mt5, BACKFILL_LIMIT)
+def loop_done(stats, t0, last_cycle, on_loop):
+  t1 = time.time()
+  loop_ms = (t1 - t0) * 1000.0
+  stats["loops"] += 1
+  stats["loop_ms_sum"] += loop_ms
+  stats["loop_ms_max"] = max(stats["loop_ms_max"], loop_ms)
+  stats["cycle_ms_sum"] += (t1 - last_cycle) * 1000.0
+  if on_loop:
+    on_loop(stats)
+  return t1
+
+def run_loop(symbols, session=None, stats=None, on_loop=None, candles_from="rates"):
+  """Tick/candle polling loop over `symbols` (never returns).
 
+  stats:        dict from new_stats(), updated in place
+  on_loop:      called after every pass, e.g. to ship stats to the supervisor
+  candles_from: "rates" polls copy_rates for every tf, "ticks" aggregates ticks
+  """
+  stats = stats if stats is not None else new_stats()
+  if candles_from == "ticks":
+    return run_tick_loop(symbols, session=session, stats=stats, on_loop=on_loop)
   last_push = 0.0
+  last_cycle = time.time()
   while True:
-    for sym in ok_symbols:
+    t0 = time.time()
+    for sym in symbols:
       tick = get_tick(sym)
       if tick:
-        post_json(POST_TICK, tick)
+        code, _ = post_json(POST_TICK, tick, session=session)
+        stats["ticks"] += 1
+        if code != 200: stats["errors"] += 1
 
     now = time.time()
     if now - last_push >= CANDLE_PUSH_EVERY_SEC:
       last_push = now
-      for sym in ok_symbols:
+      for sym in symbols:
         sym_clean = clean_symbol(sym)
         for tf_name, tf_mt5 in TF_MAP.items():
           rates = copy_rates(sym, tf_mt5, 3)
+          stats["rate_calls"] += 1
           if rates is None or len(rates) == 0:
 
             continue
-          last_closed = rates[-2]
-          post_json(POST_OHLC, {
-            "symbol": sym_clean,
-            "tf": tf_name,
-            "time": iso_from_epoch_sec(last_closed["time"]),
-            "open": float(last_closed["open"]),
-            "high": float(last_closed["high"]),
-            "low": float(last_closed["low"]),
-            "close": float(last_closed["close"]),
-            "volume": float(last_closed["tick_volume"]),
-          })
+          push_candle(sym_clean, tf_name, rates[-2:-1], session=session, stats=stats)
 
+    last_cycle = loop_done(stats, t0, last_cycle, on_loop)
     time.sleep(TICK_SLEEP_SEC)
 
+def seed_aggregator(symbols):
+  """Aggregator with MT5's forming bars adopted, ticks starting after the current one."""
+  agg = TickAggregator([clean_symbol(s) for s in symbols], list(TF_MAP))
+  for sym in symbols:
+    sym_clean = clean_symbol(sym)
+    for tf_name, tf_mt5 in TF_MAP.items():
+      rates = copy_rates(sym, tf_mt5, 1)
+      if len(rates):
+        agg.seed(sym_clean, tf_name, rates[-1])
+    t = mt5.symbol_info_tick(sym)
+    if t is not None:
+      agg.set_last_msc(sym_clean, t.time_msc)
+  return agg
+
+def run_tick_loop(symbols, session=None, stats=None, on_loop=None):
+  """Candles from ticks: one copy_ticks_from per symbol per pass feeds a
+  TickAggregator; closed bars are pushed as soon as they close, and closed
+  bars are checked against copy_rates every RECONCILE_EVERY_SEC."""
+  stats = stats if stats is not None else new_stats()
+  agg = seed_aggregator(symbols)
+  stats["rate_calls"] += len(symbols) * len(TF_MAP)
+  broker = {clean_symbol(s): s for s in symbols}
+  last_reconcile = time.time()
+  last_cycle = time.time()
+  while True:
+    t0 = time.time()
+    for sym in symbols:
+      sym_clean = clean_symbol(sym)
+      since = int(agg.last_msc[agg.index[sym_clean]] // 1000)
+      ticks = mt5.copy_ticks_from(sym, since, TICKS_MAX, mt5.COPY_TICKS_ALL)
+      if ticks is None or len(ticks) == 0:
+        continue
+      for s, tf_name, rec in agg.update(sym_clean, ticks):
+        push_candle(s, tf_name, rec, session=session, stats=stats)
+      last = ticks[-1]
+      tick = {"symbol": sym_clean, "bid": float(last["bid"]), "ask": float(last["ask"]),
+              "time": datetime.now(timezone.utc).isoformat()}
+      code, _ = post_json(POST_TICK, tick, session=session)
+      stats["ticks"] += 1
+      if code != 200: stats["errors"] += 1
+
+    # close bars on time even when no tick arrives after the boundary
+    for s, tf_name, rec in agg.flush():
+      push_candle(s, tf_name, rec, session=session, stats=stats)
+
+    if t0 - last_reconcile >= RECONCILE_EVERY_SEC:
+      last_reconcile = t0
+      for s, tf_name in agg.take_pending():
+        rates = mt5.copy_rates_from_pos(broker[s], TF_MAP[tf_name], 1, 1)
+        stats["rate_calls"] += 1
+        if rates is None or len(rates) == 0:
+          continue
+        fix = agg.reconcile(s, tf_name, rates[-1])
+        if fix is not None:
+          push_candle(s, tf_name, fix, session=session, stats=stats)
+      stats["reconciled"] = dict(agg.stats)
+
+    last_cycle = loop_done(stats, t0, last_cycle, on_loop)
+    time.sleep(TICK_SLEEP_SEC)
+
+# -------------------- supervisor mode --------------------
+def shard_symbols(symbols, n):
+  """Round-robin split so heavy/light symbols spread evenly."""
+  return [symbols[i::n] for i in range(n) if symbols[i::n]]
+
+def shard_worker(shard_id, symbols, terminal, status_q, store_root=None, candles_from="rates"):
+  """One shard: own MT5 connection, own HTTP session, own loop."""
+  def send(event, **kw):
+    try:
+      status_q.put_nowait({"shard": shard_id, "pid": os.getpid(), "event": event, "time": time.time(), **kw})
+    except Exception:
+      pass
+
+  try:
+    open_store(store_root)
+    init_mt5(terminal)
+    ok_symbols = ensure_symbols(symbols)
+    if not ok_symbols:
+      raise RuntimeError(f"No valid symbols in shard {shard_id}: {symbols}")
+
+    session = requests.Session()
+    send("up", symbols=[clean_symbol(s) for s in ok_symbols], terminal=terminal)
+
+    for sym in ok_symbols:
+      for tf_name, tf_mt5 in TF_MAP.items():
+        progress = lambda done, total: send("backfill", symbol=clean_symbol(sym), tf=tf_name, done=done, total=total)
+        n = backfill_symbol_tf(sym, tf_name, tf_mt5, BACKFILL_LIMIT, session=session, on_progress=progress)
+        progress(n, n)
+
+    last_sent = [0.0]
+    def on_loop(stats):
+      now = time.time()
+      if now - last_sent[0] >= HEALTH_EVERY_SEC:
+        last_sent[0] = now
+        send("stats", stats=dict(stats))
+        # loop_ms_max is per heartbeat; the supervisor keeps the max per report window
+        stats["loop_ms_max"] = 0.0
+
+    run_loop(ok_symbols, session=session, on_loop=on_loop, candles_from=candles_from)
+  except Exception as e:
+    send("error", error=str(e))
+    raise
+
+class Shard:
+  def __init__(self, shard_id, symbols, terminal, store_root=None, candles_from="rates"):
+    self.id = shard_id
+    self.symbols = symbols
+    self.terminal = terminal
+    self.store_root = store_root
+    self.candles_from = candles_from
+    self.proc = None
+    self.restarts = 0
+    self.started = 0.0
+    self.last_seen = 0.0
+    self.state = "down"
+    self.stats = new_stats()
+    self.prev = (0.0, new_stats())   # (time, stats) at last report
+    self.loop_max = 0.0              # slowest loop since last report
+
+  def start(self, status_q):
+    self.proc = mp.Process(target=shard_worker, args=(self.id, self.symbols, self.terminal, status_q, self.store_root, self.candles_from),
+                           name=f"bridge-shard-{self.id}", daemon=True)
+    self.proc.start()
+    self.started = self.last_seen = time.time()
+    self.state = "starting"
+    self.stats = new_stats()
+    self.prev = (self.started, new_stats())
+    self.loop_max = 0.0
+
+  def stop(self):
+    if self.proc is not None and self.proc.is_alive():
+      self.proc.terminate()
+      self.proc.join(5)
+
+  def report_line(self, now):
+    t_prev, s_prev = self.prev
+    dt = max(now - t_prev, 1e-9)
+    s = self.stats
+    loops = s["loops"] - s_prev["loops"]
+    loop_ms = (s["loop_ms_sum"] - s_prev["loop_ms_sum"]) / loops if loops else 0.0
+    cycle_ms = (s["cycle_ms_sum"] - s_prev["cycle_ms_sum"]) / loops if loops else 0.0
+    self.prev = (now, dict(s))
+    loop_max, self.loop_max = self.loop_max, 0.0
+    syms = ",".join(clean_symbol(x) for x in self.symbols)
+    pid = self.proc.pid if self.proc else "-"
+    return (f"[supervisor] shard {self.id} [{syms}] pid={pid} {self.state} "
+            f"ticks {(s['ticks'] - s_prev['ticks']) / dt:.1f}/s "
+            f"candles {(s['candles'] - s_prev['candles']) / dt:.1f}/s "
+            f"rates {(s.get('rate_calls', 0) - s_prev.get('rate_calls', 0)) / dt:.1f}/s "
+            f"errors {s['errors'] - s_prev['errors']} "
+            f"loop {loop_ms:.0f}ms (max {loop_max:.0f}ms) "
+            f"cycle {cycle_ms:.0f}ms restarts {self.restarts}")
+
+def supervise(symbols, n_shards, terminals=None, store_root=None, candles_from="rates"):
+  terminals = terminals or [None]
+  groups = shard_symbols(symbols, n_shards)
+  status_q = mp.Queue()
+  shards = [Shard(i, g, terminals[i % len(terminals)], store_root, candles_from) for i, g in enumerate(groups)]
+
+  print(f"[supervisor] {len(shards)} shards:", [[clean_symbol(s) for s in sh.symbols] for sh in shards])
+  for sh in shards:
+    sh.start(status_q)
+
+  last_report = time.time()
+  try:
+    while True:
+      try:
+        msg = status_q.get(timeout=HEALTH_EVERY_SEC)
+      except queue.Empty:
+        msg = None
+
+      if msg is not None:
+        sh = shards[msg["shard"]]
+        if sh.proc is not None and msg.get("pid") == sh.proc.pid:
+          sh.last_seen = msg["time"]
+          ev = msg["event"]
+          if ev == "stats":
+            sh.stats = msg["stats"]
+            sh.loop_max = max(sh.loop_max, sh.stats["loop_ms_max"])
+            sh.state = "running"
+          elif ev == "backfill":
+            sh.state = "backfill"
+          elif ev == "up":
+            sh.state = "backfill"
+            print(f"[supervisor] shard {sh.id} up pid={sh.proc.pid} symbols={msg.get('symbols')}")
+          elif ev == "error":
+            print(f"[supervisor] shard {sh.id} error: {msg.get('error')}")
+
+      now = time.time()
+      for sh in shards:
+        dead = not sh.proc.is_alive()
+        stale = now - sh.last_seen > HEALTH_TIMEOUT_SEC
+        if (dead or stale) and now - sh.started >= RESTART_BACKOFF_SEC:
+          why = f"exit code {sh.proc.exitcode}" if dead else f"no heartbeat for {now - sh.last_seen:.0f}s"
+          print(f"[supervisor] restarting shard {sh.id} ({why})")
+          sh.stop()
+          sh.restarts += 1
+          sh.start(status_q)
+
+      if now - last_report >= REPORT_EVERY_SEC:
+        last_report = now
+        for sh in shards:
+          print(sh.report_line(now))
+  except KeyboardInterrupt:
+    print("[supervisor] stopping shards...")
+  finally:
+    for sh in shards:
+      sh.stop()
+
+def main():
+  ap = argparse.ArgumentParser()
+  ap.add_argument("--shards", type=int, default=1, help="worker processes; symbols are split round-robin")
+  ap.add_argument("--terminal", action="append", default=None,
+                  help="terminal64.exe path for a shard (repeat; assigned round-robin)")
+  ap.add_argument("--symbols", default=None, help="comma list overriding SYMBOLS")
+  ap.add_argument("--store", default=os.getenv("CANDLE_STORE"),
+                  help="directory of the local candle store (closed bars are appended as they close)")
+  ap.add_argument("--full-backfill", action="store_true",
+                  help="post all BACKFILL_LIMIT bars per tf even when the store is warm")
+  ap.add_argument("--candles-from", choices=["rates", "ticks"], default=os.getenv("BRIDGE_CANDLES_FROM", "rates"),
+                  help="rates: poll copy_rates per tf; ticks: aggregate copy_ticks_from, reconcile with rates")
+  args = ap.parse_args()
+
+  symbols = [s.strip() for s in args.symbols.split(",") if s.strip()] if args.symbols else list(SYMBOLS)
+  if args.full_backfill:
+    global FULL_BACKFILL
+    FULL_BACKFILL = True
+    os.environ["BRIDGE_FULL_BACKFILL"] = "1"    # shard processes read it at import
+
+  if args.shards > 1:
+    supervise(symbols, args.shards, args.terminal, args.store, args.candles_from)
+    return
+
+  open_store(args.store)
+  init_mt5(args.terminal[0] if args.terminal else None)
+
+  print("[bridge] MT5 connected.")
+  ok_symbols = ensure_symbols(symbols)
+  if not ok_symbols:
+    raise RuntimeError("No valid symbols. Fix SYMBOLS to match Market Watch.")
+
+  print("[bridge] symbols:", [clean_symbol(s) for s in ok_symbols])
+  print("[bridge] timeframes:", list(TF_MAP.keys()), "from", args.candles_from)
+
+  # one-time backfill
+  for sym in ok_symbols:
+    for tf_name, tf_mt5 in TF_MAP.items():
+      backfill_symbol_tf(sym, tf_name, tf_mt5, BACKFILL_LIMIT)
+
+  run_loop(ok_symbols, candles_from=args.candles_from)
+
 if __name__ == "__main__":
   main()
 
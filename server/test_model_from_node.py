@@ -1,4 +1,4 @@
-﻿import sys, os, re
+﻿import sys, os
 import requests
 import numpy as np
 import onnxruntime as ort
@@ -18,11 +18,8 @@ def model_path(tf: str) -> str:
     raise FileNotFoundError(f"No ONNX model found in {model_dir}")
 
 def norm_dim(x):
-    if x is None: return None
+    # symbolic dims ("batch", "s77") are dynamic -> None
     if isinstance(x, (int, np.integer)): return int(x)
-    if isinstance(x, str):
-        m = re.search(r"\d+", x)
-        return int(m.group()) if m else None
     return None
 
 def get_input_shape(tf: str):
@@ -59,13 +56,15 @@ def main():
     print("model input name:", in_name)
     print("model input shape:", shp)
 
-    if len(shp) != 3 or shp[0] is None or shp[1] is None or shp[2] is None:
-        raise RuntimeError("Model shape must be 3D fixed for this tester. Your model shape is dynamic; share it and I adapt.")
+    if len(shp) != 3 or shp[1] is None or shp[2] is None:
+        raise RuntimeError("Model time/feature dims must be fixed for this tester.")
 
     B, D1, D2 = shp
+    # dynamic batch: send the one real sample instead of tiling it
+    B = B or 1
 
     # Determine which dim is time (256) and which is features (7)
-    # Expecting [77,256,7] (batch,time,features)
+    # Expecting [B,256,7] (batch,time,features)
     if D1 == 256 and D2 == 7:
         T, F = 256, 7
         layout = "BTF"
@@ -95,17 +94,18 @@ def main():
     else:
         one = X.T.reshape(1, F, T)
 
-    # tile to fixed batch B (your model uses B=77)
+    # tile only if the model has a fixed batch > 1
     inp = np.repeat(one, repeats=B, axis=0).astype(np.float32)
 
-    payload = {
-        "tf": tf,
-        "shape": list(inp.shape),
-        "features": inp.reshape(-1).tolist(),
-        "input": inp.reshape(-1).tolist(),
-    }
-
-    r = requests.post(PRED, json=payload, timeout=30)
+    # raw little-endian float32 body + shape header; the server maps it with np.frombuffer
+    # instead of parsing ~138k JSON floats (twice)
+    r = requests.post(
+        PRED,
+        params={"tf": tf, "symbol": symbol},
+        data=inp.astype("<f4").tobytes(),
+        headers={"Content-Type": "application/octet-stream", "X-Shape": ",".join(str(d) for d in inp.shape)},
+        timeout=30,
+    )
     print("status:", r.status_code)
     print(r.text)
 
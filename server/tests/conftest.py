@@ -0,0 +1,11 @@
+﻿import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVER = os.path.dirname(HERE)
+TRAINING = os.path.join(SERVER, "..", "training")
+
+# server/ and training/ are flat script directories, not packages
+for p in (SERVER, TRAINING):
+    if p not in sys.path:
+        sys.path.insert(0, p)
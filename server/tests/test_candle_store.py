@@ -0,0 +1,60 @@
+﻿"""CandleStore writers: locked, in place, never losing bars appended during a merge."""
+import os
+import threading
+
+import numpy as np
+
+from candle_store import BAR_DTYPE, CandleStore
+
+STEP = 900
+
+def _bars(times, close=1.0):
+    b = np.zeros(len(times), dtype=BAR_DTYPE)
+    b["time"] = times
+    b["close"] = close
+    return b
+
+def test_merge_only_newer_or_known_bars_appends_in_place(tmp_path):
+    s = CandleStore(tmp_path)
+    s.append("XAUUSD", "15m", _bars(np.arange(10) * STEP))
+    ino = os.stat(s.path("XAUUSD", "15m")).st_ino
+    # overlaps the stored tail (changed close) and runs past it
+    assert s.merge("XAUUSD", "15m", _bars(np.arange(5, 15) * STEP, close=2.0)) == 5
+    got = s.read("XAUUSD", "15m")
+    assert os.stat(s.path("XAUUSD", "15m")).st_ino == ino
+    np.testing.assert_array_equal(got["time"], np.arange(15) * STEP)
+    np.testing.assert_array_equal(got["close"], [1.0] * 5 + [2.0] * 10)
+
+def test_merge_in_front_keeps_the_file_and_its_readers(tmp_path):
+    s = CandleStore(tmp_path)
+    s.append("XAUUSD", "15m", _bars(np.arange(10, 20) * STEP))
+    reader = CandleStore(tmp_path)
+    assert reader.last_time("XAUUSD", "15m") == 19 * STEP     # reader now holds a memmap
+    ino = os.stat(s.path("XAUUSD", "15m")).st_ino
+    assert s.merge("XAUUSD", "15m", _bars(np.arange(0, 12) * STEP)) == 10
+    assert os.stat(s.path("XAUUSD", "15m")).st_ino == ino
+    np.testing.assert_array_equal(reader.read("XAUUSD", "15m")["time"], np.arange(20) * STEP)
+
+def test_appends_during_merges_are_not_lost(tmp_path):
+    live = np.arange(1000, 1400) * STEP
+    history = np.arange(0, 1000) * STEP
+    CandleStore(tmp_path).append("XAUUSD", "15m", _bars(live[:1]))
+
+    def bridge():
+        s = CandleStore(tmp_path)
+        for t in live[1:]:
+            s.append("XAUUSD", "15m", _bars([t]))
+
+    def warmup():
+        s = CandleStore(tmp_path)
+        # newest history first, each chunk lands in front of what is stored
+        for hi in range(1000, 0, -50):
+            s.merge("XAUUSD", "15m", _bars(history[hi - 50:hi]))
+
+    ts = [threading.Thread(target=bridge), threading.Thread(target=warmup)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    got = CandleStore(tmp_path).read("XAUUSD", "15m")["time"]
+    np.testing.assert_array_equal(got, np.concatenate([history, live]))
@@ -0,0 +1,45 @@
+﻿"""Incremental indicators vs the batch functions in training/train_smc.py (same check as
+`python indicators.py --check`, on a short slice so it runs in the normal test pass)."""
+import glob
+import os
+
+import numpy as np
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("torch")   # train_smc imports it at module level
+
+from indicators import _series, check
+
+SLICE = 400
+ATR_TOL = 1e-9     # relative
+FEAT_TOL = 1e-5    # absolute, float32 features
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "training", "data")
+CSVS = sorted(glob.glob(os.path.join(DATA, "*.csv")))
+
+def _load(path, n=SLICE):
+    d = pd.read_csv(path).sort_values("time").tail(n)
+    return tuple(d[k].to_numpy(np.float64) for k in ("open", "high", "low", "close", "volume"))
+
+@pytest.mark.parametrize("path", CSVS, ids=[os.path.basename(p) for p in CSVS])
+def test_training_slice_matches_batch(path):
+    d_atr, d_feat = check(_load(path))
+    assert d_atr <= ATR_TOL
+    assert d_feat <= FEAT_TOL
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")   # inf - inf in the batch reference
+@pytest.mark.parametrize("bad", [np.nan, np.inf])
+def test_non_finite_volume_leaves_with_the_bar(bad):
+    # NaN features while the bar is in the window, exact again once it has left
+    o, h, l, c, v = _series(300)
+    v[[70, 75, 200]] = bad
+    d_atr, d_feat = check((o, h, l, c, v))
+    assert d_atr <= ATR_TOL
+    assert d_feat <= FEAT_TOL
+
+def test_synthetic_across_resync():
+    # > 4096 updates so the running sums are rebuilt from the rings at least once
+    d_atr, d_feat = check(_series(5000), every=7)
+    assert d_atr <= ATR_TOL
+    assert d_feat <= FEAT_TOL
@@ -0,0 +1,34 @@
+﻿"""The committed smc_<tf>_raw graphs (build_feature_window folded in) must give the same
+outputs on raw OHLCV windows as smc_<tf>.onnx on the Python-normalized windows."""
+import os
+
+import numpy as np
+import pytest
+
+ort = pytest.importorskip("onnxruntime")
+pytest.importorskip("torch")   # export_onnx / train_smc import it at module level
+
+from export_onnx import real_windows
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SMC_DIR = os.path.join(HERE, "..", "..", "assets", "models", "smc")
+DATA = os.path.join(HERE, "..", "..", "training", "data")
+ATOL, RTOL = 1e-4, 1e-3   # same as export_raw_pipeline
+
+def _run(path, X):
+    s = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    return s.run(None, {s.get_inputs()[0].name: X.astype(np.float32)})[0]
+
+@pytest.mark.parametrize("raw_name", ["smc_{tf}_raw.onnx", "smc_{tf}_raw.opt.onnx"])
+@pytest.mark.parametrize("tf", ["15m", "30m"])
+def test_raw_graph_matches_normalized(tf, raw_name):
+    raw_path = os.path.join(SMC_DIR, raw_name.format(tf=tf))
+    norm_path = os.path.join(SMC_DIR, f"smc_{tf}.onnx")
+    if not os.path.exists(raw_path):
+        pytest.skip(f"{os.path.basename(raw_path)} not exported")
+    T = ort.InferenceSession(norm_path, providers=["CPUExecutionProvider"]).get_inputs()[0].shape[1]
+    X_norm, X_raw = real_windows(DATA, tf, T, limit=256)
+
+    ref = _run(norm_path, X_norm)
+    got = _run(raw_path, X_raw)
+    np.testing.assert_allclose(got, ref, atol=ATOL, rtol=RTOL)
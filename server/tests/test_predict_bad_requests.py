@@ -0,0 +1,52 @@
+﻿"""Malformed /predict bodies are the client's fault: 422, never 500 or a silent guess."""
+import io
+
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+TestClient = pytest.importorskip("fastapi.testclient").TestClient
+
+import predict_server
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(predict_server.app, raise_server_exceptions=False)
+
+def _raw(client, body, shape="1,60,5", dtype=None):
+    params = {"tf": "15m"}
+    if dtype:
+        params["dtype"] = dtype
+    return client.post("/predict", params=params, content=body,
+                       headers={"Content-Type": "application/octet-stream", "X-Shape": shape})
+
+X = (np.random.default_rng(0).random((1, 60, 5)) + 1).astype("<f4")
+
+def test_well_formed_binary_body_is_accepted(client):
+    assert _raw(client, X.tobytes()).status_code == 200
+
+@pytest.mark.parametrize("shape", ["1,sixty,5", "1,60.5,5", "1,-60,-5"])
+def test_bad_shape_header(client, shape):
+    assert _raw(client, X.tobytes(), shape=shape).status_code == 422
+
+@pytest.mark.parametrize("dtype", ["int8", "float33", "object"])
+def test_unknown_dtype_is_rejected_not_read_as_float32(client, dtype):
+    assert _raw(client, X.tobytes(), dtype=dtype).status_code == 422
+
+def test_truncated_npy_body(client):
+    bio = io.BytesIO()
+    np.save(bio, X)
+    r = client.post("/predict", params={"tf": "15m"}, content=bio.getvalue()[:-40],
+                    headers={"Content-Type": "application/x-npy"})
+    assert r.status_code == 422
+
+@pytest.mark.parametrize("body", [b"[1, 2, 3]", b'"15m"', b"42", b"null", b"{not json", b"\xff\xfe"])
+def test_json_body_that_is_not_an_object(client, body):
+    r = client.post("/predict", content=body, headers={"Content-Type": "application/json"})
+    assert r.status_code == 422
+
+def test_b64_with_unknown_dtype(client):
+    import base64
+    r = client.post("/predict", json={"tf": "15m", "features_b64": base64.b64encode(X.tobytes()).decode(),
+                                      "shape": [1, 60, 5], "dtype": "int8"})
+    assert r.status_code == 422
@@ -0,0 +1,61 @@
+﻿"""/predict routes client windows by input_format instead of guessing."""
+import numpy as np
+import pytest
+
+pytest.importorskip("onnxruntime")
+TestClient = pytest.importorskip("fastapi.testclient").TestClient
+
+import predict_server
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(predict_server.app)
+
+def _window():
+    rng = np.random.default_rng(0)
+    return (rng.random((1, 60, 5)) + 1).astype("<f4")
+
+def _post(client, **kw):
+    return client.post("/predict", json={"tf": "15m", "features": _window().reshape(-1).tolist(), **kw})
+
+def test_undeclared_features_are_taken_as_normalized(client, monkeypatch):
+    monkeypatch.setattr(predict_server, "RAW_MODELS", False)
+    r = _post(client)
+    assert r.status_code == 200
+    assert r.json()["input_format"] == "features"
+
+@pytest.mark.parametrize("fmt", ["features", "raw_ohlcv"])
+def test_declared_format_picks_matching_graph(client, fmt):
+    r = _post(client, input_format=fmt)
+    assert r.status_code == 200
+    assert r.json()["input_format"] == fmt
+
+def test_binary_body_declares_format_in_query(client):
+    r = client.post("/predict?tf=15m&input_format=raw_ohlcv", content=_window().tobytes(),
+                    headers={"Content-Type": "application/octet-stream", "X-Shape": "1,60,5"})
+    assert r.status_code == 200
+    assert r.json()["input_format"] == "raw_ohlcv"
+
+def test_unknown_format_is_rejected(client):
+    assert _post(client, input_format="ohlc").status_code == 422
+
+def _ict_window():
+    return (np.random.default_rng(1).random(256 * 7) + 1).tolist()
+
+def test_ict_graph_takes_raw_ohlcv(client):
+    r = client.post("/predict", json={"tf": "1m", "features": _ict_window(), "input_format": "raw_ohlcv"})
+    assert r.status_code == 200
+    assert r.json()["input_format"] == "raw_ohlcv"
+
+def test_declared_format_without_model_is_rejected(client):
+    r = client.post("/predict", json={"tf": "1m", "features": _ict_window(), "input_format": "features"})
+    assert r.status_code == 422
+
+def test_fetched_ict_window_reports_raw_ohlcv(client, monkeypatch):
+    rows = (np.random.default_rng(2).random((256, 7)) + 1).astype(np.float32)
+    times = np.arange(256, dtype=np.int64) * 60
+    monkeypatch.setattr(predict_server, "READY_GATE", False)
+    monkeypatch.setattr(predict_server, "_fetch_window", lambda symbol, tf, limit: (times, rows))
+    r = client.post("/predict", json={"tf": "1m", "symbol": "EURUSD"})
+    assert r.status_code == 200
+    assert r.json()["input_format"] == "raw_ohlcv"
@@ -0,0 +1,64 @@
+﻿"""shared_weights: mapped sessions behave like plain ones and keep weights out of private memory."""
+import glob
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ort = pytest.importorskip("onnxruntime")
+onnx = pytest.importorskip("onnx")
+
+import shared_weights
+
+MODELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "assets", "models")
+FILES = sorted(glob.glob(os.path.join(MODELS, "*", "*.onnx")))
+
+def _feed(sess):
+    i = sess.get_inputs()[0]
+    shape = [d if isinstance(d, int) else 2 for d in i.shape]
+    return {i.name: (np.random.default_rng(0).random(shape) + 1).astype(np.float32)}
+
+@pytest.mark.parametrize("path", FILES, ids=[os.path.basename(p) for p in FILES])
+def test_mapped_session_matches_plain(path, tmp_path):
+    ref = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    got = shared_weights.session(path, ort.SessionOptions(), tmp_path)
+    x = _feed(ref)
+    np.testing.assert_array_equal(got.run(None, x)[0], ref.run(None, x)[0])
+    assert got.get_modelmeta().custom_metadata_map == ref.get_modelmeta().custom_metadata_map
+
+def _matmul_model(path, rows=2048, cols=4096):
+    from onnx import TensorProto, helper, numpy_helper
+    w = np.random.default_rng(1).random((rows, cols), dtype=np.float32)
+    g = helper.make_graph([helper.make_node("MatMul", ["x", "W"], ["y"])], "g",
+                          [helper.make_tensor_value_info("x", TensorProto.FLOAT, [1, rows])],
+                          [helper.make_tensor_value_info("y", TensorProto.FLOAT, [1, cols])],
+                          [numpy_helper.from_array(w, "W")])
+    m = helper.make_model(g, opset_imports=[helper.make_opsetid("", 17)])
+    m.ir_version = 9
+    onnx.save(m, str(path))
+    return w.nbytes
+
+def test_split_is_reused_until_the_source_changes(tmp_path):
+    src = tmp_path / "m.onnx"
+    _matmul_model(src, 64, 64)
+    out = tmp_path / "weights"
+    first = shared_weights.split(src, out)
+    assert shared_weights.split(src, out) == first
+    st = os.stat(src)
+    os.utime(src, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert shared_weights.split(src, out) != first
+    assert len(list(out.glob("*.weights"))) == 2
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc/self/smaps_rollup")
+def test_weights_are_not_copied_into_private_memory(tmp_path):
+    def anon():
+        with open("/proc/self/smaps_rollup") as f:
+            return next(int(l.split()[1]) for l in f if l.startswith("Anonymous:")) * 1024
+    src = tmp_path / "big.onnx"
+    nbytes = _matmul_model(src)                       # 32 MB of weights
+    shared_weights.split(src, tmp_path / "weights")   # done by the parent before workers start
+    before = anon()
+    sess = shared_weights.session(src, ort.SessionOptions(), tmp_path / "weights")
+    sess.run(None, _feed(sess))
+    assert anon() - before < nbytes / 4
@@ -0,0 +1,239 @@
+﻿"""
+Tick -> OHLCV aggregation for every timeframe at once.
+
+State is a handful of (symbols x timeframes) numpy arrays holding each
+forming bar. Ticks only touch the base (1m) bar; when a 1m bar closes it
+is folded into the forming bar of every higher timeframe, so 5m..1d are
+rolled up from 1m instead of being queried separately.
+
+Bar times come from tick time (MT5 server time), like MT5's own bars.
+A bar closes when the first tick of a later bar arrives, or when flush()
+sees the server clock (wall clock + last observed server offset) pass its
+end, so quiet markets still close on time. Closed bars are returned as
+MT5 rates records (RATES_DTYPE), ready for the candle store and Node.
+
+reconcile() compares a closed bar with what copy_rates returns for it and
+hands back MT5's version when they differ (missed ticks, late ticks,
+bars that had no ticks here at all).
+"""
+from __future__ import annotations
+
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# same layout as MetaTrader5.copy_rates_* results
+RATES_DTYPE = np.dtype([
+    ("time", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("tick_volume", "<u8"),
+    ("spread", "<i4"),
+    ("real_volume", "<u8"),
+])
+
+TF_SEC = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "4h": 14400, "1d": 86400}
+DEFAULT_TFS = ("1m", "5m", "15m", "30m", "1h", "4h", "1d")
+
+# a bar is closed by flush() this long after its end (lets in-flight ticks land)
+FLUSH_GRACE_SEC = 0.3
+
+Closed = Tuple[str, str, np.ndarray]      # (symbol, tf, RATES_DTYPE record array of length 1)
+
+class TickAggregator:
+    def __init__(self, symbols: Iterable[str], tfs: Iterable[str] = DEFAULT_TFS):
+        self.symbols = list(symbols)
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.tfs = sorted(tfs, key=lambda t: TF_SEC[t])
+        self.step = np.array([TF_SEC[t] for t in self.tfs], dtype=np.int64)
+        if np.any(self.step % self.step[0]):
+            raise ValueError(f"every timeframe must be a multiple of {self.tfs[0]}: {self.tfs}")
+
+        shape = (len(self.symbols), len(self.tfs))
+        self.start = np.full(shape, -1, dtype=np.int64)      # forming bar open time, -1 = none
+        self.o = np.zeros(shape)
+        self.h = np.zeros(shape)
+        self.l = np.zeros(shape)
+        self.c = np.zeros(shape)
+        self.v = np.zeros(shape, dtype=np.int64)
+        self.closed = np.zeros(shape, dtype=RATES_DTYPE)      # last closed bar per (symbol, tf)
+        self.closed["time"] = -1
+
+        self.last_msc = np.zeros(len(self.symbols), dtype=np.int64)
+        # volume of a seeded base bar already counted in the seeded higher bars
+        self.seed_v = np.zeros(len(self.symbols), dtype=np.int64)
+        self.offset = 0.0                                     # server time - wall time
+        self.pending: Set[Tuple[str, str]] = set()            # closed since take_pending()
+        self.stats = {"ticks": 0, "late": 0, "closed": 0, "fixed": 0, "missed": 0}
+
+    # ---------------- seeding ----------------
+    def seed(self, symbol: str, tf: str, rate) -> None:
+        """Adopt MT5's forming bar (copy_rates pos 0) so the first closed bar is
+        complete. Call for every tf, then set_last_msc() with the current tick."""
+        s, k = self.index[symbol], self.tfs.index(tf)
+        self.start[s, k] = int(rate["time"])
+        self.o[s, k] = float(rate["open"])
+        self.h[s, k] = float(rate["high"])
+        self.l[s, k] = float(rate["low"])
+        self.c[s, k] = float(rate["close"])
+        self.v[s, k] = int(rate["tick_volume"])
+        if k == 0:
+            self.seed_v[s] = self.v[s, 0]
+
+    def set_last_msc(self, symbol: str, msc: int) -> None:
+        self.last_msc[self.index[symbol]] = int(msc)
+
+    # ---------------- ticks ----------------
+    def update(self, symbol: str, ticks: np.ndarray) -> List[Closed]:
+        """Feed MT5 ticks (copy_ticks_* array, oldest first). Ticks at or before the
+        last one seen are skipped. Returns bars closed by these ticks."""
+        s = self.index[symbol]
+        msc = ticks["time_msc"].astype(np.int64)
+        new = msc > self.last_msc[s]
+        if not new.any():
+            return []
+        ticks, msc = ticks[new], msc[new]
+        price = np.where(ticks["bid"] > 0, ticks["bid"], ticks["last"]).astype(np.float64)
+
+        self.last_msc[s] = msc[-1]
+        self.offset = msc[-1] / 1000.0 - time.time()
+        self.stats["ticks"] += len(msc)
+
+        # one group per base bar: o/h/l/c/count of the ticks inside it
+        t = msc // 1000
+        bs = t - t % self.step[0]
+        cut = np.flatnonzero(np.diff(bs)) + 1
+        first = np.concatenate([[0], cut])
+        last = np.concatenate([cut, [len(bs)]]) - 1
+        hi = np.maximum.reduceat(price, first)
+        lo = np.minimum.reduceat(price, first)
+
+        out: List[Closed] = []
+        for g in range(len(first)):
+            self._add_base(s, int(bs[first[g]]), price[first[g]], hi[g], lo[g], price[last[g]],
+                           int(last[g] - first[g] + 1), out)
+        return out
+
+    def _add_base(self, s, bs, o, h, l, c, n, out):
+        cur = self.start[s, 0]
+        if cur == bs:
+            self.h[s, 0] = max(self.h[s, 0], h)
+            self.l[s, 0] = min(self.l[s, 0], l)
+            self.c[s, 0] = c
+            self.v[s, 0] += n
+            return
+        if cur > bs:
+            # tick for a bar already closed; reconcile() picks up the difference
+            self.stats["late"] += n
+            return
+        if cur >= 0:
+            self._close_base(s, out)
+        self._close_higher(s, bs, out)
+        self.start[s, 0] = bs
+        self.o[s, 0], self.h[s, 0], self.l[s, 0], self.c[s, 0] = o, h, l, c
+        self.v[s, 0] = n
+
+    def _close_base(self, s, out):
+        """Close the forming 1m bar and fold it into every higher timeframe."""
+        bs = self.start[s, 0]
+        o, h, l, c = self.o[s, 0], self.h[s, 0], self.l[s, 0], self.c[s, 0]
+        v = self.v[s, 0] - self.seed_v[s]
+        self.seed_v[s] = 0
+        out.append(self._emit(s, 0))
+        for k in range(1, len(self.tfs)):
+            hs = bs - bs % self.step[k]
+            if self.start[s, k] >= 0 and self.start[s, k] != hs:
+                out.append(self._emit(s, k))
+            if self.start[s, k] < 0:
+                self.start[s, k] = hs
+                self.o[s, k], self.h[s, k], self.l[s, k], self.c[s, k] = o, h, l, c
+                self.v[s, k] = v
+            else:
+                self.h[s, k] = max(self.h[s, k], h)
+                self.l[s, k] = min(self.l[s, k], l)
+                self.c[s, k] = c
+                self.v[s, k] += v
+
+    def _close_higher(self, s, t, out):
+        """Close higher-tf bars that end at or before server time t."""
+        for k in range(1, len(self.tfs)):
+            if 0 <= self.start[s, k] and self.start[s, k] + self.step[k] <= t:
+                out.append(self._emit(s, k))
+
+    def _emit(self, s, k) -> Closed:
+        rec = np.zeros(1, dtype=RATES_DTYPE)
+        rec["time"] = self.start[s, k]
+        rec["open"], rec["high"], rec["low"], rec["close"] = self.o[s, k], self.h[s, k], self.l[s, k], self.c[s, k]
+        rec["tick_volume"] = max(int(self.v[s, k]), 0)
+        self.closed[s, k] = rec[0]
+        self.start[s, k] = -1
+        self.pending.add((self.symbols[s], self.tfs[k]))
+        self.stats["closed"] += 1
+        return (self.symbols[s], self.tfs[k], rec)
+
+    # ---------------- clock ----------------
+    def server_now(self) -> float:
+        return time.time() + self.offset
+
+    def flush(self, now: Optional[float] = None) -> List[Closed]:
+        """Close every bar whose end has passed on the server clock."""
+        now = (self.server_now() if now is None else now) - FLUSH_GRACE_SEC
+        due = (self.start >= 0) & (self.start + self.step[None, :] <= now)
+        out: List[Closed] = []
+        for s in np.flatnonzero(due.any(axis=1)):
+            if due[s, 0]:
+                self._close_base(s, out)
+            self._close_higher(s, now, out)
+        return out
+
+    # ---------------- views ----------------
+    def forming(self, symbol: str, tf: str) -> Optional[np.ndarray]:
+        """Current forming bar of tf, including the unclosed 1m bar."""
+        s, k = self.index[symbol], self.tfs.index(tf)
+        if self.start[s, 0] < 0 and self.start[s, k] < 0:
+            return None
+        rec = np.zeros(1, dtype=RATES_DTYPE)
+        b = self.start[s, 0]
+        base = b >= 0 and (self.start[s, k] < 0 or b - b % self.step[k] == self.start[s, k])
+        if self.start[s, k] >= 0 and k > 0:
+            rec["time"] = self.start[s, k]
+            rec["open"], rec["high"], rec["low"], rec["close"] = self.o[s, k], self.h[s, k], self.l[s, k], self.c[s, k]
+            rec["tick_volume"] = self.v[s, k]
+            if base:
+                rec["high"] = max(self.h[s, k], self.h[s, 0])
+                rec["low"] = min(self.l[s, k], self.l[s, 0])
+                rec["close"] = self.c[s, 0]
+                rec["tick_volume"] = self.v[s, k] + self.v[s, 0] - self.seed_v[s]
+        else:
+            rec["time"] = b - b % self.step[k]
+            rec["open"], rec["high"], rec["low"], rec["close"] = self.o[s, 0], self.h[s, 0], self.l[s, 0], self.c[s, 0]
+            rec["tick_volume"] = self.v[s, 0]
+        return rec
+
+    # ---------------- reconcile ----------------
+    def take_pending(self) -> List[Tuple[str, str]]:
+        p = sorted(self.pending)
+        self.pending.clear()
+        return p
+
+    def reconcile(self, symbol: str, tf: str, rate) -> Optional[np.ndarray]:
+        """`rate` is MT5's last closed bar for (symbol, tf). Returns it (as a
+        1-record RATES_DTYPE array) when it should replace what was emitted."""
+        s, k = self.index[symbol], self.tfs.index(tf)
+        t = int(rate["time"])
+        mine = self.closed[s, k]
+        if t < int(mine["time"]) or t == self.start[s, k]:
+            return None
+        if t == int(mine["time"]) and all(
+                float(mine[f]) == float(rate[f]) for f in ("open", "high", "low", "close")) \
+                and int(mine["tick_volume"]) == int(rate["tick_volume"]):
+            return None
+        self.stats["fixed" if t == int(mine["time"]) else "missed"] += 1
+        rec = np.zeros(1, dtype=RATES_DTYPE)
+        for f in RATES_DTYPE.names:
+            rec[f] = rate[f]
+        self.closed[s, k] = rec[0]
+        return rec
@@ -0,0 +1,252 @@
+﻿import os, time, argparse
+import numpy as np
+import pandas as pd
+import onnxruntime as ort
+from numpy.lib.stride_tricks import sliding_window_view
+
+from train_smc import load_csvs
+
+# -------------------------
+# Walk-forward backtest of the served ONNX models over CSV history
+#
+# Same trade rules as train_smc.simulate_label, vectorized:
+#   window   = bars [i-T, i)          (T = model input length)
+#   entry    = close[i]
+#   SL dist  = max(1.5 * ATR14[i], 0.0008 * |entry|),  TP dist = 2 * SL dist
+#   outcome  = first of TP / SL within the next `horizon` bars;
+#              both on the same bar = ambiguous (booked as a loss here,
+#              simulate_label drops it), neither = timeout at close[i+horizon]
+# Results are in R (multiples of the SL distance): TP = +2, SL = -1.
+# -------------------------
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(HERE, "..", "assets", "models")
+
+TF_MODEL = {
+    "1m":  ("ict", "ict_1m"),
+    "5m":  ("ict", "ict_5m"),
+    "15m": ("smc", "smc_15m"),
+    "30m": ("smc", "smc_30m"),
+}
+
+TP, SL, AMBIGUOUS, TIMEOUT = 0, 1, 2, 3
+
+def model_path(models_dir, tf, raw=True):
+    """Same preference order as predict_server._model_file."""
+    sub, key = TF_MODEL[tf]
+    d = os.path.join(models_dir, sub)
+    names = [f"{key}.opt.onnx", f"{key}.onnx"]
+    if raw:
+        names = [f"{key}_raw.opt.onnx", f"{key}_raw.onnx"] + names
+    for n in names:
+        p = os.path.join(d, n)
+        if os.path.exists(p):
+            return p
+    raise FileNotFoundError(f"no model for {tf} in {d}")
+
+def load_model(path, fallback_T=60, fallback_F=5):
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess = ort.InferenceSession(path, sess_options=so, providers=["CPUExecutionProvider"])
+    shape = sess.get_inputs()[0].shape
+    T = shape[1] if len(shape) >= 3 and isinstance(shape[1], int) else fallback_T
+    F = shape[2] if len(shape) >= 3 and isinstance(shape[2], int) else fallback_F
+    fmt = sess.get_modelmeta().custom_metadata_map.get("input_format", "features")
+    return sess, T, F, fmt
+
+def atr_vec(high, low, close, period=14):
+    """train_smc.compute_atr without the Python loop."""
+    prev_close = np.concatenate([[close[0]], close[:-1]])
+    tr = np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+    atr = np.full_like(tr, np.nan, dtype=np.float64)
+    if len(tr) >= period:
+        atr[period - 1:] = sliding_window_view(tr, period).mean(axis=1)
+    return atr
+
+def normalize_windows(W):
+    """train_smc.build_feature_window over a batch [B, T, 5] (float64 math)."""
+    w = W.astype(np.float64)
+    ref = w[:, -1, 3].copy()
+    bad = (ref == 0) | ~np.isfinite(ref)
+    if bad.any():
+        with np.errstate(invalid="ignore", divide="ignore"):
+            alt = np.nanmean(w[bad, :, 3], axis=1)
+        alt[(alt == 0) | ~np.isfinite(alt)] = 1.0
+        ref[bad] = alt
+    w[:, :, 0:4] = w[:, :, 0:4] / ref[:, None, None] - 1.0
+    v = np.log1p(np.maximum(w[:, :, 4], 0.0))
+    w[:, :, 4] = (v - v.mean(axis=1, keepdims=True)) / (v.std(axis=1, keepdims=True) + 1e-6)
+    return w.astype(np.float32)
+
+def buy_prob(y):
+    """Model outputs -> BUY probability, read the way predict_server._to_side_conf does."""
+    y = y.reshape(len(y), -1).astype(np.float64)
+    if y.shape[1] >= 2:
+        z = y[:, :2] - y[:, :2].max(axis=1, keepdims=True)
+        e = np.exp(z)
+        return e[:, 1] / e.sum(axis=1)
+    return 0.5 * (1.0 + np.tanh(0.5 * y[:, 0]))      # overflow-free sigmoid
+
+def outcomes(h, l, c, idx, is_buy, sl_dist, horizon):
+    """Vectorized TP/SL walk for entries at `idx` -> (result code, R, bars held)."""
+    H = sliding_window_view(h, horizon)[idx + 1]       # h[i+1 : i+1+horizon]
+    L = sliding_window_view(l, horizon)[idx + 1]
+    entry = c[idx]
+    tp_dist = 2.0 * sl_dist
+
+    up = (entry + np.where(is_buy, tp_dist, sl_dist))[:, None]
+    dn = (entry - np.where(is_buy, sl_dist, tp_dist))[:, None]
+    hit_up = H >= up
+    hit_dn = L <= dn
+    hit_tp = np.where(is_buy[:, None], hit_up, hit_dn)
+    hit_sl = np.where(is_buy[:, None], hit_dn, hit_up)
+
+    def first(m):
+        return np.where(m.any(axis=1), m.argmax(axis=1), horizon)
+
+    ft, fs = first(hit_tp), first(hit_sl)
+    res = np.full(len(idx), TIMEOUT, dtype=np.int8)
+    res[ft < fs] = TP
+    res[fs < ft] = SL
+    res[(ft == fs) & (ft < horizon)] = AMBIGUOUS
+
+    direction = np.where(is_buy, 1.0, -1.0)
+    R = np.where(res == TP, 2.0, -1.0)
+    to = res == TIMEOUT
+    R[to] = (c[idx[to] + horizon] - entry[to]) * direction[to] / sl_dist[to]
+    held = np.minimum(np.minimum(ft, fs), horizon - 1) + 1
+    return res, R, held
+
+def backtest_series(d, sess, T, F, fmt, horizon=24, atr_period=14, batch=4096, min_conf=0.0, one_position=False, stride=1):
+    d = d.sort_values("t").drop_duplicates("t", keep="last")
+    o, h, l, c, v = (d[k].to_numpy(np.float64) for k in ("open", "high", "low", "close", "volume"))
+    n = len(d)
+    empty = {"bars": n, "signals": 0, "R": np.zeros(0), "res": np.zeros(0, dtype=np.int8), "score_sec": 0.0}
+    if n < T + horizon + 2:
+        return empty
+
+    atr = atr_vec(h, l, c, atr_period)
+    idx = np.arange(T, n - horizon - 1)                # same range as simulate_label
+    idx = idx[np.isfinite(atr[idx])][::max(int(stride), 1)]
+
+    # model input columns as predict_server builds them (spread / real_volume are 0 in CSVs)
+    base = np.zeros((n, max(F, 5)), dtype=np.float32)
+    base[:, :5] = np.stack([o, h, l, c, v], axis=1)
+    base = base[:, :F]
+    wins = sliding_window_view(base, T, axis=0)        # wins[k] = base[k:k+T].T, no copy
+    name = sess.get_inputs()[0].name
+    normalize = fmt != "raw_ohlcv" and F == 5
+
+    t0 = time.perf_counter()
+    p = np.empty(len(idx), dtype=np.float64)
+    for s in range(0, len(idx), batch):
+        k = idx[s:s + batch] - T
+        X = np.ascontiguousarray(wins[k].transpose(0, 2, 1))
+        if normalize:
+            X = normalize_windows(X)
+        p[s:s + batch] = buy_prob(np.asarray(sess.run(None, {name: X})[0]))
+    score_sec = time.perf_counter() - t0
+
+    conf = np.maximum(p, 1.0 - p) * 100.0
+    take = conf >= min_conf
+    idx, p = idx[take], p[take]
+    if len(idx) == 0:
+        return dict(empty, signals=int(take.sum()), score_sec=score_sec)
+
+    is_buy = p >= 0.5
+    sl_dist = np.maximum(atr[idx] * 1.5, np.abs(c[idx]) * 0.0008)
+    res, R, held = outcomes(h, l, c, idx, is_buy, sl_dist, horizon)
+
+    if one_position:
+        # no new entry until the open trade has exited
+        keep = []
+        j = 0
+        while j < len(idx):
+            keep.append(j)
+            j = int(np.searchsorted(idx, idx[j] + held[j] + 1))
+        res, R = res[keep], R[keep]
+
+    return {"bars": n, "signals": int(len(idx)), "R": R, "res": res, "score_sec": score_sec}
+
+def summarize(R, res):
+    n = len(R)
+    if n == 0:
+        return {"trades": 0, "tp": 0, "sl": 0, "ambiguous": 0, "timeout": 0,
+                "hit_rate": np.nan, "expectancy_R": np.nan, "total_R": 0.0, "max_dd_R": 0.0}
+    eq = np.cumsum(R)
+    peak = np.maximum.accumulate(np.concatenate([[0.0], eq]))[1:]
+    return {
+        "trades": n,
+        "tp": int((res == TP).sum()),
+        "sl": int((res == SL).sum()),
+        "ambiguous": int((res == AMBIGUOUS).sum()),
+        "timeout": int((res == TIMEOUT).sum()),
+        "hit_rate": round(float((res == TP).mean()) * 100.0, 2),
+        "expectancy_R": round(float(R.mean()), 4),
+        "total_R": round(float(eq[-1]), 2),
+        "max_dd_R": round(float((peak - eq).max()), 2),
+    }
+
+def run(df, models_dir=MODELS_DIR, tfs=None, symbols=None, raw=True, **kw):
+    df = df.copy()
+    df["tf"] = df["tf"].astype(str).str.lower()
+    df["t"] = pd.to_datetime(df["time"], utc=True)
+    tfs = tfs or [t for t in TF_MODEL if t in set(df["tf"])]
+    rows = []
+    for tf in tfs:
+        path = model_path(models_dir, tf, raw=raw)
+        sess, T, F, fmt = load_model(path)
+        d_tf = df[df["tf"] == tf]
+        all_R, all_res = [], []
+        for sym in sorted(d_tf["symbol"].unique()):
+            if symbols and sym not in symbols:
+                continue
+            t0 = time.perf_counter()
+            r = backtest_series(d_tf[d_tf["symbol"] == sym], sess, T, F, fmt, **kw)
+            all_R.append(r["R"]); all_res.append(r["res"])
+            rows.append({"symbol": sym, "tf": tf, "model": os.path.basename(path), "bars": r["bars"],
+                         "signals": r["signals"], **summarize(r["R"], r["res"]),
+                         "score_sec": round(r["score_sec"], 3), "sec": round(time.perf_counter() - t0, 3)})
+        if len(all_R) > 1:
+            # per-tf line: trades concatenated symbol by symbol
+            R, res = np.concatenate(all_R), np.concatenate(all_res)
+            rows.append({"symbol": "ALL", "tf": tf, "model": os.path.basename(path),
+                         "bars": sum(x["bars"] for x in rows if x["tf"] == tf and x["symbol"] != "ALL"),
+                         "signals": sum(x["signals"] for x in rows if x["tf"] == tf and x["symbol"] != "ALL"),
+                         **summarize(R, res),
+                         "score_sec": round(sum(x["score_sec"] for x in rows if x["tf"] == tf and x["symbol"] != "ALL"), 3),
+                         "sec": round(sum(x["sec"] for x in rows if x["tf"] == tf and x["symbol"] != "ALL"), 3)})
+    return pd.DataFrame(rows)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data-dir", default=os.path.join(HERE, "data"), help="folder containing CSV files")
+    ap.add_argument("--models-dir", default=MODELS_DIR)
+    ap.add_argument("--tfs", default=None, help="comma list (default: every tf with data and a model)")
+    ap.add_argument("--symbols", default=None, help="comma list (default: all)")
+    ap.add_argument("--horizon", type=int, default=24)
+    ap.add_argument("--atr-period", type=int, default=14)
+    ap.add_argument("--batch", type=int, default=4096, help="windows per ONNX run")
+    ap.add_argument("--min-conf", type=float, default=0.0, help="skip signals below this confidence (%%)")
+    ap.add_argument("--one-position", action="store_true", help="no new entry while a trade is open")
+    ap.add_argument("--stride", type=int, default=1, help="score every Nth bar only (quick passes with the heavier ICT models)")
+    ap.add_argument("--no-raw", action="store_true", help="use the normalized-input models (NumPy preprocessing)")
+    ap.add_argument("--out", default=None, help="write the report as CSV")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    df = load_csvs(args.data_dir)
+    tfs = [t.strip().lower() for t in args.tfs.split(",")] if args.tfs else None
+    symbols = {s.strip().upper() for s in args.symbols.split(",")} if args.symbols else None
+    rep = run(df, models_dir=args.models_dir, tfs=tfs, symbols=symbols, raw=not args.no_raw,
+              horizon=args.horizon, atr_period=args.atr_period, batch=args.batch,
+              min_conf=args.min_conf, one_position=args.one_position, stride=args.stride)
+
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(rep.to_string(index=False))
+    if args.out:
+        rep.to_csv(args.out, index=False)
+        print(f"✅ Saved report: {args.out}")
+    print(f"done in {time.perf_counter() - t0:.1f}s")
+
+if __name__ == "__main__":
+    main()
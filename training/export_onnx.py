@@ -0,0 +1,340 @@
+﻿import os, json, time, argparse, platform
+from datetime import datetime, timezone
+import numpy as np
+
+import torch
+import torch.nn as nn
+import onnxruntime as ort
+
+# -------------------------
+# Export / optimize / verify / benchmark
+#
+#   smc_15m.onnx            torch export, dynamic batch (and optionally time) axis
+#   smc_15m.opt.onnx        ORT offline-optimized graph
+#   smc_15m.onnx.json       parity + latency report
+#   smc_15m_raw.onnx        same network with build_feature_window folded in front:
+#   smc_15m_raw.opt.onnx    takes raw [B, T, 5] OHLCV (predict_server: fetched / raw_ohlcv windows)
+#   smc_15m_raw.onnx.json   parity vs the Python preprocessing + latency comparison
+# -------------------------
+BENCH_BATCHES = (1, 8, 32, 77, 256)
+
+RAW_FORMAT = "raw_ohlcv"
+
+class FeatureWindowNorm(nn.Module):
+    """train_smc.build_feature_window as graph ops, batched.
+
+    [B, T, 5] raw open/high/low/close/volume -> [B, T, 5] float32
+    prices / last close - 1 (fallback: nanmean close, then 1.0),
+    volume -> z-score of log1p(max(v, 0)) with population std + 1e-6.
+    Computed in float64 like the NumPy version.
+    """
+    def forward(self, x):
+        w = x.to(torch.float64)
+        c = w[:, :, 3]
+
+        ref = c[:, -1]
+        nan = torch.isnan(c)
+        cnt = (~nan).to(torch.float64).sum(dim=1)
+        alt = torch.where(nan, torch.zeros_like(c), c).sum(dim=1) / cnt
+        alt = torch.where((alt == 0) | ~torch.isfinite(alt), torch.ones_like(alt), alt)
+        ref = torch.where((ref == 0) | ~torch.isfinite(ref), alt, ref)
+
+        px = w[:, :, 0:4] / ref[:, None, None] - 1.0
+
+        v = torch.log1p(torch.clamp(w[:, :, 4], min=0.0))
+        m = v.mean(dim=1, keepdim=True)
+        sd = torch.sqrt(((v - m) ** 2).mean(dim=1, keepdim=True))
+        v = (v - m) / (sd + 1e-6)
+
+        return torch.cat([px, v[:, :, None]], dim=2).to(torch.float32)
+
+class WithPreprocess(nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.norm = FeatureWindowNorm()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(self.norm(x))
+
+def _tag_raw(onnx_path):
+    import onnx
+    m = onnx.load(onnx_path)
+    kv = m.metadata_props.add()
+    kv.key = "input_format"
+    kv.value = RAW_FORMAT
+    onnx.save(m, onnx_path)
+
+def export_onnx(model, onnx_path, T, F, dynamic_time=False, opset=18):
+    model.eval()
+    # batch 2 so the tracer cannot specialise anything on batch == 1
+    dummy = torch.randn(2, T, F, dtype=torch.float32)
+    axes = {"x": {0: "batch"}, "logits": {0: "batch"}}
+    if dynamic_time:
+        axes["x"][1] = "time"
+
+    torch.onnx.export(
+        model,
+        dummy,
+        onnx_path,
+        input_names=["x"],
+        output_names=["logits"],
+        dynamic_axes=axes,
+        opset_version=opset,
+        do_constant_folding=True,
+        dynamo=False,
+    )
+    return onnx_path
+
+def optimize_onnx(src, dst):
+    # EXTENDED (not ALL): ALL adds layout transforms tied to this machine's CPU
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    so.optimized_model_filepath = dst
+    ort.InferenceSession(src, sess_options=so, providers=["CPUExecutionProvider"])
+    return dst
+
+def _session(path):
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ort.InferenceSession(path, sess_options=so, providers=["CPUExecutionProvider"])
+
+def torch_outputs(model, X, batch=1024):
+    model.eval()
+    outs = []
+    with torch.no_grad():
+        for i in range(0, len(X), batch):
+            outs.append(model(torch.from_numpy(np.ascontiguousarray(X[i:i + batch]))).numpy())
+    return np.concatenate(outs).reshape(len(X), -1)
+
+def check_parity(model, onnx_path, X, atol=1e-4, rtol=1e-3):
+    """ONNX vs PyTorch on real windows; raises if they disagree."""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    ref = torch_outputs(model, X)
+    sess = _session(onnx_path)
+    got = np.asarray(sess.run(None, {sess.get_inputs()[0].name: X})[0]).reshape(len(X), -1)
+
+    diff = np.abs(got - ref)
+    rep = {
+        "samples": int(len(X)),
+        "max_abs": float(diff.max()) if diff.size else 0.0,
+        "mean_abs": float(diff.mean()) if diff.size else 0.0,
+        "sign_agree": float(np.mean(np.sign(got) == np.sign(ref))) if diff.size else 1.0,
+        "atol": atol,
+        "rtol": rtol,
+    }
+    rep["ok"] = bool(np.allclose(got, ref, atol=atol, rtol=rtol))
+    if not rep["ok"]:
+        raise RuntimeError(f"ONNX parity failed for {onnx_path}: {rep}")
+    return rep
+
+def bench(onnx_path, T, F, batches=BENCH_BATCHES, runs=50, warmup=5):
+    sess = _session(onnx_path)
+    name = sess.get_inputs()[0].name
+    rng = np.random.default_rng(0)
+    res = {}
+    for b in batches:
+        X = rng.standard_normal((b, T, F)).astype(np.float32)
+        for _ in range(warmup):
+            sess.run(None, {name: X})
+        ts = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            sess.run(None, {name: X})
+            ts.append((time.perf_counter() - t0) * 1000.0)
+        ts = np.array(ts)
+        res[str(b)] = {
+            "p50_ms": round(float(np.percentile(ts, 50)), 4),
+            "p90_ms": round(float(np.percentile(ts, 90)), 4),
+            "per_sample_us": round(float(np.percentile(ts, 50)) * 1000.0 / b, 2),
+        }
+    return res
+
+def export_pipeline(model, onnx_path, X_real, dynamic_time=False, bench_runs=50):
+    """Export with dynamic axes, optimize offline, verify on X_real, benchmark,
+    and write <onnx_path>.json. Returns the report dict."""
+    T, F = int(X_real.shape[1]), int(X_real.shape[2])
+    export_onnx(model, onnx_path, T, F, dynamic_time=dynamic_time)
+    opt_path = optimize_onnx(onnx_path, _opt_name(onnx_path))
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "input": {"name": "x", "T": T, "F": F, "dynamic_batch": True, "dynamic_time": bool(dynamic_time)},
+        "files": {"export": os.path.basename(onnx_path), "optimized": os.path.basename(opt_path)},
+        "parity": {
+            "export": check_parity(model, onnx_path, X_real),
+            "optimized": check_parity(model, opt_path, X_real),
+        },
+        "bench": {
+            "export": bench(onnx_path, T, F, runs=bench_runs),
+            "optimized": bench(opt_path, T, F, runs=bench_runs),
+        },
+        "env": {
+            "torch": torch.__version__,
+            "onnxruntime": ort.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+    }
+    if dynamic_time:
+        # same windows cut to half length must still run
+        half = np.ascontiguousarray(X_real[:, T // 2:, :])
+        report["parity"]["half_time"] = check_parity(model, opt_path, half)
+
+    with open(onnx_path + ".json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    p = report["parity"]["optimized"]
+    print(f"✅ Saved ONNX: {onnx_path} (+ {os.path.basename(opt_path)}) | parity max_abs {p['max_abs']:.2e} on {p['samples']} windows")
+    for b, r in report["bench"]["optimized"].items():
+        print(f"   batch {b:>4}: p50 {r['p50_ms']:.3f} ms  ({r['per_sample_us']:.1f} us/sample)")
+    return report
+
+def _opt_name(onnx_path):
+    return onnx_path[:-len(".onnx")] + ".opt.onnx" if onnx_path.endswith(".onnx") else onnx_path + ".opt"
+
+def python_preprocess(X_raw):
+    from train_smc import build_feature_window
+    return np.stack([build_feature_window(w) for w in X_raw]).astype(np.float32)
+
+def compare_preprocess_latency(raw_path, norm_path, X_raw, batches=(1, 77), runs=30):
+    """raw graph on raw windows vs build_feature_window in Python + normalized graph."""
+    s_raw, s_norm = _session(raw_path), _session(norm_path)
+    n_raw, n_norm = s_raw.get_inputs()[0].name, s_norm.get_inputs()[0].name
+    res = {}
+    for b in batches:
+        idx = np.arange(b) % len(X_raw)
+        Xb = np.ascontiguousarray(X_raw[idx], dtype=np.float32)
+        for _ in range(3):
+            s_raw.run(None, {n_raw: Xb})
+            s_norm.run(None, {n_norm: python_preprocess(Xb)})
+        t_graph, t_py = [], []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            s_raw.run(None, {n_raw: Xb})
+            t1 = time.perf_counter()
+            s_norm.run(None, {n_norm: python_preprocess(Xb)})
+            t2 = time.perf_counter()
+            t_graph.append((t1 - t0) * 1000.0)
+            t_py.append((t2 - t1) * 1000.0)
+        g, p = float(np.median(t_graph)), float(np.median(t_py))
+        res[str(b)] = {"graph_ms": round(g, 4), "python_ms": round(p, 4), "speedup": round(p / g, 2) if g else None}
+    return res
+
+def export_raw_pipeline(model, onnx_path, X_raw, dynamic_time=False, atol=1e-4, rtol=1e-3):
+    """Export model(build_feature_window(x)) as one graph taking raw OHLCV.
+
+    Parity: the raw graph on raw windows must match the PyTorch model on
+    windows normalized by the NumPy build_feature_window."""
+    X_raw = np.ascontiguousarray(X_raw, dtype=np.float32)
+    T, F = int(X_raw.shape[1]), int(X_raw.shape[2])
+    wrapped = WithPreprocess(model).eval()
+    export_onnx(wrapped, onnx_path, T, F, dynamic_time=dynamic_time)
+    _tag_raw(onnx_path)
+    opt_path = optimize_onnx(onnx_path, _opt_name(onnx_path))
+
+    ref = torch_outputs(model, python_preprocess(X_raw))
+    parity = {}
+    for key, p in (("export", onnx_path), ("optimized", opt_path)):
+        sess = _session(p)
+        got = np.asarray(sess.run(None, {sess.get_inputs()[0].name: X_raw})[0]).reshape(len(X_raw), -1)
+        diff = np.abs(got - ref)
+        parity[key] = {
+            "samples": int(len(X_raw)),
+            "max_abs": float(diff.max()),
+            "mean_abs": float(diff.mean()),
+            "sign_agree": float(np.mean(np.sign(got) == np.sign(ref))),
+            "ok": bool(np.allclose(got, ref, atol=atol, rtol=rtol)),
+        }
+        if not parity[key]["ok"]:
+            raise RuntimeError(f"raw-input ONNX parity failed for {p}: {parity[key]}")
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "input": {"name": "x", "T": T, "F": F, "format": RAW_FORMAT, "dynamic_batch": True, "dynamic_time": bool(dynamic_time)},
+        "files": {"export": os.path.basename(onnx_path), "optimized": os.path.basename(opt_path)},
+        "parity": parity,
+        "bench": {"optimized": bench(opt_path, T, F)},
+        "vs_python_preprocess": None,
+        "env": {"torch": torch.__version__, "onnxruntime": ort.__version__, "machine": platform.machine()},
+    }
+    return report, opt_path
+
+def export_with_preprocess(model, onnx_path, X_raw, dynamic_time=False):
+    """export_raw_pipeline + latency comparison against the normalized graph
+    (exported alongside if missing). Writes <onnx_path>.json."""
+    report, opt_path = export_raw_pipeline(model, onnx_path, X_raw, dynamic_time=dynamic_time)
+
+    base = onnx_path.replace("_raw.onnx", ".onnx")
+    norm_opt = _opt_name(base)
+    if not os.path.exists(norm_opt):
+        export_onnx(model, base, X_raw.shape[1], X_raw.shape[2])
+        optimize_onnx(base, norm_opt)
+    report["vs_python_preprocess"] = compare_preprocess_latency(opt_path, norm_opt, X_raw)
+
+    with open(onnx_path + ".json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    p = report["parity"]["optimized"]
+    print(f"✅ Saved raw-input ONNX: {onnx_path} | parity vs NumPy preprocessing max_abs {p['max_abs']:.2e} on {p['samples']} windows")
+    for b, r in report["vs_python_preprocess"].items():
+        print(f"   batch {b:>4}: graph {r['graph_ms']:.3f} ms vs python+onnx {r['python_ms']:.3f} ms ({r['speedup']}x)")
+    return report
+
+# -------------------------
+# CLI: re-export an existing checkpoint
+# -------------------------
+def raw_windows(df, lookback, limit=2048):
+    """Raw [N, lookback, 5] OHLCV windows from one tf's rows (all symbols).
+
+    Over `limit` windows, an evenly strided sample across the whole set is kept, so
+    every symbol and period is covered (not just the tail of the last symbol)."""
+    from numpy.lib.stride_tricks import sliding_window_view
+    wins = []
+    for sym in sorted(df["symbol"].unique()):
+        d = df[df["symbol"] == sym].sort_values("time")
+        a = d[["open", "high", "low", "close", "volume"]].to_numpy(np.float32)
+        if len(a) >= lookback:
+            wins.append(sliding_window_view(a, lookback, axis=0).transpose(0, 2, 1))
+    if not wins:
+        raise RuntimeError(f"Not enough rows for lookback={lookback}")
+    X = np.concatenate(wins)
+    if len(X) > limit:
+        X = X[np.unique(np.linspace(0, len(X) - 1, limit).round().astype(np.int64))]
+    return np.ascontiguousarray(X)
+
+def real_windows(data_dir, tf_name, lookback, limit=2048):
+    from train_smc import load_csvs
+    df = load_csvs(data_dir)
+    df = df[df["tf"].astype(str).str.lower() == tf_name]
+    if df.empty:
+        raise RuntimeError(f"No {tf_name} rows in {data_dir}")
+    X_raw = raw_windows(df, lookback, limit)
+    return python_preprocess(X_raw), X_raw
+
+def main():
+    from train_smc import CandleCNN
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pt", required=True, help="state_dict saved by train_smc.py")
+    ap.add_argument("--out", required=True, help="output .onnx path")
+    ap.add_argument("--data-dir", required=True, help="CSV folder for parity windows")
+    ap.add_argument("--tf", required=True)
+    ap.add_argument("--lookback", type=int, default=60)
+    ap.add_argument("--dynamic-time", action="store_true")
+    ap.add_argument("--bench-runs", type=int, default=50)
+    ap.add_argument("--fold-preprocess", action="store_true",
+                    help="also export <out>_raw.onnx with build_feature_window inside the graph")
+    args = ap.parse_args()
+
+    model = CandleCNN(in_ch=5)
+    model.load_state_dict(torch.load(args.pt, map_location="cpu"))
+    model.eval()
+
+    X, X_raw = real_windows(args.data_dir, args.tf.lower(), args.lookback)
+    export_pipeline(model, args.out, X, dynamic_time=args.dynamic_time, bench_runs=args.bench_runs)
+    if args.fold_preprocess:
+        export_with_preprocess(model, args.out.replace(".onnx", "_raw.onnx"), X_raw, dynamic_time=args.dynamic_time)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+﻿import os, sys, json, time, argparse, itertools, random, shutil, warnings
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# -------------------------
+# Hyperparameter sweep over train_smc.py
+#
+#   python sweep.py --data-dir data --out-dir sweep_out \
+#       --lookback 40,60,90 --horizon 12,24 --lr 3e-4,1e-3 --batch 64,128
+#   python sweep.py ... --random 12 --lr 1e-4:3e-3        (lo:hi = log-uniform)
+#
+# 1. every distinct (tf, lookback, horizon) dataset is labelled once and
+#    saved as .npy under <out>/cache (reused while the CSVs are unchanged)
+# 2. trials run in a process pool sized to --cores / --threads; each opens
+#    the arrays with mmap_mode="r", so all trials share one page-cache copy
+# 3. median pruning: after --prune-warmup epochs a trial stops when its best
+#    val loss is worse than the median of other trials on the same dataset
+#    at that epoch
+# 4. <out>/sweep_results.csv ranks trials by best val loss within each
+#    dataset; the best trial of each dataset is exported like train_smc.py
+#    does into <out>/<tf>_lb<L>_h<H>/ (smc_<tf>.onnx, smc_<tf>_raw.onnx),
+#    with its params in sweep_best.json
+#
+# Val losses are only compared within one (tf, lookback, horizon): other
+# lookbacks/horizons give other labels and another validation split, so
+# their losses say nothing about each other (use backtest.py for that).
+# -------------------------
+PARAMS = {"lookback": int, "horizon": int, "lr": float, "batch": int}
+DEFAULTS = {"lookback": "60", "horizon": "24", "lr": "1e-3", "batch": "128"}
+RESULT_COLS = ["dataset", "rank", "tf", "id", "lookback", "horizon", "lr", "batch", "status",
+               "best_val", "best_epoch", "val_acc", "epochs_run", "seconds"]
+
+def parse_values(s, cast):
+    """'40,60,90' -> [40, 60, 90]; 'lo:hi' -> ('range', lo, hi) (random search only)."""
+    if ":" in s:
+        lo, hi = (cast(v) for v in s.split(":", 1))
+        return ("range", lo, hi)
+    return [cast(v) for v in s.split(",") if v.strip()]
+
+def make_trials(space, tfs, n_random=0, seed=7):
+    if n_random <= 0:
+        ranged = [k for k, v in space.items() if isinstance(v, tuple)]
+        if ranged:
+            raise SystemExit(f"lo:hi ranges need --random N: {', '.join(ranged)}")
+        combos = [dict(zip(space, vals)) for vals in itertools.product(*space.values())]
+    else:
+        rng = random.Random(seed)
+        combos = []
+        for _ in range(n_random):
+            c = {}
+            for k, v in space.items():
+                if isinstance(v, tuple):
+                    _, lo, hi = v
+                    if PARAMS[k] is float:
+                        c[k] = float(np.exp(rng.uniform(np.log(lo), np.log(hi))))
+                    else:
+                        c[k] = rng.randint(lo, hi)
+                else:
+                    c[k] = rng.choice(v)
+            combos.append(c)
+    return [dict(c, tf=tf) for tf in tfs for c in combos]
+
+# -------------------------
+# Shared datasets
+# -------------------------
+def dataset_key(t):
+    return (t["tf"], t["lookback"], t["horizon"])
+
+def dataset_name(key):
+    tf, lookback, horizon = key
+    return f"{tf}_lb{lookback}_h{horizon}"
+
+def dataset_dir(cache_dir, tf, lookback, horizon):
+    return os.path.join(cache_dir, dataset_name((tf, lookback, horizon)))
+
+def source_stamp(data_dir):
+    files = sorted(f for f in os.listdir(data_dir) if f.endswith(".csv"))
+    return {f: [os.path.getsize(os.path.join(data_dir, f)), int(os.path.getmtime(os.path.join(data_dir, f)))] for f in files}
+
+def build_cache(data_dir, cache_dir, tf, lookback, horizon):
+    """Label once, sorted by time (what train_one would do), saved as .npy."""
+    from train_smc import load_csvs, build_dataset
+    d = dataset_dir(cache_dir, tf, lookback, horizon)
+    meta_path = os.path.join(d, "meta.json")
+    stamp = source_stamp(data_dir)
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f).get("sources") == stamp:
+                return d, False
+
+    t0 = time.time()
+    all_df = load_csvs(data_dir)
+    df_tf = all_df[all_df["tf"].astype(str).str.lower() == tf]
+    X, y, ts = build_dataset(df_tf, tf, lookback=lookback, horizon=horizon)
+    order = np.argsort(ts)
+    os.makedirs(d, exist_ok=True)
+    np.save(os.path.join(d, "X.npy"), X[order])
+    np.save(os.path.join(d, "y.npy"), y[order])
+    np.save(os.path.join(d, "ts.npy"), ts[order])
+    with open(meta_path, "w") as f:
+        json.dump({"tf": tf, "lookback": lookback, "horizon": horizon, "samples": int(len(X)),
+                   "buy_pct": round(100.0 * float(y.mean()), 2), "seconds": round(time.time() - t0, 2),
+                   "sources": stamp}, f, indent=2)
+    return d, True
+
+def open_cache(d):
+    return tuple(np.load(os.path.join(d, f"{k}.npy"), mmap_mode="r") for k in ("X", "y", "ts"))
+
+# -------------------------
+# Trials (run in pool workers)
+# -------------------------
+_W = {}
+
+def _init_worker(threads, history, warmup, min_trials):
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    # torch.from_numpy on the read-only memmaps: fine, training never writes to X
+    warnings.filterwarnings("ignore", message="The given NumPy array is not writable")
+    _W.update(history=history, warmup=warmup, min_trials=min_trials)
+
+def should_prune(history, key, ep, best, warmup, min_trials):
+    """Median rule: best-so-far val loss vs the median of the best-so-far at ep of
+    other trials on the same dataset. key = (tf, lookback, horizon, trial id)."""
+    if ep < warmup:
+        return False
+    others = [v[ep - 1] for k, v in history.items() if k != key and k[:3] == key[:3] and len(v) >= ep]
+    return len(others) >= min_trials and best > float(np.median(others))
+
+def run_trial(trial):
+    from train_smc import train_one, set_seed
+    history = _W["history"]
+    key = dataset_key(trial) + (trial["id"],)
+    X, y, ts = open_cache(trial["data"])
+    state = {"best": float("inf"), "best_epoch": 0, "acc": float("nan"), "epochs": 0, "pruned": False}
+
+    def on_epoch(ep, tr_loss, va_loss, acc):
+        state["epochs"] = ep
+        if va_loss < state["best"]:
+            state.update(best=va_loss, best_epoch=ep, acc=acc)
+        history[key] = history.get(key, []) + [state["best"]]
+        state["pruned"] = should_prune(history, key, ep, state["best"], _W["warmup"], _W["min_trials"])
+        return state["pruned"]
+
+    set_seed(trial["seed"])
+    t0 = time.time()
+    try:
+        pt = train_one(f"{trial['tf']}_t{trial['id']:03d}", X, y, ts, out_dir=trial["dir"], epochs=trial["epochs"],
+                       batch=trial["batch"], lr=trial["lr"], seed=trial["seed"], on_epoch=on_epoch, export=False)
+        status = "pruned" if state["pruned"] else "done"
+    except Exception as e:
+        print(f"[sweep] trial {trial['id']} failed: {e}", flush=True)
+        pt, status = None, "failed"
+    return dict(trial, status=status, pt=pt, best_val=state["best"], best_epoch=state["best_epoch"],
+                val_acc=state["acc"], epochs_run=state["epochs"], seconds=round(time.time() - t0, 2))
+
+# -------------------------
+# Results
+# -------------------------
+def write_results(results, path):
+    rows = []
+    for key in sorted({dataset_key(r) for r in results}):
+        ranked = sorted((r for r in results if dataset_key(r) == key),
+                        key=lambda r: (r["status"] == "failed", r["best_val"]))
+        for i, r in enumerate(ranked, 1):
+            rows.append(dict(r, rank=i, dataset=dataset_name(key)))
+    import pandas as pd
+    df = pd.DataFrame(rows, columns=RESULT_COLS)
+    df.to_csv(path, index=False, float_format="%.6g")
+    return df
+
+def export_best(best, data_dir, out_dir, no_raw=False):
+    import torch
+    from train_smc import CandleCNN, load_csvs
+    from export_onnx import export_pipeline, export_with_preprocess, raw_windows
+    tf = best["tf"]
+    out_dir = os.path.join(out_dir, dataset_name(dataset_key(best)))
+    os.makedirs(out_dir, exist_ok=True)
+    model = CandleCNN(in_ch=5)
+    model.load_state_dict(torch.load(best["pt"], map_location="cpu"))
+    model.eval()
+    shutil.copyfile(best["pt"], os.path.join(out_dir, f"smc_{tf}.pt"))
+
+    X, _, _ = open_cache(best["data"])
+    Xva = np.array(X[int(len(X) * 0.8):][:2048])
+    export_pipeline(model, os.path.join(out_dir, f"smc_{tf}.onnx"), Xva)
+    if not no_raw:
+        df_tf = load_csvs(data_dir)
+        df_tf = df_tf[df_tf["tf"].astype(str).str.lower() == tf]
+        export_with_preprocess(model, os.path.join(out_dir, f"smc_{tf}_raw.onnx"), raw_windows(df_tf, best["lookback"]))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data-dir", required=True, help="folder containing CSV files")
+    ap.add_argument("--out-dir", required=True, help="results, cache, trial checkpoints and the best ONNX")
+    ap.add_argument("--tfs", default="15m,30m")
+    for k in PARAMS:
+        ap.add_argument(f"--{k}", default=DEFAULTS[k], help=f"comma list, or lo:hi with --random (default {DEFAULTS[k]})")
+    ap.add_argument("--random", type=int, default=0, help="sample N combinations instead of the full grid")
+    ap.add_argument("--epochs", type=int, default=25)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--cores", type=int, default=os.cpu_count() or 1, help="total CPU budget")
+    ap.add_argument("--threads", type=int, default=1, help="torch threads per trial (trials in parallel = cores // threads)")
+    ap.add_argument("--prune-warmup", type=int, default=3, help="never prune before this epoch")
+    ap.add_argument("--prune-min-trials", type=int, default=3, help="other trials needed at an epoch before pruning on it")
+    ap.add_argument("--no-prune", action="store_true")
+    ap.add_argument("--no-export", action="store_true", help="only write the ranked table")
+    ap.add_argument("--no-raw", action="store_true", help="skip the raw-OHLCV export of the best model")
+    args = ap.parse_args()
+
+    space = {k: parse_values(getattr(args, k), cast) for k, cast in PARAMS.items()}
+    tfs = [t.strip() for t in args.tfs.split(",") if t.strip()]
+    trials = make_trials(space, tfs, args.random, args.seed)
+    jobs = max(1, args.cores // max(1, args.threads))
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    cache_dir = os.path.join(args.out_dir, "cache")
+    trial_dir = os.path.join(args.out_dir, "trials")
+    os.makedirs(trial_dir, exist_ok=True)
+    print(f"[sweep] {len(trials)} trials over {', '.join(tfs)} | {jobs} parallel x {args.threads} thread(s)", flush=True)
+
+    ctx = mp.get_context("spawn")
+    with ctx.Manager() as manager:
+        history = manager.dict()
+        warmup = 10 ** 9 if args.no_prune else args.prune_warmup
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(args.threads, history, warmup, args.prune_min_trials)) as pool:
+            t0 = time.time()
+            keys = sorted({(t["tf"], t["lookback"], t["horizon"]) for t in trials})
+            futs = {pool.submit(build_cache, args.data_dir, cache_dir, *k): k for k in keys}
+            data = {}
+            for f in as_completed(futs):
+                data[futs[f]], built = f.result()
+                print(f"[sweep] dataset {futs[f]} {'built' if built else 'cached'}", flush=True)
+            print(f"[sweep] {len(keys)} datasets ready in {time.time() - t0:.1f}s", flush=True)
+
+            for i, t in enumerate(trials):
+                t.update(id=i, epochs=args.epochs, seed=args.seed, dir=trial_dir,
+                         data=data[(t["tf"], t["lookback"], t["horizon"])])
+            results = []
+            for f in as_completed([pool.submit(run_trial, t) for t in trials]):
+                r = f.result()
+                results.append(r)
+                print(f"[sweep] trial {r['id']:03d} {r['tf']} lb={r['lookback']} h={r['horizon']} lr={r['lr']:.2e} "
+                      f"batch={r['batch']}: {r['status']} best_val {r['best_val']:.4f} @ep {r['best_epoch']} "
+                      f"({r['epochs_run']} ep, {r['seconds']:.0f}s) [{len(results)}/{len(trials)}]", flush=True)
+
+    df = write_results(results, os.path.join(args.out_dir, "sweep_results.csv"))
+    print(f"\n✅ Saved results: {os.path.join(args.out_dir, 'sweep_results.csv')} ({time.time() - t0:.0f}s total)")
+    print(df[df["rank"] <= 5].to_string(index=False))
+
+    # one winner per dataset: val losses of different datasets are not comparable
+    best = {}
+    for key in keys:
+        ok = [r for r in results if dataset_key(r) == key and r["status"] != "failed" and np.isfinite(r["best_val"])]
+        if ok:
+            best[dataset_name(key)] = min(ok, key=lambda r: r["best_val"])
+    with open(os.path.join(args.out_dir, "sweep_best.json"), "w") as f:
+        json.dump({name: {k: b[k] for k in ("tf", "id", "lookback", "horizon", "lr", "batch", "best_val", "best_epoch", "val_acc")
+                          if k in b} for name, b in best.items()}, f, indent=2)
+    if not args.no_export:
+        for name, b in best.items():
+            print(f"\n[sweep] exporting best of {name}: trial {b['id']:03d} (val {b['best_val']:.4f})")
+            export_best(b, args.data_dir, args.out_dir, no_raw=args.no_raw)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,8 @@ import torch
 import torch.nn as nn
 from torch.utils.data import Dataset, DataLoader
 
+from export_onnx import export_pipeline, export_with_preprocess, raw_windows
+
 # -------------------------
 # Utils
 # -------------------------
@@ -156,10 +158,17 @@ class NpDataset(Dataset):
     def __getitem__(self, idx):
         return self.X[idx], self.y[idx]
 
-def train_one(tf_name, X, y, ts, out_dir, epochs=25, batch=128, lr=1e-3, seed=7):
-    # time split (no leakage)
-    order = np.argsort(ts)
-    X, y = X[order], y[order]
+def train_one(tf_name, X, y, ts, out_dir, epochs=25, batch=128, lr=1e-3, seed=7, dynamic_time=False, X_raw=None,
+              on_epoch=None, export=True):
+    """
+    on_epoch(ep, tr_loss, va_loss, val_acc) is called after every epoch; a truthy
+    return stops training early (sweep.py uses it for pruning).
+    export=False skips the ONNX export and returns the best .pt path instead.
+    """
+    # time split (no leakage); already-sorted inputs (e.g. read-only memmaps) are not copied
+    if len(ts) > 1 and not np.all(ts[1:] >= ts[:-1]):
+        order = np.argsort(ts)
+        X, y = X[order], y[order]
 
     n = len(X)
     if n < 200:
@@ -216,25 +225,26 @@ def train_one(tf_name, X, y, ts, out_dir, epochs=25, batch=128, lr=1e-3, seed=7)
             best_val = va_loss
             torch.save(model.state_dict(), best_path)
 
+        if on_epoch is not None and on_epoch(ep, tr_loss, va_loss, acc):
+            print(f"[{tf_name}] stopped after ep {ep:02d}")
+            break
+
+    if not export:
+        return best_path
+
     # load best and export ONNX
     model.load_state_dict(torch.load(best_path, map_location="cpu"))
     model.eval()
 
     onnx_path = os.path.join(out_dir, f"smc_{tf_name}.onnx")
-    dummy = torch.randn(1, 60, 5, dtype=torch.float32)
-
-    torch.onnx.export(
-        model,
-        dummy,
-        onnx_path,
-        input_names=["x"],
-        output_names=["logits"],
-        opset_version=18,
-        do_constant_folding=True,
-        dynamo=False,
-    )
-
-    print(f"âœ… Saved ONNX: {onnx_path}")
+    # dynamic batch (+ optional time) axis, ORT offline optimization, parity on the
+    # validation windows and a latency sweep -> smc_<tf>.onnx.json
+    export_pipeline(model, onnx_path, Xva[:2048], dynamic_time=dynamic_time)
+    if X_raw is not None:
+        # same network with build_feature_window inside the graph -> smc_<tf>_raw.onnx, tagged
+        # raw_ohlcv; predict_server runs it on the windows it fetches and on clients' raw_ohlcv ones
+        export_with_preprocess(model, os.path.join(out_dir, f"smc_{tf_name}_raw.onnx"), X_raw,
+                               dynamic_time=dynamic_time)
     return onnx_path
 
 def load_csvs(data_dir):
@@ -250,6 +260,21 @@ def load_csvs(data_dir):
         dfs.append(df)
     return pd.concat(dfs, ignore_index=True)
 
+def build_dataset(df_tf, tf_name, lookback=60, horizon=24):
+    """simulate_label per symbol (labels never cross symbols), concatenated."""
+    Xs, ys, tss = [], [], []
+    for sym in sorted(df_tf["symbol"].unique()):
+        df_sym = df_tf[df_tf["symbol"] == sym]
+        X, y, ts = simulate_label(df_sym, lookback=lookback, horizon=horizon)
+        print(f"{tf_name} {sym}: samples={len(X)}")
+        if len(X) > 0:
+            Xs.append(X); ys.append(y); tss.append(ts)
+
+    if not Xs:
+        raise RuntimeError(f"No training samples built for {tf_name}")
+
+    return np.concatenate(Xs, axis=0), np.concatenate(ys, axis=0), np.concatenate(tss, axis=0)
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--data-dir", required=True, help="folder containing CSV files")
@@ -260,6 +285,8 @@ def main():
     ap.add_argument("--lookback", type=int, default=60)
     ap.add_argument("--horizon", type=int, default=24)
     ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--dynamic-time", action="store_true", help="export ONNX with a dynamic time axis too")
+    ap.add_argument("--no-raw", action="store_true", help="skip the raw-OHLCV export (normalization folded into the graph)")
     args = ap.parse_args()
 
     set_seed(args.seed)
@@ -275,23 +302,11 @@ def main():
             continue
 
         # combine symbols but keep ordering per symbol (we label per symbol)
-        Xs, ys, tss = [], [], []
-        for sym in sorted(df_tf["symbol"].unique()):
-            df_sym = df_tf[df_tf["symbol"] == sym]
-            X, y, ts = simulate_label(df_sym, lookback=args.lookback, horizon=args.horizon)
-            print(f"{tf_name} {sym}: samples={len(X)}")
-            if len(X) > 0:
-                Xs.append(X); ys.append(y); tss.append(ts)
-
-        if not Xs:
-            raise RuntimeError(f"No training samples built for {tf_name}")
-
-        X = np.concatenate(Xs, axis=0)
-        y = np.concatenate(ys, axis=0)
-        ts = np.concatenate(tss, axis=0)
+        X, y, ts = build_dataset(df_tf, tf_name, lookback=args.lookback, horizon=args.horizon)
 
         print(f"\nTF {tf_name}: total samples={len(X)} | BUY%={100.0*y.mean():.1f}%\n")
-        train_one(tf_name, X, y, ts, out_dir=args.out_dir, epochs=args.epochs, batch=args.batch, lr=args.lr, seed=args.seed)
+        X_raw = None if args.no_raw else raw_windows(df_tf, args.lookback)
+        train_one(tf_name, X, y, ts, out_dir=args.out_dir, epochs=args.epochs, batch=args.batch, lr=args.lr, seed=args.seed, dynamic_time=args.dynamic_time, X_raw=X_raw)
 
 if __name__ == "__main__":
     main()